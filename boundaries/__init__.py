@@ -8,6 +8,7 @@ from django.utils.translation import gettext as _
 log = logging.getLogger(__name__)
 registry = {}
 _basepath = '.'
+_definition_file = None
 
 
 def register(slug, **kwargs):
@@ -16,6 +17,8 @@ def register(slug, **kwargs):
     command. Called by definition files.
     """
     kwargs['file'] = os.path.join(_basepath, kwargs.get('file', ''))
+    if _definition_file:
+        kwargs['definition_file'] = _definition_file  # to fingerprint the definition
     if slug in registry:
         log.warning(_('Multiple definitions of %(slug)s found.') % {'slug': slug})
     registry[slug] = kwargs
@@ -29,12 +32,14 @@ def autodiscover(base_dir):
     Walks the directory tree, loading definition files. Definition files are any
     files ending in "definition.py" or "definitions.py".
     """
-    global _basepath
+    global _basepath, _definition_file
     for (dirpath, dirnames, filenames) in os.walk(base_dir, followlinks=True):
         _basepath = dirpath
         for filename in filenames:
             if definition_file_re.search(filename):
-                import_file(os.path.join(dirpath, filename))
+                _definition_file = os.path.join(dirpath, filename)
+                import_file(_definition_file)
+    _definition_file = None
 
 
 def attr(name):
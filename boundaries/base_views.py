@@ -164,11 +164,19 @@ class ModelGeoListView(ModelListView):
     of the geometry field to filter on.
 
     To access a geospatial field, the field name must be provided
-    by the URLconf in the 'geo_field' keyword argument."""
+    by the URLconf in the 'geo_field' keyword argument.
+
+    To serve a geospatial field from another field or an annotation,
+    override the get_geo_field method."""
 
     name_field = 'name'
     default_geo_filter_field = None
 
+    def get_geo_field(self, request, qs, field):
+        """Returns the queryset and the name of the field or annotation
+        from which to read the requested geospatial field."""
+        return qs, field
+
     def filter(self, request, qs):
         qs = super().filter(request, qs)
 
@@ -215,22 +223,23 @@ class ModelGeoListView(ModelListView):
                     "this query would return %(actual)s. Please filter your query."
                 ) % {'expected': app_settings.MAX_GEO_LIST_RESULTS, 'actual': qs.count()})
 
+        qs, source = self.get_geo_field(request, qs, field)
         format = request.GET.get('format', 'json')
 
         if format in ('json', 'apibrowser'):
             strings = ['{"objects": [']
             strings.append(','.join(
                 f'{{"name": "{escapejs(x[1])}", "{field}": {x[0].geojson}}}'
-                for x in qs.values_list(field, self.name_field))
+                for x in qs.values_list(source, self.name_field))
             )
             strings.append(']}')
             return RawJSONResponse(''.join(strings))
         elif format == 'wkt':
             return HttpResponse(
-                "\n".join(geom.wkt for geom in qs.values_list(field, flat=True)), content_type="text/plain"
+                "\n".join(geom.wkt for geom in qs.values_list(source, flat=True)), content_type="text/plain"
             )
         elif format == 'kml':
-            placemarks = [kml.generate_placemark(x[1], x[0]) for x in qs.values_list(field, self.name_field)]
+            placemarks = [kml.generate_placemark(x[1], x[0]) for x in qs.values_list(source, self.name_field)]
             resp = HttpResponse(
                 kml.generate_kml_document(placemarks),
                 content_type="application/vnd.google-earth.kml+xml")
@@ -271,10 +280,18 @@ class ModelGeoDetailView(ModelDetailView):
     of geospatial field names which we're allowed to provide.
 
     To access a geospatial field, the field name must be provided
-    by the URLconf in the 'geo_field' keyword argument."""
+    by the URLconf in the 'geo_field' keyword argument.
+
+    To serve a geospatial field from another field or an annotation,
+    override the get_geo_field method."""
 
     name_field = 'name'
 
+    def get_geo_field(self, request, qs, field):
+        """Returns the queryset and the name of the field or annotation
+        from which to read the requested geospatial field."""
+        return qs.only(field, self.name_field), field
+
     def get(self, request, **kwargs):
         if 'geo_field' not in kwargs:
             # If it's not a geo request, let ModelDetailView handle it.
@@ -284,12 +301,13 @@ class ModelGeoDetailView(ModelDetailView):
         if field not in self.allowed_geo_fields:
             raise Http404
 
+        qs, source = self.get_geo_field(request, self.base_qs, field)
         try:
-            obj = self.get_object(request, self.base_qs.only(field, self.name_field), **kwargs)
+            obj = self.get_object(request, qs, **kwargs)
         except ObjectDoesNotExist:
             raise Http404
 
-        geom = getattr(obj, field)
+        geom = getattr(obj, source)
         name = getattr(obj, self.name_field)
         format = request.GET.get('format', 'json')
         if format in ('json', 'apibrowser'):
@@ -0,0 +1,165 @@
+"""
+Reorders a boundary set's rows along a Hilbert curve, so that spatially close
+boundaries are stored in the same or nearby pages, and a spatial lookup reads
+fewer pages. Requires PostgreSQL.
+"""
+import json
+import statistics
+
+from django.db import connection, transaction
+
+from boundaries import partitioning
+from boundaries.models import Boundary, BoundaryGeometry
+
+# The number of bits per axis of the grid on which boundaries are ordered.
+HILBERT_ORDER = 16
+
+
+def hilbert_index(x, y, order=HILBERT_ORDER):
+    """
+    Returns the position of the cell (x, y) along a Hilbert curve that covers a
+    grid of 2**order by 2**order cells.
+    """
+    n = 1 << order
+    index = 0
+    s = n >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        index += s * s * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return index
+
+
+def hilbert_sort(items, order=HILBERT_ORDER):
+    """
+    Returns the keys of the (key, extent) items, ordered by the positions of
+    the centers of their extents along a Hilbert curve that covers the union of
+    their extents. Items without extents are last.
+    """
+    extents = [extent for key, extent in items if extent]
+    if not extents:
+        return [key for key, extent in items]
+
+    xmin = min(extent[0] for extent in extents)
+    ymin = min(extent[1] for extent in extents)
+    width = max(extent[2] for extent in extents) - xmin or 1
+    height = max(extent[3] for extent in extents) - ymin or 1
+    cells = (1 << order) - 1
+
+    def position(item):
+        extent = item[1]
+        if not extent:
+            return float('inf')
+        x = ((extent[0] + extent[2]) / 2 - xmin) / width
+        y = ((extent[1] + extent[3]) / 2 - ymin) / height
+        return hilbert_index(round(x * cells), round(y * cells), order)
+
+    return [key for key, extent in sorted(items, key=position)]
+
+
+def cluster_boundary_set(boundary_set):
+    """
+    Rewrites the boundary set's boundaries in Hilbert order, keeping their
+    primary keys, and returns the number of boundaries.
+
+    If the boundaries table is partitioned, the boundaries are copied in order
+    to a new table, which replaces the boundary set's partition. Otherwise, they
+    are deleted and inserted again in order at the end of the table, and the
+    table must be vacuumed to reuse the deleted rows' space; `VACUUM FULL` also
+    compacts the table, keeping the order. Either way, the order holds until the
+    rows are updated.
+
+    The boundaries' shapes in the BoundaryGeometry table, if any, are rewritten
+    in the same order.
+    """
+    pks = hilbert_sort(list(Boundary.objects.filter(set=boundary_set).values_list('pk', 'extent')))
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(Boundary._meta.db_table)
+    pk, set_id = (quote_name(Boundary._meta.get_field(name).column) for name in ('id', 'set'))
+    columns = [quote_name(field.column) for field in Boundary._meta.concrete_fields]
+    select = ', '.join(f'b.{column}' for column in columns)
+    source = (
+        f'FROM {table} b JOIN unnest(%s::integer[]) WITH ORDINALITY AS o(id, position) ON b.{pk} = o.id '
+        f'WHERE b.{set_id} = %s'
+    )
+    columns = ', '.join(columns)
+
+    if partitioning.is_partitioned():
+        name = partitioning.partition_name(boundary_set.slug) + '_new'
+        with transaction.atomic():
+            partitioning.create_table(name)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {quote_name(name)} ({columns}) SELECT {select} {source} ORDER BY o.position',
+                    [pks, boundary_set.slug],
+                )
+                cluster_geometries(cursor, pks)
+            partitioning.add_check(name, boundary_set.slug)
+            partitioning.replace_partition(boundary_set, name, delete_related=False)
+        return len(pks)
+
+    # The foreign keys to boundaries are checked at commit, by which time the
+    # boundaries are inserted again.
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE boundaries_clustered ON COMMIT DROP AS '
+            f'SELECT {select}, o.position AS clustered_position {source}',
+            [pks, boundary_set.slug],
+        )
+        cursor.execute(f'DELETE FROM {table} WHERE {set_id} = %s', [boundary_set.slug])
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM boundaries_clustered ORDER BY clustered_position'
+        )
+        cluster_geometries(cursor, pks)
+
+    return len(pks)
+
+
+def cluster_geometries(cursor, pks):
+    """
+    Rewrites the BoundaryGeometry rows of the boundaries in the order of their
+    primary keys.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(BoundaryGeometry._meta.db_table)
+    boundary_id = quote_name(BoundaryGeometry._meta.get_field('boundary').column)
+    columns = ', '.join(quote_name(field.column) for field in BoundaryGeometry._meta.concrete_fields)
+    cursor.execute(
+        f'CREATE TEMPORARY TABLE geometries_clustered ON COMMIT DROP AS '
+        f'SELECT g.*, o.position AS clustered_position FROM {table} g '
+        f'JOIN unnest(%s::integer[]) WITH ORDINALITY AS o(id, position) ON g.{boundary_id} = o.id',
+        [pks],
+    )
+    cursor.execute(f'DELETE FROM {table} WHERE {boundary_id} = ANY(%s::integer[])', [pks])
+    cursor.execute(
+        f'INSERT INTO {table} ({columns}) SELECT {columns} FROM geometries_clustered ORDER BY clustered_position'
+    )
+
+
+def benchmark(boundary_set, points):
+    """
+    Looks up the boundaries of the set that contain each point, as the
+    `contains` filter does, and returns the median execution time in
+    milliseconds, and the numbers of buffers hit and read, of all lookups.
+    """
+    times = []
+    hit = read = 0
+    for point in points:
+        queryset = Boundary.objects.filter(set=boundary_set, **{Boundary.get_shape_field() + '__contains': point})
+        queryset = queryset.values_list('pk')
+        plan = json.loads(queryset.explain(format='json', analyze=True, buffers=True))[0]
+        times.append(plan['Execution Time'])
+        hit += plan['Plan'].get('Shared Hit Blocks', 0)
+        read += plan['Plan'].get('Shared Read Blocks', 0)
+    return {
+        'time': statistics.median(times) if times else 0,
+        'hit': hit,
+        'read': read,
+    }
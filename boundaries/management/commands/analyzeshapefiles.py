@@ -2,12 +2,13 @@ import logging
 from collections import OrderedDict
 from shutil import rmtree
 
+from django.contrib.gis.gdal import SpatialReference
 from django.core.management.base import BaseCommand
 from django.utils.translation import gettext as _
 
 import boundaries
-from boundaries.management.commands.loadshapefiles import create_data_sources
-from boundaries.models import Definition, Feature, app_settings, slugify
+from boundaries.management.commands.loadshapefiles import create_data_sources, filter_layer
+from boundaries.models import CompiledDefinition, Definition, Feature, app_settings, slugify
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +25,13 @@ class Command(BaseCommand):
             default=app_settings.SHAPEFILES_DIR,
             help=_('Load shapefiles from this directory.'),
         )
+        parser.add_argument(
+            '--vsizip',
+            action='store_true',
+            dest='vsizip',
+            default=False,
+            help=_("Read ZIP files in place with GDAL's /vsizip/, instead of decompressing them."),
+        )
 
     def handle(self, *args, **options):
         boundaries.autodiscover(options['data_dir'])
@@ -38,7 +46,11 @@ class Command(BaseCommand):
             definition.setdefault('name', name)
             definition = Definition(definition)
 
-            data_sources, tmpdirs = create_data_sources(definition['file'], encoding=definition['encoding'])
+            data_sources, tmpdirs = create_data_sources(
+                definition['file'],
+                encoding=definition['encoding'],
+                vsizip=options['vsizip'],
+            )
 
             try:
                 if not data_sources:
@@ -50,8 +62,15 @@ class Command(BaseCommand):
                         features[slug] = []
 
                         layer = data_source[0]
+                        if definition.get('srid'):
+                            srs = SpatialReference(definition['srid'])
+                        else:
+                            srs = layer.srs
+                        filter_layer(layer, definition, srs)
+
+                        compiled = CompiledDefinition(definition, layer.fields)
                         for feature in layer:
-                            feature = Feature(feature, definition)
+                            feature = Feature(feature, compiled)
                             if feature.is_valid():
                                 features[slug].append((feature.id, feature.name))
 
@@ -0,0 +1,70 @@
+import logging
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.translation import gettext as _
+
+from boundaries import partitioning
+from boundaries.clustering import benchmark, cluster_boundary_set
+from boundaries.models import Boundary, BoundarySet
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = _('Reorder the rows of boundary sets along a Hilbert curve, so that nearby boundaries share pages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', nargs='*', help=_('The slugs of the boundary sets to reorder. Defaults to all.'))
+        parser.add_argument(
+            '-b',
+            '--benchmark',
+            action='store',
+            dest='benchmark',
+            type=int,
+            default=0,
+            help=_(
+                "Before and after reordering, look up this many boundaries' centroids with EXPLAIN (ANALYZE, "
+                'BUFFERS), and report the median execution time and the numbers of buffers hit and read.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(_('clusterboundaries requires PostgreSQL.'))
+
+        boundary_sets = BoundarySet.objects.order_by('slug')
+        if options['slug']:
+            boundary_sets = boundary_sets.filter(slug__in=options['slug'])
+
+        partitioned = partitioning.is_partitioned()
+        quote_name = connection.ops.quote_name
+
+        points = {}  # with --benchmark
+        for boundary_set in boundary_sets:
+            if options['benchmark']:
+                queryset = Boundary.objects.filter(set=boundary_set, centroid__isnull=False)
+                centroids = list(queryset.values_list('centroid', flat=True))
+                points[boundary_set] = random.Random(0).choices(centroids, k=options['benchmark']) if centroids else []
+                self.report(boundary_set, _('before'), benchmark(boundary_set, points[boundary_set]))
+
+            count = cluster_boundary_set(boundary_set)
+            # A boundary set's new partition has no statistics.
+            if partitioned:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {quote_name(partitioning.partition_name(boundary_set.slug))}')
+            log.info(_('%(slug)s: reordered %(count)i boundaries.') % {'slug': boundary_set.slug, 'count': count})
+
+        if not partitioned:
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {quote_name(Boundary._meta.db_table)}')
+
+        for boundary_set, set_points in points.items():
+            self.report(boundary_set, _('after'), benchmark(boundary_set, set_points))
+
+    def report(self, boundary_set, label, result):
+        self.stdout.write(
+            _('%(slug)s (%(label)s): median %(time).3f ms, %(hit)i buffers hit, %(read)i buffers read')
+            % dict(result, slug=boundary_set.slug, label=label)
+        )
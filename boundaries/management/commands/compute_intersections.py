@@ -4,7 +4,7 @@ import sys
 from django.core.management.base import BaseCommand
 from django.utils.translation import gettext as _
 
-from boundaries.models import BoundarySet
+from boundaries.models import Boundary, BoundarySet
 
 
 class Command(BaseCommand):
@@ -43,15 +43,17 @@ class Command(BaseCommand):
 
         # For each boundary in the first set...
         for a_slug in bset_a.boundaries.order_by("slug").values_list('slug', flat=True):
-            a_bdry = bset_a.boundaries.get(slug=a_slug)
-            a_area = a_bdry.shape.area
+            a_bdry = bset_a.boundaries.select_related('geometry', 'stored_shape').get(slug=a_slug)
+            a_shape = a_bdry.get_shape()
+            a_area = a_shape.area
 
             # Find each intersecting boundary in the second set...
-            for b_bdry in bset_b.boundaries\
-                    .filter(shape__intersects=a_bdry.shape):
+            for b_bdry in bset_b.boundaries.select_related('geometry', 'stored_shape')\
+                    .filter(**{Boundary.get_shape_field() + '__intersects': a_shape}):
+                b_shape = b_bdry.get_shape()
 
                 try:
-                    geometry = a_bdry.shape.intersection(b_bdry.shape)
+                    geometry = a_shape.intersection(b_shape)
                 except Exception as e:
                     sys.stderr.write(f"{a_slug}/{b_bdry.slug}: {e}\n")
                     continue
@@ -60,7 +62,7 @@ class Command(BaseCommand):
                 if geometry.empty:
                     continue
 
-                b_area = b_bdry.shape.area
+                b_area = b_shape.area
 
                 # Skip overlaps that are less than .1% of the area of either of the shapes.
                 # These are probably not true overlaps.
@@ -1,27 +1,98 @@
+import hashlib
+import io
+import json
 import logging
+import multiprocessing
 import os
 import os.path
-import subprocess
-from contextlib import closing
+import struct
+import sys
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing, contextmanager, nullcontext
+from ctypes import c_char_p, c_void_p
+from datetime import date
+from functools import partial
+from itertools import islice
 from shutil import rmtree
 from tempfile import mkdtemp
 from zipfile import ZipFile
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 from django.conf import settings
-from django.contrib.gis.gdal import DataSource, SpatialReference
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.contrib.gis.gdal import DataSource, GDALException, OGRGeometry, SpatialReference
+from django.contrib.gis.gdal.libgdal import lgdal
+from django.contrib.gis.gdal.prototypes.generation import void_output
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
 from django.utils.translation import gettext as _
 
 import boundaries
-from boundaries.models import Boundary, BoundarySet, Definition, Feature, app_settings, slugify
+from boundaries import partitioning, reproject, storage, topology
+from boundaries.clustering import cluster_boundary_set, hilbert_sort
+from boundaries.models import (
+    Boundary,
+    BoundaryGeometry,
+    BoundarySet,
+    CompiledDefinition,
+    Definition,
+    Feature,
+    Geometry,
+    LoadCheckpoint,
+    SimplifiedShape,
+    StagedBoundary,
+    StoredShape,
+    app_settings,
+    slugify,
+    wgs84,
+)
+from boundaries.reproject import transform_features
 
 log = logging.getLogger(__name__)
 
+# The extensions of the files that make up a boundary set's source.
+SOURCE_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.zip')
+
+# The batch size for --copy, if --batch-size isn't set.
+COPY_BATCH_SIZE = 1000
+
+# The batch size for --stream, if --batch-size isn't set.
+STREAM_BATCH_SIZE = 1000
+
+# The fields whose indexes --defer-indexes builds after copying a boundary set into its new partition.
+DEFERRED_INDEX_FIELDS = ('shape', 'simple_shape', 'centroid', 'slug', 'name')
+
+# The command, definitions and options inherited by the processes of --jobs.
+_worker_state = None
+
+# The number of features per task sent to the processes of --workers.
+PIPELINE_CHUNK_SIZE = 100
+
+# The definition and options inherited by the processes of --workers.
+_pipeline_state = None
+
+# The parent's database connections, inherited by the processes of --workers, which mustn't close them.
+_inherited_connections = []
+
+# The number of points per edge of a definition's spatial filter, when transforming it.
+SPATIAL_FILTER_STEPS = 16
+
+set_attribute_filter = void_output(lgdal.OGR_L_SetAttributeFilter, [c_void_p, c_char_p])
+
 
 class Command(BaseCommand):
     help = _('Import boundaries described by shapefiles.')
 
+    profiler = None
+    # With --jobs, the hashes of the stored shapes to prune once all boundary sets are loaded.
+    deferred_hashes = None
+
     def add_arguments(self, parser):
         parser.add_argument(
             '-r',
@@ -61,7 +132,14 @@ class Command(BaseCommand):
             action='store_true',
             dest='clean',
             default=False,
-            help=_('Clean shapefiles first with ogr2ogr.'),
+            help=_('Drop Z coordinates and keep only the polygons of geometry collections.'),
+        )
+        parser.add_argument(
+            '--vsizip',
+            action='store_true',
+            dest='vsizip',
+            default=False,
+            help=_("Read ZIP files in place with GDAL's /vsizip/, instead of decompressing them."),
         )
         parser.add_argument(
             '-m',
@@ -74,6 +152,148 @@ class Command(BaseCommand):
                 'either "combine" (extend the MultiPolygon) or "union" (union the geometries).'
             ),
         )
+        parser.add_argument(
+            '-g',
+            '--group',
+            action='store_true',
+            dest='group',
+            default=False,
+            help=_(
+                'With --merge, group features by slug in memory, and merge each group once, '
+                'instead of merging each feature into the saved boundary.'
+            ),
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            action='store',
+            dest='batch_size',
+            type=int,
+            default=0,
+            help=_('Insert boundaries in batches of this size, instead of one at a time.'),
+        )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            action='store',
+            dest='jobs',
+            type=int,
+            default=1,
+            help=_('Load this many boundary sets at a time, each in its own process.'),
+        )
+        parser.add_argument(
+            '-w',
+            '--workers',
+            action='store',
+            dest='workers',
+            type=int,
+            default=1,
+            help=_("Prepare each boundary set's features in a pool of this many processes."),
+        )
+        parser.add_argument(
+            '--chunk-size',
+            action='store',
+            dest='chunk_size',
+            type=int,
+            default=0,
+            help=_('Reproject features in chunks of this size with NumPy, instead of one at a time.'),
+        )
+        parser.add_argument(
+            '-i',
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help=_(
+                'Only insert, update or delete the boundaries that changed, instead of deleting and recreating '
+                'the boundary set.'
+            ),
+        )
+        parser.add_argument(
+            '--changed-only',
+            action='store_true',
+            dest='changed_only',
+            default=False,
+            help=_(
+                "Only load boundary sets whose source files or definition file changed since they were last loaded, "
+                "regardless of their last updated date."
+            ),
+        )
+        parser.add_argument(
+            '--profile',
+            action='store',
+            dest='profile',
+            default='',
+            help=_(
+                'Write a JSON report of the wall time, CPU time, feature and vertex counts and peak memory of each '
+                'boundary set and data source, and the time spent in each phase of loading, to this path.'
+            ),
+        )
+        parser.add_argument(
+            '--derive',
+            action='store_true',
+            dest='derive',
+            default=False,
+            help=_(
+                "Compute boundaries' simplified shapes, centroids and extents, and boundary sets' extents, in PostGIS "
+                "after inserting the boundaries, instead of in Python."
+            ),
+        )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            dest='stream',
+            default=False,
+            help=_(
+                'Write boundaries to a staging table in committed batches, recording a checkpoint after each batch, '
+                'and replace the boundary set only once all batches are written.'
+            ),
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help=_("With --stream, continue each boundary set's load from its last checkpoint, if any."),
+        )
+        parser.add_argument(
+            '--swap',
+            action='store_true',
+            dest='swap',
+            default=False,
+            help=_(
+                'Load boundaries through the staging table as with --stream, compute their derived fields there, '
+                "then replace the boundary set's partition in one short transaction. Requires partitionboundaries."
+            ),
+        )
+        parser.add_argument(
+            '--defer-indexes',
+            action='store_true',
+            dest='defer_indexes',
+            default=False,
+            help=_(
+                "On a partitioned boundaries table, build the new partition's indexes on shapes, simplified shapes, "
+                'centroids, slugs and names after copying the staged boundaries into it, instead of updating them '
+                'for each boundary.'
+            ),
+        )
+        parser.add_argument(
+            '--cluster',
+            action='store_true',
+            dest='cluster',
+            default=False,
+            help=_(
+                "Reorder each boundary set's rows along a Hilbert curve after loading, so that nearby boundaries "
+                'share pages.'
+            ),
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            dest='copy',
+            default=False,
+            help=_('Insert boundaries with PostgreSQL COPY in binary format, instead of INSERT.'),
+        )
 
     def get_version(self):
         return '0.10.2'
@@ -84,6 +304,52 @@ class Command(BaseCommand):
             if input().lower() != 'y':
                 return
 
+        if options['chunk_size'] and not reproject.available():
+            raise CommandError(_('--chunk-size requires NumPy.'))
+        if options['group'] and not options['merge']:
+            raise CommandError(_('--group requires --merge.'))
+        # Without --group, each feature is merged into the saved boundary with the same slug.
+        if options['batch_size'] and options['merge'] and not options['group']:
+            raise CommandError(_('--batch-size cannot be combined with --merge.'))
+        if options['copy'] and options['merge'] and not options['group']:
+            raise CommandError(_('--copy cannot be combined with --merge.'))
+        if options['workers'] > 1 and options['merge']:
+            raise CommandError(_('--workers cannot be combined with --merge.'))
+        if options['incremental'] and options['merge'] and not options['group']:
+            raise CommandError(_('--incremental cannot be combined with --merge.'))
+        if options['derive'] and options['merge'] and not options['group']:
+            raise CommandError(_('--derive cannot be combined with --merge.'))
+        if options['derive'] and connection.vendor != 'postgresql':
+            raise CommandError(_('--derive requires PostGIS.'))
+        # Indexes are deferred only when a boundary set's partition is swapped.
+        for option in ('merge', 'incremental', 'copy'):
+            if options['defer_indexes'] and options[option]:
+                raise CommandError(_('--defer-indexes cannot be combined with --%(option)s.') % {'option': option})
+        if options['defer_indexes'] and options['workers'] > 1:
+            raise CommandError(_('--defer-indexes cannot be combined with --workers.'))
+        if options['defer_indexes'] and not partitioning.is_partitioned():
+            raise CommandError(
+                _('--defer-indexes requires a partitioned boundaries table. Run partitionboundaries first.')
+            )
+        if options['cluster'] and connection.vendor != 'postgresql':
+            raise CommandError(_('--cluster requires PostgreSQL.'))
+        if options['resume'] and not options['stream']:
+            raise CommandError(_('--resume requires --stream.'))
+        # Streaming writes each batch of boundaries as it is prepared, in one process.
+        for staged in ('stream', 'swap'):
+            for option in ('merge', 'incremental', 'copy'):
+                if options[staged] and options[option]:
+                    raise CommandError(
+                        _('--%(staged)s cannot be combined with --%(option)s.') % {'staged': staged, 'option': option}
+                    )
+            if options[staged] and options['workers'] > 1:
+                raise CommandError(_('--%(staged)s cannot be combined with --workers.') % {'staged': staged})
+        # Without partitions, replacing a boundary set's rows would take as long as loading them.
+        if options['swap'] and not partitioning.is_partitioned():
+            raise CommandError(_('--swap requires a partitioned boundaries table. Run partitionboundaries first.'))
+
+        self.profiler = Profiler(enabled=bool(options['profile']))
+
         boundaries.autodiscover(options['data_dir'])
 
         if options['only']:
@@ -95,40 +361,153 @@ class Command(BaseCommand):
         else:
             blacklist = set()
 
-        for slug, definition in boundaries.registry.items():
-            name = slug
-            slug = slugify(slug)
+        pending = []
+
+        try:
+            for slug, definition in boundaries.registry.items():
+                name = slug
+                slug = slugify(slug)
+
+                if options['changed_only']:
+                    changed = partial(fingerprint, definition)
+                else:
+                    changed = None
+
+                if self.loadable(slug, definition['last_updated'], whitelist, blacklist, options['reload'], changed):
+                    # Backwards-compatibility with having the name, instead of the slug,
+                    # as the first argument to `boundaries.register`.
+                    definition.setdefault('name', name)
+                    definition = Definition(definition)
+
+                    if options['jobs'] > 1:
+                        pending.append((slug, definition))
+                    else:
+                        self.load_set(slug, definition, options)
+                else:
+                    log.debug(_('Skipping %(slug)s.') % {'slug': slug})
+
+            if pending:
+                self.load_sets_in_parallel(pending, options)
+        finally:
+            if options['profile']:
+                self.profiler.write(options['profile'])
+
+    def load_set(self, slug, definition, options):
+        log.info(_('Processing %(slug)s.') % {'slug': slug})
 
-            if self.loadable(slug, definition['last_updated'], whitelist, blacklist, options['reload']):
-                log.info(_('Processing %(slug)s.') % {'slug': slug})
+        # The numbers of vertices and WKB bytes saved by snapping to the definition's precision.
+        self.snapped = [0, 0]
 
-                # Backwards-compatibility with having the name, instead of the slug,
-                # as the first argument to `boundaries.register`.
-                definition.setdefault('name', name)
-                definition = Definition(definition)
+        # Hashing the source files is only needed to compare them with --changed-only and --resume, but the
+        # fingerprint is recorded on the boundary set and on --stream's checkpoints for later runs to compare.
+        if options['changed_only'] or options['stream']:
+            fingerprint(definition.dictionary)
 
+        with self.profiler.boundary_set(slug):
+            with self.profiler.phase('open'):
                 data_sources, tmpdirs = create_data_sources(
                     definition['file'],
                     encoding=definition['encoding'],
-                    convert_3d_to_2d=options['clean'],
+                    vsizip=options['vsizip'],
                 )
 
+            try:
+                partitioned = bool(data_sources) and partitioning.is_partitioned()
+                if partitioned and not partitioning.has_partition(slug):
+                    with transaction.atomic():
+                        partitioning.create_partition(slug)
+
+                # On a partitioned table, a boundary set is replaced by swapping its partition, unless its
+                # boundaries are updated or merged in place, or written with --copy or --workers.
+                swap = options['swap'] or (
+                    partitioned
+                    and not any(options[option] for option in ('incremental', 'merge', 'copy'))
+                    and options['workers'] <= 1
+                )
+
+                if not data_sources:
+                    log.warning(_('No shapefiles found.'))
+                elif options['stream'] or swap:
+                    self.stream_boundary_set(slug, definition, data_sources, dict(options, swap=swap), tmpdirs)
+                elif options['workers'] > 1:
+                    # The processes are forked before the boundary set's transaction begins.
+                    with self.create_pool(definition, options) as executor:
+                        self.load_boundary_set(slug, definition, data_sources, options, executor)
+                else:
+                    self.load_boundary_set(slug, definition, data_sources, options)
+
+                # A swapped partition is written in Hilbert order to begin with.
+                if data_sources and options['cluster'] and not swap:
+                    with self.profiler.phase('cluster'):
+                        cluster_boundary_set(BoundarySet.objects.get(slug=slug))
+
+                precision = definition.get('precision') or app_settings.PRECISION
+                if data_sources and precision:
+                    log.info(
+                        _('%(slug)s: snapping to %(precision)g degrees saved %(vertices)i vertices (%(bytes)i bytes).')
+                        % {'slug': slug, 'precision': precision, 'vertices': self.snapped[0], 'bytes': self.snapped[1]}
+                    )
+            finally:
+                for tmpdir in tmpdirs:
+                    rmtree(tmpdir)
+
+    def load_sets_in_parallel(self, pending, options):
+        """
+        Loads boundary sets in a pool of processes, largest first, each with its
+        own database connection and transaction.
+        """
+        global _worker_state
+
+        pending.sort(key=lambda item: source_size(item[1]['file']), reverse=True)
+
+        # Forked processes inherit the registry's definitions, whose functions
+        # can't be pickled, but they must not share the parent's connection.
+        _worker_state = (self, dict(pending), options)
+        connections.close_all()
+
+        results = {}
+        reports = {}  # with --profile
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=options['jobs'], mp_context=context) as executor:
+            futures = {executor.submit(load_set_in_worker, slug): slug for slug, definition in pending}
+            hashes = set()
+            for future in as_completed(futures):
+                slug = futures[future]
                 try:
-                    if not data_sources:
-                        log.warning(_('No shapefiles found.'))
-                    else:
-                        self.load_boundary_set(slug, definition, data_sources, options)
-                finally:
-                    for tmpdir in tmpdirs:
-                        rmtree(tmpdir)
+                    results[slug], reports[slug], deferred_hashes = future.result()
+                    hashes.update(deferred_hashes)
+                except Exception as e:  # e.g. the worker was killed
+                    results[slug] = f'{type(e).__name__}: {e}'
+
+        # A process mustn't prune a stored shape that another process is reusing in its uncommitted load.
+        if hashes:
+            with transaction.atomic():
+                storage.prune_stored_shapes(hashes)
+
+        failures = 0
+        for slug, definition in pending:
+            self.profiler.sets.extend(reports.get(slug, []))
+            if results[slug]:
+                failures += 1
+                log.error(_('%(slug)s failed: %(error)s') % {'slug': slug, 'error': results[slug]})
             else:
-                log.debug(_('Skipping %(slug)s.') % {'slug': slug})
+                log.info(_('%(slug)s succeeded.') % {'slug': slug})
+
+        if failures:
+            raise CommandError(
+                _('%(failures)i of %(count)i boundary sets failed to load.')
+                % {'failures': failures, 'count': len(pending)}
+            )
 
-    def loadable(self, slug, last_updated, whitelist=[], blacklist=[], reload_existing=False):
+    def loadable(self, slug, last_updated, whitelist=[], blacklist=[], reload_existing=False, fingerprint=None):
         """
         Allows through boundary sets that are in the whitelist (if set) and are
         not in the blacklist. Unless the `reload_existing` argument is True, it
         further limits to those that don't exist or are out-of-date.
+
+        If the `fingerprint` argument is set, a boundary set is out-of-date if
+        its fingerprint differs from the function's return value, instead of if
+        its last updated date is earlier.
         """
         if whitelist and slug not in whitelist or slug in blacklist:
             return False
@@ -136,63 +515,480 @@ class Command(BaseCommand):
             return True
         else:
             try:
-                return BoundarySet.objects.get(slug=slug).last_updated < last_updated
+                boundary_set = BoundarySet.objects.get(slug=slug)
             except BoundarySet.DoesNotExist:
                 return True
+            if fingerprint:
+                return boundary_set.fingerprint != fingerprint()
+            return boundary_set.last_updated < last_updated
+
+    def check_definition(self, slug, definition, options):
+        """
+        Raises an error if the definition's keys can't be combined with the options.
+        """
+        if definition.get('coverage') and not topology.available():
+            raise CommandError(_('%(slug)s: coverage requires GEOS 3.12 or later.') % {'slug': slug})
+        if definition.get('simple_shape_vertices') and (
+            options['derive'] or options['merge'] and not options['group'] or definition.get('coverage')
+        ):
+            raise CommandError(
+                _('%(slug)s: simple_shape_vertices cannot be combined with --derive, with --merge unless --group, '
+                  'or with coverage.') % {'slug': slug}
+            )
 
     @transaction.atomic
-    def load_boundary_set(self, slug, definition, data_sources, options):
-        BoundarySet.objects.filter(slug=slug).delete()  # also deletes boundaries
-
-        boundary_set = BoundarySet.objects.create(
-            slug=slug,
-            last_updated=definition['last_updated'],
-            name=definition['name'],
-            singular=definition['singular'],
-            domain=definition['domain'],
-            authority=definition['authority'],
-            source_url=definition['source_url'],
-            licence_url=definition['licence_url'],
-            start_date=definition['start_date'],
-            end_date=definition['end_date'],
-            notes=definition['notes'],
-            extra=definition['extra'],
-        )
+    def load_boundary_set(self, slug, definition, data_sources, options, executor=None):
+        self.check_definition(slug, definition, options)
+
+        # The stored shapes that the boundary set's boundaries referenced, to prune if no longer referenced.
+        hashes = storage.stored_hashes(slug)
+
+        if options['incremental']:
+            boundary_set, created = BoundarySet.objects.update_or_create(
+                slug=slug,
+                defaults=boundary_set_fields(definition),
+            )
+        else:
+            BoundarySet.objects.filter(slug=slug).delete()  # also deletes boundaries
+
+            boundary_set = BoundarySet.objects.create(slug=slug, **boundary_set_fields(definition))
 
         boundary_set.extent = [None, None, None, None]  # [xmin, ymin, xmax, ymax]
 
+        derived = not options['derive']  # whether to derive fields in Python
+
+        # Unless fields are derived from the shapes in the boundaries table, the shapes are written to the
+        # BoundaryGeometry or StoredShape table with their boundaries, instead of being moved there once the set
+        # is loaded.
+        separate = storage.is_enabled() and derived and not definition.get('coverage')
+
+        writer = self.get_writer(options, separate)
+        if options['incremental']:
+            writer = IncrementalWriter(boundary_set, writer, separate)
+
+        profiler = self.profiler
+        definition = profiler.instrument(definition)
+
+        groups = {}  # with --group
+        start = time.time()
+        count = 0
+
         for data_source in data_sources:
             log.info(_('Loading %(slug)s from %(source)s') % {'slug': slug, 'source': data_source.name})
 
-            layer = data_source[0]
-            layer.source = data_source  # to trace the layer back to its source
+            with profiler.data_source(data_source.name):
+                layer = data_source[0]
+                layer.source = data_source  # to trace the layer back to its source
 
-            if definition.get('srid'):
-                srs = SpatialReference(definition['srid'])
-            else:
-                srs = layer.srs
+                if definition.get('srid'):
+                    srs = SpatialReference(definition['srid'])
+                else:
+                    srs = layer.srs
 
-            for feature in layer:
-                feature = Feature(feature, definition, srs, boundary_set)
-                feature.layer = layer  # to trace the feature back to its source
+                filter_layer(layer, definition, srs)
 
-                if feature.is_valid():
+                if executor:
+                    features = self.prepare_in_parallel(
+                        layer, srs, boundary_set, executor, options['workers'], options['chunk_size']
+                    )
+                else:
+                    features = self.prepare(
+                        layer, definition, srs, boundary_set, options['clean'], options['chunk_size']
+                    )
+
+                for feature in features:
                     log.info(_('%(slug)s...') % {'slug': feature.slug})
 
-                    boundary = self.load_boundary(feature, options['merge'])
-                    boundary_set.extend(boundary.extent)
+                    if options['group']:
+                        with profiler.phase('group'):
+                            key = feature.slug
+                            if key in groups:
+                                groups[key].add(feature)
+                            else:
+                                groups[key] = FeatureGroup(feature)
+                    else:
+                        if writer:
+                            with profiler.phase('build'):
+                                boundary = feature.build_boundary(derived)
+                            with profiler.phase('write'):
+                                writer.write(boundary)
+                        elif options['merge']:
+                            with profiler.phase('merge'):
+                                boundary = self.load_boundary(feature, options['merge'])
+                        else:
+                            with profiler.phase('build'):
+                                boundary = feature.build_boundary(derived)
+                            with profiler.phase('write'):
+                                boundary.save(force_insert=True)
+                        if derived:
+                            boundary_set.extend(boundary.extent)
+                    profiler.count(loaded=1)
+                    count += 1
+
+        for group in groups.values():
+            with profiler.phase('merge'):
+                boundary = group.build_boundary(options['merge'], derived)
+            self.count_snapped(group.feature)
+            with profiler.phase('write'):
+                if writer:
+                    writer.write(boundary)
+                else:
+                    boundary.save(force_insert=True)
+            if derived:
+                boundary_set.extend(boundary.extent)
+
+        if writer:
+            with profiler.phase('write'):
+                writer.flush()
+
+        if not derived:
+            with profiler.phase('derive'):
+                boundary_set.extent = derive_in_database(boundary_set)
+
+        if definition.get('coverage'):
+            with profiler.phase('simplify'):
+                topology.simplify_boundary_set(boundary_set)
+
+        if app_settings.SIMPLE_SHAPE_TOLERANCES:
+            with profiler.phase('simplify'):
+                simplify_in_database(boundary_set)
+
+        if storage.is_enabled():
+            with profiler.phase('move'):
+                storage.move_shapes(boundary_set, prune=False)
+                self.prune_stored_shapes(hashes)
 
         if None not in boundary_set.extent:  # unless there are no features
             boundary_set.save()
+        elif options['incremental']:  # all features were removed
+            boundary_set.extent = None
+            boundary_set.save()
 
         log.info(
             _('%(slug)s count: %(count)i') % {'slug': slug, 'count': Boundary.objects.filter(set=boundary_set).count()}
         )
+        log_rate(slug, count, time.time() - start)
+
+    def stream_boundary_set(self, slug, definition, data_sources, options, tmpdirs=()):
+        """
+        Writes the boundary set's boundaries to the staging table in batches,
+        each committed with a checkpoint, then replaces the boundary set with
+        the staged boundaries in one transaction. With --resume, continues from
+        the last checkpoint, unless the source files changed since.
+        """
+        self.check_definition(slug, definition, options)
+
+        checkpoint = None
+        if options['resume']:
+            checkpoint = LoadCheckpoint.objects.filter(slug=slug).first()
+            if checkpoint and checkpoint.fingerprint != definition.get('fingerprint', ''):
+                log.warning(_('%(slug)s: The source files changed since the checkpoint.') % {'slug': slug})
+                checkpoint = None
+        if checkpoint:
+            log.info(
+                _('%(slug)s: Resuming from feature %(position)i of %(source)s.')
+                % {'slug': slug, 'position': checkpoint.position, 'source': checkpoint.data_source}
+            )
+        else:
+            # A failed or changed load's staged boundaries and checkpoint are discarded.
+            with transaction.atomic():
+                StagedBoundary.objects.filter(set=slug).delete()
+                LoadCheckpoint.objects.filter(slug=slug).delete()
+                checkpoint = LoadCheckpoint.objects.create(
+                    slug=slug, fingerprint=definition.get('fingerprint', ''), extent=[None, None, None, None]
+                )
+
+        # The boundary set is saved when it is published.
+        boundary_set = BoundarySet(slug=slug, **boundary_set_fields(definition))
+        boundary_set.extent = list(checkpoint.extent)
+
+        profiler = self.profiler
+        definition = profiler.instrument(definition)
+
+        derived = not options['derive']
+        batch_size = options['batch_size'] or STREAM_BATCH_SIZE
+        start = time.time()
+        count = 0
+
+        def commit(batch, name, position):
+            with transaction.atomic():
+                StagedBoundary.objects.bulk_create(batch)
+                checkpoint.data_source = name
+                checkpoint.position = position
+                checkpoint.count += len(batch)
+                checkpoint.extent = boundary_set.extent
+                checkpoint.save()
+
+        # Data sources decompressed from ZIP files are in new temporary directories on each run.
+        names = [
+            checkpoint_key(index, data_source, tmpdirs, definition['file'])
+            for index, data_source in enumerate(data_sources)
+        ]
+        if checkpoint.data_source and checkpoint.data_source not in names:
+            raise CommandError(
+                _('%(slug)s: The checkpoint\'s data source %(source)s was not found.')
+                % {'slug': slug, 'source': checkpoint.data_source}
+            )
+        # Data sources before the checkpoint's were fully loaded.
+        skip = names.index(checkpoint.data_source) if checkpoint.data_source else 0
+
+        for name, data_source in zip(names[skip:], data_sources[skip:]):
+            log.info(_('Loading %(slug)s from %(source)s') % {'slug': slug, 'source': data_source.name})
+
+            position = checkpoint.position if name == checkpoint.data_source else 0
+
+            with profiler.data_source(data_source.name):
+                layer = data_source[0]
+                layer.source = data_source  # to trace the layer back to its source
+
+                if definition.get('srid'):
+                    srs = SpatialReference(definition['srid'])
+                else:
+                    srs = layer.srs
+
+                filter_layer(layer, definition, srs)
+
+                batch = []
+                features = self.prepare(
+                    layer, definition, srs, boundary_set, options['clean'], options['chunk_size'], position
+                )
+                for feature in features:
+                    with profiler.phase('build'):
+                        boundary = feature.build_boundary(derived)
+                    if derived:
+                        boundary_set.extend(boundary.extent)
+                    batch.append(StagedBoundary.from_boundary(boundary))
+                    if len(batch) >= batch_size:
+                        with profiler.phase('write'):
+                            commit(batch, name, feature.index + 1)
+                        batch = []
+                    profiler.count(loaded=1)
+                    count += 1
+
+                with profiler.phase('write'):
+                    commit(batch, name, layer.num_feat)
+
+        with profiler.phase('publish'):
+            if options['swap']:
+                self.swap_boundary_set(
+                    boundary_set, definition, derived, options['defer_indexes'], options['cluster']
+                )
+            else:
+                self.publish_boundary_set(boundary_set, definition, derived)
+
+        log.info(
+            _('%(slug)s count: %(count)i') % {'slug': slug, 'count': Boundary.objects.filter(set=boundary_set).count()}
+        )
+        log_rate(slug, count, time.time() - start)
+
+    @transaction.atomic
+    def publish_boundary_set(self, boundary_set, definition, derived=True):
+        """
+        Replaces the boundary set and its boundaries with the staged boundaries,
+        and deletes its checkpoint.
+        """
+        # The derived fields are computed before the shapes are published, possibly to the BoundaryGeometry table.
+        if not derived:
+            boundary_set.extent = derive_in_database(boundary_set, StagedBoundary)
+        if definition.get('coverage'):
+            topology.simplify_boundary_set(boundary_set, StagedBoundary)
+
+        hashes = storage.stored_hashes(boundary_set)
+        BoundarySet.objects.filter(slug=boundary_set.slug).delete()  # also deletes boundaries
+        if None in boundary_set.extent:  # unless there are no features
+            boundary_set.extent = None
+        boundary_set.save(force_insert=True)
+
+        publish_staged_boundaries(boundary_set, separate=storage.is_enabled())
+        self.prune_stored_shapes(hashes)
+
+        if app_settings.SIMPLE_SHAPE_TOLERANCES:
+            simplify_in_database(boundary_set)
+
+        LoadCheckpoint.objects.filter(slug=boundary_set.slug).delete()
+
+    def swap_boundary_set(self, boundary_set, definition, derived=True, defer_indexes=False, cluster=False):
+        """
+        Computes the staged boundaries' derived fields in the staging table and
+        copies the staged boundaries to a new table, then replaces the boundary
+        set's partition with the new table in one short transaction, so that
+        readers never see a partly loaded set.
+
+        If `defer_indexes` is set, the new table's indexes on DEFERRED_INDEX_FIELDS
+        are built after the copy. The live partitions' indexes are untouched.
+
+        If `cluster` is set, the boundaries are copied in Hilbert order, as
+        `cluster_boundary_set` would reorder them.
+        """
+        table = partitioning.partition_name(boundary_set.slug) + '_new'
+
+        with transaction.atomic():
+            if not derived:
+                boundary_set.extent = derive_in_database(boundary_set, StagedBoundary)
+            if definition.get('coverage'):
+                topology.simplify_boundary_set(boundary_set, StagedBoundary)
+            order = None
+            if cluster:
+                staged = StagedBoundary.objects.filter(set=boundary_set.slug)
+                order = hilbert_sort(list(staged.values_list('pk', 'extent')))
+            partitioning.create_table(table)
+            indexes = drop_indexes(table, Boundary, DEFERRED_INDEX_FIELDS) if defer_indexes else []
+            publish_staged_boundaries(boundary_set, table, storage.is_enabled(), order)
+            # The constraint is validated now, rather than while the boundaries table is locked.
+            partitioning.add_check(table, boundary_set.slug)
+            if defer_indexes:
+                start = time.time()
+                create_indexes(indexes)
+                analyze(table)
+                log.info(
+                    _('%(slug)s: built %(count)i indexes and analyzed the new partition in %(seconds).1fs.')
+                    % {'slug': boundary_set.slug, 'count': len(indexes), 'seconds': time.time() - start}
+                )
+        if None in boundary_set.extent:  # unless there are no features
+            boundary_set.extent = None
+
+        with transaction.atomic():
+            boundary_set.save()
+            hashes = storage.stored_hashes(boundary_set)
+            partitioning.replace_partition(boundary_set, table)
+            self.prune_stored_shapes(hashes)
+            LoadCheckpoint.objects.filter(slug=boundary_set.slug).delete()
+
+        StagedBoundary.objects.filter(set=boundary_set.slug).delete()
+
+        # Until then, requests for these simplifications fall back to simple_shape.
+        if app_settings.SIMPLE_SHAPE_TOLERANCES:
+            with transaction.atomic():
+                simplify_in_database(boundary_set)
+
+    def prune_stored_shapes(self, hashes):
+        """
+        Prunes the stored shapes with the hashes that are no longer referenced,
+        or, with --jobs, defers it until all boundary sets are loaded.
+        """
+        if self.deferred_hashes is None:
+            storage.prune_stored_shapes(hashes)
+        else:
+            self.deferred_hashes.update(hashes)
+
+    def prepare(self, layer, definition, srs, boundary_set, clean=False, chunk_size=0, start=0):
+        """
+        Yields the layer's valid features.
+
+        If `chunk_size` is set, reprojects the features in chunks of this size,
+        with one call to OGR per chunk. If `start` is set, skips this many
+        features, e.g. to resume a streaming load.
+        """
+        profiler = self.profiler
+        definition = CompiledDefinition(definition, layer.fields)
+        index = start
+        for chunk in chunked(islice(profiler.iterate(layer, 'read'), start, None), chunk_size or 1):
+            if profiler.enabled:
+                profiler.count(features=len(chunk), vertices=sum(feature.geom.point_count for feature in chunk))
+            with profiler.phase('transform'):
+                geometries = transform_chunk(chunk, srs, clean, bool(chunk_size))
+
+            for feature, geometry in zip(chunk, geometries):
+                feature = Feature(feature, definition, srs, boundary_set, geometry=geometry)
+                feature.layer = layer  # to trace the feature back to its source
+                feature.index = index
+                index += 1
+
+                if feature.is_valid():
+                    yield feature
+                    # Once the caller has built the boundary, which snaps the geometry.
+                    self.count_snapped(feature)
+
+    def create_pool(self, definition, options):
+        """
+        Returns the pool of processes in which --workers prepare features.
+
+        The processes are forked at once, without the parent's database
+        connections, unless the caller holds a transaction. Either way, they
+        open their own connections if they need any.
+        """
+        global _pipeline_state
+
+        # Forked processes inherit the definition, whose functions can't be pickled.
+        _pipeline_state = (definition, options['clean'], options['chunk_size'], not options['derive'])
+
+        if not connection.in_atomic_block:
+            connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        executor = ProcessPoolExecutor(
+            max_workers=options['workers'], mp_context=context, initializer=detach_connections
+        )
+        executor.submit(int).result()  # a pool forks all its processes on its first task
+        return executor
+
+    def prepare_in_parallel(self, layer, srs, boundary_set, executor, workers, chunk_size=0):
+        """
+        Yields the layer's valid features, in order, after reprojecting,
+        simplifying and otherwise preparing them in the pool of processes.
+
+        Features are sent to the pool in chunks, and only a few chunks are in
+        flight at any time, so that memory use doesn't grow with the layer.
+        """
+        profiler = self.profiler
+        fields = layer.fields
+        srs_wkt = srs.wkt
+        detached_layer = DetachedLayer(layer)
+        in_flight = deque()
+        chunk = []
+        for feature in profiler.iterate(layer, 'read'):
+            with profiler.phase('read'):
+                geometry = feature.geom
+                chunk.append(DetachedFeature({field: feature.get(field) for field in fields}, bytes(geometry.wkb)))
+            profiler.count(features=1, vertices=geometry.point_count if profiler.enabled else 0)
+            if len(chunk) == (chunk_size or PIPELINE_CHUNK_SIZE):
+                in_flight.append(executor.submit(prepare_in_worker, srs_wkt, chunk, detached_layer, boundary_set))
+                chunk = []
+                if len(in_flight) >= workers * 2:
+                    with profiler.phase('prepare'):
+                        prepared = in_flight.popleft().result()
+                    for feature in prepared:
+                        self.count_snapped(feature)
+                        yield feature
+        if chunk:
+            in_flight.append(executor.submit(prepare_in_worker, srs_wkt, chunk, detached_layer, boundary_set))
+        while in_flight:
+            with profiler.phase('prepare'):
+                prepared = in_flight.popleft().result()
+            for feature in prepared:
+                self.count_snapped(feature)
+                yield feature
+
+    def count_snapped(self, feature):
+        if feature.snapped:
+            self.snapped[0] += feature.snapped[0]
+            self.snapped[1] += feature.snapped[1]
+
+    def get_writer(self, options, separate=False):
+        """
+        Returns the writer with which to insert boundaries, or None to insert
+        boundaries one at a time.
+
+        If `separate` is set, the writer writes the boundaries' shapes to the
+        BoundaryGeometry table. Boundaries that are merged with existing
+        boundaries are saved one at a time, and their shapes moved later.
+        """
+        if options['copy']:
+            batch_size = options['batch_size'] or COPY_BATCH_SIZE
+            if connection.vendor == 'postgresql':
+                return CopyWriter(batch_size, separate)
+            log.warning(_('--copy requires PostgreSQL. Inserting boundaries in bulk instead.'))
+            return BulkWriter(batch_size, separate)
+        elif options['batch_size']:
+            return BulkWriter(options['batch_size'], separate)
+        elif separate and not (options['merge'] and not options['group']):
+            return BulkWriter(1, separate)
 
     def load_boundary(self, feature, merge_strategy=None):
         if merge_strategy:
             try:
                 boundary = Boundary.objects.get(set=feature.boundary_set, slug=feature.slug)
+                feature.snap()
                 if merge_strategy == 'combine':
                     boundary.merge(feature.geometry)
                 elif merge_strategy == 'union':
@@ -203,6 +999,7 @@ class Command(BaseCommand):
                     )
                 boundary.centroid = boundary.shape.centroid
                 boundary.extent = boundary.shape.extent
+                boundary.content_hash = boundary.compute_content_hash()
                 boundary.save()
                 return boundary
             except Boundary.DoesNotExist:
@@ -211,22 +1008,915 @@ class Command(BaseCommand):
             return feature.create_boundary()
 
 
-def create_data_sources(path, encoding='ascii', convert_3d_to_2d=False, zipfile=None):
+class Profiler:
+    """
+    Times the phases of loading each boundary set and data source, for
+    --profile. A phase's time excludes the time of the phases within it, e.g.
+    the time of definition functions called while building a boundary.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.sets = []
+        self.reports = []  # the boundary set and data source being loaded
+        self.stack = []  # the phases being timed, as [name, wall, cpu]
+
+    def boundary_set(self, slug):
+        if not self.enabled:
+            return nullcontext()
+        report = self.report(slug=slug, data_sources=[])
+        self.sets.append(report)
+        return self.scope(report)
+
+    def data_source(self, name):
+        if not self.enabled:
+            return nullcontext()
+        report = self.report(name=name)
+        self.reports[0]['data_sources'].append(report)
+        return self.scope(report)
+
+    def phase(self, name):
+        if not self.enabled:
+            return nullcontext()
+        return self.timed(name)
+
+    def count(self, **counts):
+        if self.enabled:
+            for report in self.reports:
+                for key, value in counts.items():
+                    report[key] += value
+
+    def iterate(self, iterable, name):
+        """
+        Yields the items of the iterable, timing each step as the phase.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+
+        iterator = iter(iterable)
+        done = object()
+        while True:
+            with self.phase(name):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def instrument(self, definition):
+        """
+        Returns a copy of the definition whose functions are timed as the
+        "callbacks" phase.
+        """
+        if not self.enabled:
+            return definition
+
+        def timed(function):
+            def wrapper(*args, **kwargs):
+                with self.phase('callbacks'):
+                    return function(*args, **kwargs)
+            return wrapper
+
+        wrappers = {}  # to keep functions that are shared between keys shared
+        dictionary = dict(definition.dictionary)
+        for key, value in dictionary.items():
+            if key.endswith('_func') and callable(value):
+                if value not in wrappers:
+                    wrappers[value] = timed(value)
+                dictionary[key] = wrappers[value]
+        return Definition(dictionary)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'sets': self.sets}, f, indent=2)
+
+    def report(self, **kwargs):
+        return dict(kwargs, wall=0.0, cpu=0.0, features=0, loaded=0, vertices=0, peak_rss=None, phases={})
+
+    @contextmanager
+    def scope(self, report):
+        self.reports.append(report)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            report['wall'] += time.perf_counter() - wall
+            report['cpu'] += time.process_time() - cpu
+            report['peak_rss'] = peak_rss()
+            self.reports.pop()
+
+    @contextmanager
+    def timed(self, name):
+        self.pause()
+        self.stack.append([name, time.perf_counter(), time.process_time()])
+        try:
+            yield
+        finally:
+            self.pause()
+            self.stack.pop()
+            if self.stack:  # resume the enclosing phase
+                self.stack[-1][1:] = [time.perf_counter(), time.process_time()]
+
+    def pause(self):
+        """
+        Adds the time since the current phase started or resumed to its totals.
+        """
+        if self.stack:
+            entry = self.stack[-1]
+            wall, cpu = time.perf_counter(), time.process_time()
+            for report in self.reports:
+                totals = report['phases'].setdefault(entry[0], {'wall': 0.0, 'cpu': 0.0})
+                totals['wall'] += wall - entry[1]
+                totals['cpu'] += cpu - entry[2]
+            entry[1:] = [wall, cpu]
+
+
+class BulkWriter:
+    """
+    Buffers boundaries and inserts each batch with a single query.
+
+    If `separate` is set, empties the boundaries' own shapes, and writes their
+    shapes to the StoredShape table before the boundaries, if
+    DEDUPLICATE_SHAPES is set, or else to the BoundaryGeometry table after the
+    boundaries, with a single query.
+    """
+
+    def __init__(self, batch_size, separate=False):
+        self.batch_size = batch_size
+        self.deduplicate = separate and app_settings.DEDUPLICATE_SHAPES
+        self.separate = separate and not self.deduplicate
+        self.batch = []
+
+    def write(self, boundary):
+        self.batch.append(boundary)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            if self.deduplicate:
+                storage.store_shapes(self.batch)
+            shapes = storage.split_shapes(self.batch) if self.separate else []
+            Boundary.objects.bulk_create(self.batch)
+            if shapes:
+                BoundaryGeometry.objects.bulk_create(
+                    BoundaryGeometry(boundary=boundary, shape=shape) for boundary, shape in zip(self.batch, shapes)
+                )
+            self.batch = []
+
+
+class CopyWriter(BulkWriter):
+    """
+    Buffers boundaries and streams each batch into the boundaries table with
+    `COPY ... FROM STDIN` in PostgreSQL's binary format, in which geometries are
+    sent as EWKB instead of as text.
+    """
+
+    def __init__(self, batch_size, separate=False):
+        super().__init__(batch_size, separate)
+        # The boundaries' primary keys are needed to write their shapes to the BoundaryGeometry table.
+        self.fields = [
+            field for field in Boundary._meta.concrete_fields if self.separate or field is not Boundary._meta.pk
+        ]
+        self.sql = self.copy_sql(Boundary, self.fields)
+        if self.separate:
+            self.geometry_fields = BoundaryGeometry._meta.concrete_fields
+            self.geometry_sql = self.copy_sql(BoundaryGeometry, self.geometry_fields)
+
+    @staticmethod
+    def copy_sql(model, fields):
+        return 'COPY {} ({}) FROM STDIN WITH (FORMAT binary)'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        )
+
+    def flush(self):
+        if self.batch:
+            if self.deduplicate:
+                storage.store_shapes(self.batch)
+            with connection.cursor() as cursor:
+                if self.separate:
+                    cursor.execute(
+                        'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                        [Boundary._meta.db_table, Boundary._meta.pk.column, len(self.batch)],
+                    )
+                    for boundary, (pk,) in zip(self.batch, cursor.fetchall()):
+                        boundary.pk = pk
+                    geometries = [
+                        BoundaryGeometry(boundary_id=boundary.pk, shape=shape)
+                        for boundary, shape in zip(self.batch, storage.split_shapes(self.batch))
+                    ]
+                self.copy(cursor, self.sql, self.encode(self.batch))
+                if self.separate:
+                    self.copy(cursor, self.geometry_sql, self.encode(geometries, self.geometry_fields))
+            self.batch = []
+
+    def copy(self, cursor, sql, data):
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, io.BytesIO(data))
+        else:  # psycopg
+            with cursor.copy(sql) as copy:
+                copy.write(data)
+
+    def encode(self, boundaries, fields=None):
+        """
+        Returns the boundaries (or other model instances, with their fields) as
+        a COPY binary file.
+        """
+        if fields is None:
+            fields = self.fields
+        buffer = io.BytesIO()
+        buffer.write(b'PGCOPY\n\xff\r\n\x00')  # signature
+        buffer.write(struct.pack('!ii', 0, 0))  # flags, header extension length
+        field_count = struct.pack('!h', len(fields))
+        for boundary in boundaries:
+            buffer.write(field_count)
+            for field in fields:
+                value = encode_copy_value(field, getattr(boundary, field.attname))
+                if value is None:
+                    buffer.write(struct.pack('!i', -1))
+                else:
+                    buffer.write(struct.pack('!i', len(value)))
+                    buffer.write(value)
+        buffer.write(struct.pack('!h', -1))  # trailer
+        return buffer.getvalue()
+
+
+class IncrementalWriter:
+    """
+    Compares boundaries to the boundary set's existing boundaries by slug and
+    content hash. Inserts new boundaries, updates changed boundaries and leaves
+    unchanged boundaries untouched. Once all boundaries are written, `flush`
+    deletes the existing boundaries that weren't written.
+    """
+
+    def __init__(self, boundary_set, writer=None, separate=False):
+        self.boundary_set = boundary_set
+        self.writer = writer
+        self.deduplicate = separate and app_settings.DEDUPLICATE_SHAPES
+        self.separate = separate and not self.deduplicate
+        self.existing = {
+            slug: (pk, content_hash)
+            for pk, slug, content_hash in Boundary.objects.filter(set=boundary_set).values_list(
+                'pk', 'slug', 'content_hash'
+            )
+        }
+        self.seen = set()
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.untouched = 0
+
+    def write(self, boundary):
+        if boundary.slug in self.seen:
+            raise ValueError(
+                _("The slug '%(slug)s' is not unique within the boundary set.") % {'slug': boundary.slug}
+            )
+        self.seen.add(boundary.slug)
+
+        if boundary.slug not in self.existing:
+            if self.writer:
+                self.writer.write(boundary)
+            else:
+                boundary.save(force_insert=True)
+            self.added += 1
+        else:
+            pk, content_hash = self.existing[boundary.slug]
+            if boundary.content_hash == content_hash:
+                self.untouched += 1
+            else:
+                boundary.pk = pk
+                if self.deduplicate:
+                    storage.store_shapes([boundary])
+                elif self.separate:
+                    (shape,) = storage.split_shapes([boundary])
+                    BoundaryGeometry.objects.update_or_create(boundary_id=pk, defaults={'shape': shape})
+                boundary.save(force_update=True)
+                SimplifiedShape.objects.filter(boundary=pk).delete()
+                self.changed += 1
+
+    def flush(self):
+        if self.writer:
+            self.writer.flush()
+
+        removed = [pk for slug, (pk, content_hash) in self.existing.items() if slug not in self.seen]
+        Boundary.objects.filter(pk__in=removed).delete()
+        self.removed = len(removed)
+
+        log.info(
+            _('%(slug)s: %(added)i added, %(changed)i changed, %(removed)i removed, %(untouched)i untouched')
+            % {
+                'slug': self.boundary_set.slug,
+                'added': self.added,
+                'changed': self.changed,
+                'removed': self.removed,
+                'untouched': self.untouched,
+            }
+        )
+
+
+def derive_in_database(boundary_set, model=Boundary):
+    """
+    Sets the simplified shape, centroid and extent of the boundary set's
+    boundaries that were built without them, with set-wide SQL, and returns
+    the boundary set's extent.
+
+    The model can be StagedBoundary, to derive the fields of staged boundaries.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    shape, simple_shape, simple_shape_tolerance, simple_shape_vertices, centroid, extent, set_id = (
+        quote_name(model._meta.get_field(name).column)
+        for name in (
+            'shape', 'simple_shape', 'simple_shape_tolerance', 'simple_shape_vertices', 'centroid', 'extent', 'set'
+        )
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET '
+            f'{simple_shape} = ST_Multi(ST_SimplifyPreserveTopology({shape}, %s)), '
+            f'{simple_shape_tolerance} = %s, '
+            f'{centroid} = ST_Centroid({shape}), '
+            f'{extent} = jsonb_build_array(ST_XMin({shape}), ST_YMin({shape}), ST_XMax({shape}), ST_YMax({shape})) '
+            f'WHERE {set_id} = %s AND ST_IsEmpty({simple_shape})',
+            [app_settings.SIMPLE_SHAPE_TOLERANCE, app_settings.SIMPLE_SHAPE_TOLERANCE, boundary_set.slug],
+        )
+        cursor.execute(
+            f'UPDATE {table} SET {simple_shape_vertices} = ST_NPoints({simple_shape}) '
+            f'WHERE {set_id} = %s AND {simple_shape_vertices} IS NULL',
+            [boundary_set.slug],
+        )
+        # The boundaries' extents, unlike their shapes, are never moved by SEPARATE_SHAPES.
+        cursor.execute(
+            f"SELECT MIN(({extent}->>0)::float), MIN(({extent}->>1)::float), "
+            f"MAX(({extent}->>2)::float), MAX(({extent}->>3)::float) FROM {table} WHERE {set_id} = %s",
+            [boundary_set.slug],
+        )
+        return list(cursor.fetchone())
+
+
+def drop_indexes(table, model, fields):
+    """
+    Drops the non-unique, single-column indexes on the model's fields from the
+    table, and returns the statements with which to create them again.
+    """
+    columns = [model._meta.get_field(name).column for name in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x '
+            'JOIN pg_class i ON i.oid = x.indexrelid '
+            'JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = x.indkey[0] '
+            'WHERE x.indrelid = %s::regclass AND x.indnatts = 1 AND NOT x.indisunique AND a.attname = ANY(%s)',
+            [table, columns],
+        )
+        indexes = cursor.fetchall()
+        for name, statement in indexes:
+            cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(name)}')
+    return [statement for name, statement in indexes]
+
+
+def create_indexes(statements):
+    """
+    Creates the indexes returned by `drop_indexes`.
+    """
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def analyze(*tables):
+    """
+    Updates the planner's statistics of the tables.
+    """
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
+
+
+def publish_staged_boundaries(boundary_set, table=None, separate=False, order=None):
+    """
+    Moves the boundary set's staged boundaries into the boundaries table, with
+    set-wide SQL.
+
+    If a table is given, copies the staged boundaries into it instead, with ids
+    from the boundaries table's sequence, to be attached as a partition by
+    `partitioning.replace_partition`.
+
+    If `separate` is set, writes empty shapes to the boundaries table, and the
+    staged boundaries' shapes to the StoredShape table, unless already stored,
+    if DEDUPLICATE_SHAPES is set, or else to the BoundaryGeometry table.
+
+    If `order` is set, it is the staged boundaries' primary keys, in the order
+    in which to write them, e.g. along a Hilbert curve.
+    """
+    quote_name = connection.ops.quote_name
+    fields = [field for field in Boundary._meta.concrete_fields if field is not Boundary._meta.pk]
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    staged_table = quote_name(StagedBoundary._meta.db_table)
+    set_id = quote_name(StagedBoundary._meta.get_field('set').column)
+    staged_pk = quote_name(StagedBoundary._meta.pk.column)
+    pk = quote_name(Boundary._meta.pk.column)
+    shape = quote_name(Boundary._meta.get_field('shape').column)
+    target = quote_name(table or Boundary._meta.db_table)
+    sequence = [Boundary._meta.db_table, Boundary._meta.pk.column]
+
+    source, params, position, ordered = f'FROM {staged_table} s WHERE s.{set_id} = %s', [boundary_set.slug], '', ''
+    if order is not None:
+        source = (
+            f'FROM {staged_table} s JOIN unnest(%s::integer[]) WITH ORDINALITY AS o(staged_id, clustered_position) '
+            f'ON s.{staged_pk} = o.staged_id WHERE s.{set_id} = %s'
+        )
+        params = [order, boundary_set.slug]
+        position, ordered = ', o.clustered_position', ' ORDER BY clustered_position'
+
+    with connection.cursor() as cursor:
+        if separate and app_settings.DEDUPLICATE_SHAPES:
+            stored_table = quote_name(StoredShape._meta.db_table)
+            stored_hash, stored_shape = (
+                quote_name(StoredShape._meta.get_field(name).column) for name in ('hash', 'shape')
+            )
+            replacements = {'shape': storage.EMPTY_SHAPE, 'stored_shape': 'digest'}
+            values = ', '.join(replacements.get(field.name, quote_name(field.column)) for field in fields)
+            if table:
+                columns, values = f'{pk}, {columns}', f'nextval(pg_get_serial_sequence(%s, %s)), {values}'
+            cursor.execute(
+                f'WITH staged AS (SELECT {storage.hash_expression(shape)} AS digest{position}, s.* {source}), '
+                f'stored AS (INSERT INTO {stored_table} ({stored_hash}, {stored_shape}) '
+                f'SELECT DISTINCT ON (digest) digest, {shape} FROM staged ON CONFLICT ({stored_hash}) DO NOTHING) '
+                f'INSERT INTO {target} ({columns}) SELECT {values} FROM staged{ordered}',
+                [*params, *(sequence if table else [])],
+            )
+        elif separate:
+            values = ', '.join(
+                storage.EMPTY_SHAPE if field.name == 'shape' else quote_name(field.column) for field in fields
+            )
+            geometry_table = quote_name(BoundaryGeometry._meta.db_table)
+            boundary_id, geometry_shape = (
+                quote_name(BoundaryGeometry._meta.get_field(name).column) for name in ('boundary', 'shape')
+            )
+            cursor.execute(
+                f'WITH staged AS (SELECT nextval(pg_get_serial_sequence(%s, %s)) AS {pk}, {columns}{position} '
+                f'{source}), '
+                f'published AS (INSERT INTO {target} ({pk}, {columns}) SELECT {pk}, {values} FROM staged{ordered}) '
+                f'INSERT INTO {geometry_table} ({boundary_id}, {geometry_shape}) '
+                f'SELECT {pk}, {shape} FROM staged{ordered}',
+                [*sequence, *params],
+            )
+        elif table:
+            cursor.execute(
+                f'INSERT INTO {target} ({pk}, {columns}) '
+                f'SELECT nextval(pg_get_serial_sequence(%s, %s)), {columns} {source}{ordered}',
+                [*sequence, *params],
+            )
+        else:
+            cursor.execute(f'INSERT INTO {target} ({columns}) SELECT {columns} {source}{ordered}', params)
+        if not table:
+            cursor.execute(f'DELETE FROM {staged_table} WHERE {set_id} = %s', [boundary_set.slug])
+
+
+def simplify_in_database(boundary_set):
+    """
+    Simplifies the shapes of the boundary set's boundaries at each of the
+    SIMPLE_SHAPE_TOLERANCES, unless already simplified, with set-wide SQL.
+    The shapes are read from the BoundaryGeometry or StoredShape table, if
+    moved there. A stored shape that was already simplified, for another
+    boundary, isn't simplified again.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(SimplifiedShape._meta.db_table)
+    boundary_table = quote_name(Boundary._meta.db_table)
+    geometry_table = quote_name(BoundaryGeometry._meta.db_table)
+    stored_table = quote_name(StoredShape._meta.db_table)
+    boundary_id, tolerance, simplified_shape = (
+        quote_name(SimplifiedShape._meta.get_field(name).column) for name in ('boundary', 'tolerance', 'shape')
+    )
+    geometry_boundary_id = quote_name(BoundaryGeometry._meta.get_field('boundary').column)
+    stored_hash = quote_name(StoredShape._meta.get_field('hash').column)
+    pk, set_id, stored_shape_id = (
+        quote_name(Boundary._meta.get_field(name).column) for name in ('id', 'set', 'stored_shape')
+    )
+    shape = storage.shape_expression('b', 'g', 's')
+
+    missing = f'NOT EXISTS (SELECT 1 FROM {table} x WHERE x.{boundary_id} = b.{pk} AND x.{tolerance} = %s)'
+    # A stored shape is simplified once, for the first of the boundaries that reference it.
+    distinct = f'DISTINCT ON (COALESCE(b.{stored_shape_id}, b.{pk}::text)) ' if app_settings.DEDUPLICATE_SHAPES else ''
+
+    with connection.cursor() as cursor:
+        for value in app_settings.SIMPLE_SHAPE_TOLERANCES:
+            if app_settings.DEDUPLICATE_SHAPES:
+                reuse_simplified_shapes(cursor, boundary_set, value)
+            cursor.execute(
+                f'INSERT INTO {table} ({boundary_id}, {tolerance}, {simplified_shape}) '
+                f'SELECT {distinct}b.{pk}, %s, ST_Multi(ST_SimplifyPreserveTopology({shape}, %s)) '
+                f'FROM {boundary_table} b '
+                f'LEFT JOIN {geometry_table} g ON g.{geometry_boundary_id} = b.{pk} '
+                f'LEFT JOIN {stored_table} s ON s.{stored_hash} = b.{stored_shape_id} '
+                f'WHERE b.{set_id} = %s AND {missing}',
+                [value, value, boundary_set.slug, value],
+            )
+            if app_settings.DEDUPLICATE_SHAPES:
+                reuse_simplified_shapes(cursor, boundary_set, value)
+
+
+def reuse_simplified_shapes(cursor, boundary_set, value):
+    """
+    Copies the simplified shapes at the tolerance of other boundaries with the
+    same stored shapes to the boundary set's boundaries, instead of simplifying
+    the stored shapes again.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(SimplifiedShape._meta.db_table)
+    boundary_table = quote_name(Boundary._meta.db_table)
+    boundary_id, tolerance, simplified_shape = (
+        quote_name(SimplifiedShape._meta.get_field(name).column) for name in ('boundary', 'tolerance', 'shape')
+    )
+    pk, set_id, stored_shape_id = (
+        quote_name(Boundary._meta.get_field(name).column) for name in ('id', 'set', 'stored_shape')
+    )
+    cursor.execute(
+        f'INSERT INTO {table} ({boundary_id}, {tolerance}, {simplified_shape}) '
+        f'SELECT DISTINCT ON (b.{pk}) b.{pk}, %s, x.{simplified_shape} FROM {boundary_table} b '
+        f'JOIN {boundary_table} o ON o.{stored_shape_id} = b.{stored_shape_id} AND o.{pk} <> b.{pk} '
+        f'JOIN {table} x ON x.{boundary_id} = o.{pk} AND x.{tolerance} = %s '
+        f'WHERE b.{set_id} = %s AND NOT EXISTS '
+        f'(SELECT 1 FROM {table} y WHERE y.{boundary_id} = b.{pk} AND y.{tolerance} = %s)',
+        [value, value, boundary_set.slug, value],
+    )
+
+
+def encode_copy_value(field, value):
+    """
+    Returns the value of the model field in PostgreSQL's binary format.
+    """
+    if value is None:
+        return None
+    if field.is_relation:
+        field = field.target_field
+    internal_type = field.get_internal_type()
+    if hasattr(field, 'geom_type'):
+        if value.srid is None:
+            value.srid = field.srid
+        return bytes(value.ewkb)
+    elif internal_type == 'JSONField':
+        return b'\x01' + json.dumps(value, cls=field.encoder).encode('utf-8')  # jsonb version 1
+    elif internal_type == 'DateField':
+        return struct.pack('!i', (value - date(2000, 1, 1)).days)  # days since the PostgreSQL epoch
+    elif internal_type == 'FloatField':
+        return struct.pack('!d', value)
+    elif internal_type in ('AutoField', 'IntegerField'):
+        return struct.pack('!i', value)
+    elif internal_type in ('BigAutoField', 'BigIntegerField'):
+        return struct.pack('!q', value)
+    elif internal_type in ('CharField', 'SlugField', 'TextField'):
+        return str(value).encode('utf-8')
+    raise ValueError(
+        _('The field %(name)s of type %(type)s is not supported by COPY.')
+        % {'name': field.name, 'type': internal_type}
+    )
+
+
+def boundary_set_fields(definition):
+    """
+    Returns the boundary set's fields from its definition.
+    """
+    return {
+        'last_updated': definition['last_updated'],
+        'name': definition['name'],
+        'singular': definition['singular'],
+        'domain': definition['domain'],
+        'authority': definition['authority'],
+        'source_url': definition['source_url'],
+        'licence_url': definition['licence_url'],
+        'start_date': definition['start_date'],
+        'end_date': definition['end_date'],
+        'notes': definition['notes'],
+        'extra': definition['extra'],
+        'fingerprint': definition.get('fingerprint', ''),
+    }
+
+
+def load_set_in_worker(slug):
+    """
+    Loads a boundary set in a process of --jobs. Returns an error message if the
+    boundary set failed to load, the boundary set's --profile report, and the
+    hashes of the stored shapes to prune.
+    """
+    command, definitions, options = _worker_state
+    # A process can load many boundary sets, so only return this set's report and hashes.
+    start = len(command.profiler.sets)
+    command.deferred_hashes = set()
+    try:
+        command.load_set(slug, definitions[slug], options)
+    except Exception as e:
+        log.exception(_('Error loading %(slug)s.') % {'slug': slug})
+        return f'{type(e).__name__}: {e}', command.profiler.sets[start:], set()
+    return None, command.profiler.sets[start:], command.deferred_hashes
+
+
+def detach_connections():
+    """
+    Makes a process of --workers open its own database connections, instead of
+    using the parent's. The inherited connections are kept, but never used or
+    closed, since closing them would close them for the parent.
+    """
+    for conn in connections.all():
+        if conn.connection is not None:
+            _inherited_connections.append(conn.connection)
+            conn.connection = None
+        # As if the connection had been closed outside a transaction.
+        conn.in_atomic_block = False
+        conn.savepoint_ids = []
+        conn.atomic_blocks = []
+        conn.needs_rollback = False
+
+
+def prepare_in_worker(srs_wkt, chunk, layer, boundary_set):
+    """
+    Builds the boundaries of a chunk of detached features of the detached layer
+    in a process of --workers. Returns prepared features, omitting invalid
+    features.
+    """
+    definition, clean, chunk_size, derived = _pipeline_state
+    srs = SpatialReference(srs_wkt)
+    prepared = []
+    for feature, geometry in zip(chunk, transform_chunk(chunk, srs, clean, bool(chunk_size))):
+        feature = Feature(feature, definition, srs, boundary_set, geometry=geometry)
+        feature.layer = layer
+        if feature.is_valid():
+            prepared.append(PreparedFeature(feature.build_boundary(derived), feature.snapped))
+    return prepared
+
+
+class FeatureGroup:
+    """
+    The features with the same slug, to merge into one boundary with a single
+    union and simplification. As with --merge, the boundary takes its other
+    attributes from the first feature.
+    """
+
+    def __init__(self, feature):
+        self.feature = feature
+        self.geometries = [feature.geometry]
+
+    def add(self, feature):
+        self.geometries.append(feature.geometry)
+
+    def build_boundary(self, merge_strategy, derived=True):
+        if len(self.geometries) > 1:
+            geometry = self.geometries[0].merge(*self.geometries[1:])
+            if merge_strategy == 'union':
+                geometry = geometry.unary_union()
+            elif merge_strategy != 'combine':
+                raise ValueError(
+                    _("The merge strategy '%(value)s' must be 'combine' or 'union'.") % {'value': merge_strategy}
+                )
+            self.feature.geometry = geometry
+        return self.feature.build_boundary(derived)
+
+
+class DetachedFeature:
+    """
+    An OGR feature's attributes and geometry, detached from its layer so that
+    it can be sent to another process.
+    """
+
+    __slots__ = ('values', 'wkb')
+
+    def __init__(self, values, wkb):
+        self.values = values
+        self.wkb = wkb
+
+    @property
+    def fields(self):
+        return list(self.values)
+
+    @property
+    def geom(self):
+        return OGRGeometry(memoryview(self.wkb))
+
+    def get(self, field):
+        return self.values[field]
+
+
+class DetachedLayer:
+    """
+    A layer's name and data source, detached so that definition functions can
+    trace features prepared in another process back to their data source, with
+    `feature.layer.source.name` or `feature.layer.source.zipfile`.
+    """
+
+    __slots__ = ('name', 'source')
+
+    def __init__(self, layer):
+        self.name = layer.name
+        self.source = DetachedSource(layer.source)
+
+
+class DetachedSource:
+    """
+    A data source's name and, if it was read from a ZIP file, the ZIP file.
+    """
+
+    def __init__(self, data_source):
+        self.name = data_source.name
+        if hasattr(data_source, 'zipfile'):
+            self.zipfile = data_source.zipfile
+
+
+class PreparedFeature:
+    """
+    A feature whose boundary was built in another process.
+    """
+
+    __slots__ = ('boundary', 'snapped')
+
+    def __init__(self, boundary, snapped=None):
+        self.boundary = boundary
+        self.snapped = snapped
+
+    @property
+    def slug(self):
+        return self.boundary.slug
+
+    def build_boundary(self, derived=True):
+        return self.boundary
+
+    def create_boundary(self):
+        self.boundary.save(force_insert=True)
+        return self.boundary
+
+
+def filter_layer(layer, definition, srs):
+    """
+    Sets the layer's attribute filter and spatial filter from the definition's
+    `attribute_filter` and `spatial_filter`, so that OGR skips the features
+    that don't match, without reading their geometries.
+    """
+    if definition.get('attribute_filter'):
+        try:
+            set_attribute_filter(layer.ptr, definition['attribute_filter'].encode())
+        except GDALException:
+            raise ValueError(
+                _("The attribute filter '%(value)s' is not a valid SQL WHERE expression.")
+                % {'value': definition['attribute_filter']}
+            )
+
+    if definition.get('spatial_filter'):
+        xmin, ymin, xmax, ymax = definition['spatial_filter']
+        # Densify the bounding box's edges, so that its transformation covers the same area.
+        steps = [i / SPATIAL_FILTER_STEPS for i in range(SPATIAL_FILTER_STEPS)]
+        points = (
+            [(xmin + (xmax - xmin) * step, ymin) for step in steps]
+            + [(xmax, ymin + (ymax - ymin) * step) for step in steps]
+            + [(xmax - (xmax - xmin) * step, ymax) for step in steps]
+            + [(xmin, ymax - (ymax - ymin) * step) for step in steps]
+        )
+        points.append(points[0])
+        geometry = OGRGeometry('POLYGON ((%s))' % ','.join('%r %r' % point for point in points), wgs84())
+        if srs is not None:  # otherwise, assume the layer is in EPSG:4326
+            geometry.transform(srs)
+        layer.spatial_filter = geometry.envelope.tuple
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to `size` items from the iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def transform_chunk(features, srs, clean=False, batch=False):
+    """
+    Returns the features' geometries, transformed to EPSG:4326. If `batch` is
+    set, transforms them with one call to OGR (--chunk-size).
+    """
+    if batch:
+        return transform_features(features, srs, clean)
+    return [Geometry(feature.geom).transform(srs, clean=clean) for feature in features]
+
+
+def fingerprint(definition):
+    """
+    Returns a SHA-256 hash of the boundary set's source files and definition
+    file, and caches it in the definition.
+    """
+    if 'fingerprint' not in definition:
+        value = hashlib.sha256()
+        paths = source_files(definition['file'])
+        if definition.get('definition_file'):
+            paths.append(definition['definition_file'])
+        for path in paths:
+            value.update(os.path.basename(path).encode('utf-8'))
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    value.update(chunk)
+        definition['fingerprint'] = value.hexdigest()
+    return definition['fingerprint']
+
+
+def source_files(path):
+    """
+    Returns the paths to the shapefiles' files and ZIP files at the path, in a
+    constant order.
+    """
+    if os.path.isfile(path):
+        root, extension = os.path.splitext(path)
+        if extension.lower() != '.shp':
+            return [path]
+        # A shapefile's attributes, projection and index are in files with the same basename.
+        dirname, stem = os.path.split(root)
+        return [
+            os.path.join(dirname, basename)
+            for basename in sorted(os.listdir(dirname or '.'))
+            if os.path.splitext(basename)[0] == stem and basename.lower().endswith(SOURCE_EXTENSIONS)
+        ]
+    paths = []
+    for (dirpath, dirnames, filenames) in os.walk(path, followlinks=True):
+        dirnames.sort()  # force a constant order
+        for basename in sorted(filenames):
+            if basename.lower().endswith(SOURCE_EXTENSIONS) and '_cleaned_' not in basename:
+                paths.append(os.path.join(dirpath, basename))
+    return paths
+
+
+def checkpoint_key(index, data_source, tmpdirs, path):
+    """
+    Returns a key for the data source that is the same on each run, for
+    --resume: its index among the boundary set's data sources, and its path
+    relative to the temporary directory to which its ZIP file was decompressed,
+    or else to the definition's file.
+    """
+    name = data_source.name
+    for directory in [*tmpdirs, path if os.path.isdir(path) else os.path.dirname(path)]:
+        if directory and name.startswith(os.path.join(directory, '')):
+            name = os.path.relpath(name, directory)
+            break
+    return f'{index}:{name}'
+
+
+def source_size(path):
+    """
+    Returns the size in bytes of the file or of the files in the directory.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for (dirpath, dirnames, filenames) in os.walk(path, followlinks=True):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+
+def log_rate(slug, count, seconds):
+    """
+    Logs the number of features loaded per second, to compare loading strategies.
+    """
+    rate = count / seconds if seconds else 0
+    log.info(
+        _('%(slug)s: %(count)i features in %(seconds).2fs (%(rate).1f features/s)')
+        % {'slug': slug, 'count': count, 'seconds': seconds, 'rate': rate}
+    )
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the process in kilobytes, or None if
+    it's unavailable.
+    """
+    if resource is None:
+        return None
+    value = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes
+        value //= 1024
+    return value
+
+
+def create_data_sources(path, encoding='ascii', convert_3d_to_2d=None, zipfile=None, *, vsizip=False):
     """
     If the path is to a shapefile, returns a DataSource for the shapefile. If
     the path is to a directory or ZIP file, returns DataSources for shapefiles
     in the directory or ZIP file.
+
+    If `vsizip` is True, ZIP files are read in place through GDAL's /vsizip/
+    virtual file system, instead of being decompressed to temporary directories.
+
+    The `convert_3d_to_2d` argument is deprecated and ignored. `loadshapefiles
+    --clean` drops Z coordinates as it loads features.
     """
+    if convert_3d_to_2d is not None:
+        warnings.warn(
+            'The convert_3d_to_2d argument of create_data_sources is deprecated and ignored.',
+            DeprecationWarning,
+            stacklevel=2,
+        )
 
     def create_data_source(path):
-        if convert_3d_to_2d and '_cleaned_' not in path:
-            source = path
-            path = path.replace('.shp', '._cleaned_.shp')
-            args = ['ogr2ogr', '-f', 'ESRI Shapefile', path, source, '-nlt', 'POLYGON']
-            if os.path.exists(path):
-                args.append('-overwrite')
-            subprocess.call(args)
-
         return DataSource(path, encoding=encoding)
 
     def create_data_sources_from_zip(path):
@@ -235,17 +1925,48 @@ def create_data_sources(path, encoding='ascii', convert_3d_to_2d=False, zipfile=
         sources it contains, along with all temporary directories created.
         """
 
+        if vsizip:
+            try:
+                with closing(ZipFile(path)) as z:
+                    return create_data_sources_from_vsizip(path, z), []
+            except GDALException as e:
+                log.warning(
+                    _('Decompressing %(path)s, which GDAL could not read in place: %(error)s')
+                    % {'path': path, 'error': e}
+                )
+
         tmpdir = mkdtemp()
 
         with closing(ZipFile(path)) as z:
             z.extractall(tmpdir)
 
-        data_sources, tmpdirs = create_data_sources(tmpdir, encoding, convert_3d_to_2d, path)
+        data_sources, tmpdirs = create_data_sources(tmpdir, encoding, zipfile=path, vsizip=vsizip)
 
         tmpdirs.insert(0, tmpdir)
 
         return data_sources, tmpdirs
 
+    def create_data_sources_from_vsizip(path, z):
+        """
+        Returns the data sources in an open ZIP file, including those in ZIP
+        files within the ZIP file, without decompressing anything to disk.
+        """
+
+        data_sources = []
+
+        archive = '/vsizip/{%s}' % path
+        for name in sorted(z.namelist()):
+            if name.endswith('.shp'):
+                if '_cleaned_' not in name:
+                    data_source = create_data_source(f'{archive}/{name}')
+                    data_source.zipfile = path  # to trace the data source back to its ZIP file
+                    data_sources.append(data_source)
+            elif name.endswith('.zip'):
+                with closing(ZipFile(z.open(name))) as nested:
+                    data_sources += create_data_sources_from_vsizip(f'{archive}/{name}', nested)
+
+        return data_sources
+
     if os.path.isfile(path):
         if path.endswith('.shp'):
             return [create_data_source(path)], []
@@ -264,7 +1985,7 @@ def create_data_sources(path, encoding='ascii', convert_3d_to_2d=False, zipfile=
         for basename in sorted(filenames):
             filename = os.path.join(dirpath, basename)
             if filename.endswith('.shp'):
-                if '_cleaned_' not in filename:  # don't load the cleaned copy twice
+                if '_cleaned_' not in filename:  # skip copies written by --clean in earlier versions
                     data_source = create_data_source(filename)
                     if zipfile:
                         data_source.zipfile = zipfile  # to trace the data source back to its ZIP file
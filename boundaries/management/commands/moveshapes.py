@@ -0,0 +1,50 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.translation import gettext as _
+
+from boundaries.models import Boundary, BoundarySet, StoredShape, app_settings
+from boundaries.storage import move_shapes, restore_shapes
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = _(
+        "Move boundaries' shapes to a separate table, for the SEPARATE_SHAPES or DEDUPLICATE_SHAPES setting, or "
+        'back to the boundaries table with --back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', nargs='*', help=_('The slugs of the boundary sets to move. Defaults to all.'))
+        parser.add_argument(
+            '--back',
+            action='store_true',
+            dest='back',
+            default=False,
+            help=_('Move the shapes back to the boundaries table, before disabling SEPARATE_SHAPES.'),
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(_('moveshapes requires PostgreSQL.'))
+
+        boundary_sets = BoundarySet.objects.order_by('slug')
+        if options['slug']:
+            boundary_sets = boundary_sets.filter(slug__in=options['slug'])
+
+        function = restore_shapes if options['back'] else move_shapes
+        for boundary_set in boundary_sets:
+            with transaction.atomic():
+                count = function(boundary_set)
+            log.info(_('%(slug)s: moved %(count)i shapes.') % {'slug': boundary_set.slug, 'count': count})
+
+        if app_settings.DEDUPLICATE_SHAPES and not options['back']:
+            log.info(
+                _('%(boundaries)i boundaries share %(shapes)i stored shapes.')
+                % {
+                    'boundaries': Boundary.objects.filter(stored_shape__isnull=False).count(),
+                    'shapes': StoredShape.objects.count(),
+                }
+            )
@@ -0,0 +1,51 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.translation import gettext as _
+
+from boundaries import partitioning
+from boundaries.models import BoundarySet
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = _(
+        'Partition the boundaries table by boundary set, and attach a partition for each boundary set, or detach '
+        "partitions with --detach. The partitioned table's primary key is (id, set_id), and the foreign keys to it "
+        "are dropped, unlike in Django's migrations; review later migrations of these tables before applying them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', nargs='*', help=_('The slugs of the boundary sets to partition. Defaults to all.'))
+        parser.add_argument(
+            '--detach',
+            action='store_true',
+            dest='detach',
+            default=False,
+            help=_("Move the boundary sets' boundaries to the default partition, and drop their partitions."),
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(_('partitionboundaries requires PostgreSQL.'))
+
+        slugs = options['slug'] or list(BoundarySet.objects.order_by('slug').values_list('slug', flat=True))
+
+        with transaction.atomic():
+            if options['detach']:
+                if not partitioning.is_partitioned():
+                    raise CommandError(_('The boundaries table is not partitioned.'))
+                for slug in slugs:
+                    if partitioning.has_partition(slug):
+                        partitioning.detach_partition(slug)
+                        log.info(_('%(slug)s: detached partition.') % {'slug': slug})
+            elif partitioning.is_partitioned():
+                for slug in slugs:
+                    if not partitioning.has_partition(slug):
+                        partitioning.create_partition(slug)
+                        log.info(_('%(slug)s: attached partition.') % {'slug': slug})
+            else:
+                partitioning.partition_table(slugs)
+                log.info(_('Partitioned the boundaries table into %(count)i partitions.') % {'count': len(slugs)})
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0009_alter_boundaryset_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boundary',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text="A hash of the boundary's geometry and attributes, to detect changes when reloading.", max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0010_boundary_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boundaryset',
+            name='fingerprint',
+            field=models.CharField(blank=True, help_text="A hash of the set's source files and definition file, to detect changes when reloading.", max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:49
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0011_boundaryset_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimplifiedShape',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField(help_text='The tolerance with which the shape is simplified.')),
+                ('shape', django.contrib.gis.db.models.fields.MultiPolygonField(help_text='The simplified geometry of the boundary in EPSG:4326.', srid=4326)),
+                ('boundary', models.ForeignKey(help_text='The boundary whose shape is simplified.', on_delete=django.db.models.deletion.CASCADE, related_name='simplified_shapes', to='boundaries.boundary')),
+            ],
+            options={
+                'verbose_name': 'simplified shape',
+                'verbose_name_plural': 'simplified shapes',
+                'unique_together': {('boundary', 'tolerance')},
+            },
+        ),
+    ]
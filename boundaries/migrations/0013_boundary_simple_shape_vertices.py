@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0012_simplifiedshape'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boundary',
+            name='simple_shape_tolerance',
+            field=models.FloatField(blank=True, help_text='The tolerance with which the simplified geometry was simplified.', null=True),
+        ),
+        migrations.AddField(
+            model_name='boundary',
+            name='simple_shape_vertices',
+            field=models.IntegerField(blank=True, help_text='The number of vertices in the simplified geometry.', null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:54
+
+import django.contrib.gis.db.models.fields
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0013_boundary_simple_shape_vertices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadCheckpoint',
+            fields=[
+                ('slug', models.SlugField(help_text='The slug of the boundary set being loaded.', max_length=200, primary_key=True, serialize=False)),
+                ('fingerprint', models.CharField(blank=True, help_text="The boundary set's fingerprint, to not resume from a checkpoint of other source files.", max_length=64)),
+                ('data_source', models.CharField(blank=True, help_text='The index and relative path of the data source being loaded.', max_length=1024)),
+                ('position', models.IntegerField(default=0, help_text='The number of features read from the data source.')),
+                ('count', models.IntegerField(default=0, help_text='The number of boundaries staged.')),
+                ('extent', models.JSONField(blank=True, help_text='The bounding box of the boundaries staged as a list like [xmin, ymin, xmax, ymax] in EPSG:4326.', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='The time at which the checkpoint was recorded.')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StagedBoundary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('set_name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(db_index=False, max_length=200)),
+                ('external_id', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=192)),
+                ('metadata', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('shape', django.contrib.gis.db.models.fields.MultiPolygonField(spatial_index=False, srid=4326)),
+                ('simple_shape', django.contrib.gis.db.models.fields.MultiPolygonField(spatial_index=False, srid=4326)),
+                ('simple_shape_tolerance', models.FloatField(null=True)),
+                ('simple_shape_vertices', models.IntegerField(null=True)),
+                ('centroid', django.contrib.gis.db.models.fields.PointField(null=True, spatial_index=False, srid=4326)),
+                ('extent', models.JSONField(null=True)),
+                ('label_point', django.contrib.gis.db.models.fields.PointField(null=True, spatial_index=False, srid=4326)),
+                ('start_date', models.DateField(null=True)),
+                ('end_date', models.DateField(null=True)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('set', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='boundaries.boundaryset')),
+            ],
+        ),
+    ]
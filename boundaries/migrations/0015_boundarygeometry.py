@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:59
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0014_stagedboundary_loadcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoundaryGeometry',
+            fields=[
+                ('boundary', models.OneToOneField(help_text='The boundary whose shape this is.', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='geometry', serialize=False, to='boundaries.boundary')),
+                ('shape', django.contrib.gis.db.models.fields.MultiPolygonField(help_text='The geometry of the boundary in EPSG:4326.', srid=4326)),
+            ],
+            options={
+                'verbose_name': 'boundary geometry',
+                'verbose_name_plural': 'boundary geometries',
+            },
+        ),
+    ]
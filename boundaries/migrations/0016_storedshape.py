@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:06
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boundaries', '0015_boundarygeometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredShape',
+            fields=[
+                ('hash', models.CharField(help_text="A SHA-256 hash of the shape's normalized WKB.", max_length=64, primary_key=True, serialize=False)),
+                ('shape', django.contrib.gis.db.models.fields.MultiPolygonField(help_text='The geometry in EPSG:4326.', srid=4326)),
+            ],
+            options={
+                'verbose_name': 'stored shape',
+                'verbose_name_plural': 'stored shapes',
+            },
+        ),
+        migrations.AddField(
+            model_name='boundary',
+            name='stored_shape',
+            field=models.ForeignKey(blank=True, help_text="The boundary's shape, if DEDUPLICATE_SHAPES is set, in which case its own shape is empty.", null=True, on_delete=django.db.models.deletion.PROTECT, related_name='boundaries', to='boundaries.storedshape'),
+        ),
+        migrations.AddField(
+            model_name='stagedboundary',
+            name='stored_shape',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='boundaries.storedshape'),
+        ),
+    ]
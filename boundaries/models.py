@@ -1,10 +1,15 @@
+import hashlib
+import json
 import re
+from ctypes import c_double, c_int
+from functools import lru_cache
 
 from appconf import AppConf
 from django.contrib.gis.db import models
 from django.contrib.gis.gdal import CoordTransform, OGRGeometry, OGRGeomType, SpatialReference
-from django.contrib.gis.geos import GEOSGeometry
-
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
+from django.contrib.gis.geos.libgeos import GEOM_PTR
+from django.contrib.gis.geos.prototypes.geom import GeomOutput
 from django.core.serializers.json import DjangoJSONEncoder
 from django.template import defaultfilters
 from django.urls import reverse
@@ -25,6 +30,30 @@ class MyAppConf(AppConf):
     # The tolerance parameter to PostGIS' ST_Simplify function.
     SIMPLE_SHAPE_TOLERANCE = 0.0002
 
+    # Additional tolerances at which to simplify boundaries' shapes when
+    # loading, e.g. [0.01, 0.002, 0.00005]. A request for a boundary's
+    # simple_shape with a "resolution" parameter (in degrees per pixel) is
+    # served the coarsest simplification whose tolerance doesn't exceed it.
+    SIMPLE_SHAPE_TOLERANCES = []
+
+    # Whether to store boundaries' full shapes in a separate table, which is
+    # joined only by the shape endpoints and spatial filters, to keep the rows
+    # of the boundaries table narrow. After changing this setting, run the
+    # moveshapes management command (with --back, if disabling).
+    SEPARATE_SHAPES = False
+
+    # Whether to store each distinct full shape once, in a table keyed by a hash
+    # of the normalized shape, which boundaries reference, so that a shape that
+    # is reused across boundary sets is stored and indexed once. Takes
+    # precedence over SEPARATE_SHAPES. After changing this setting, run the
+    # moveshapes management command (with --back, if disabling).
+    DEDUPLICATE_SHAPES = False
+
+    # The size of the grid, in degrees, to which boundaries' shapes are snapped
+    # when loading, e.g. 0.000001 (about 10 cm), to drop insignificant digits
+    # and vertices. A definition's `precision` overrides it. None to not snap.
+    PRECISION = None
+
     # The Access-Control-Allow-Origin header's value.
     ALLOW_ORIGIN = '*'
 
@@ -37,6 +66,29 @@ def slugify(value):
     return defaultfilters.slugify(slug_re.sub('-', value))
 
 
+# GEOS's precision reducer, which Django doesn't expose.
+set_precision = GeomOutput('GEOSGeom_setPrecision', argtypes=[GEOM_PTR, c_double, c_int])
+
+
+@lru_cache(maxsize=None)
+def wgs84():
+    return SpatialReference(4326)
+
+
+_coord_transforms = {}
+
+
+def get_coord_transform(srs):
+    """
+    Returns a cached transformation from the spatial reference system to
+    EPSG:4326, instead of creating one for each feature.
+    """
+    key = srs.wkt
+    if key not in _coord_transforms:
+        _coord_transforms[key] = CoordTransform(srs, wgs84())
+    return _coord_transforms[key]
+
+
 class BoundarySet(models.Model):
 
     """
@@ -101,6 +153,11 @@ class BoundarySet(models.Model):
         blank=True,
         help_text=_("Any additional metadata."),
     )
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text=_("A hash of the set's source files and definition file, to detect changes when reloading."),
+    )
 
     name_plural = property(lambda s: s.name)
     name_singular = property(lambda s: s.singular)
@@ -211,6 +268,16 @@ class Boundary(models.Model):
     simple_shape = models.MultiPolygonField(
         help_text=_('The simplified geometry of the boundary in EPSG:4326.'),
     )
+    simple_shape_tolerance = models.FloatField(
+        blank=True,
+        null=True,
+        help_text=_('The tolerance with which the simplified geometry was simplified.'),
+    )
+    simple_shape_vertices = models.IntegerField(
+        blank=True,
+        null=True,
+        help_text=_('The number of vertices in the simplified geometry.'),
+    )
     centroid = models.PointField(
         null=True,
         help_text=_('The centroid of the boundary in EPSG:4326.'),
@@ -236,6 +303,19 @@ class Boundary(models.Model):
         null=True,
         help_text=_("The date until which the boundary is in effect."),
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text=_("A hash of the boundary's geometry and attributes, to detect changes when reloading."),
+    )
+    stored_shape = models.ForeignKey(
+        'StoredShape',
+        blank=True,
+        null=True,
+        related_name='boundaries',
+        on_delete=models.PROTECT,
+        help_text=_("The boundary's shape, if DEDUPLICATE_SHAPES is set, in which case its own shape is empty."),
+    )
 
     api_fields = [
         'boundary_set_name', 'name', 'metadata', 'external_id', 'extent', 'centroid', 'start_date', 'end_date'
@@ -301,6 +381,46 @@ class Boundary(models.Model):
             } for b in boundaries
         ]
 
+    @staticmethod
+    def get_shape_field():
+        """
+        Returns the lookup of boundaries' shapes, which are in StoredShape if
+        DEDUPLICATE_SHAPES is set, or in BoundaryGeometry if SEPARATE_SHAPES is.
+        """
+        if app_settings.DEDUPLICATE_SHAPES:
+            return 'stored_shape__shape'
+        if app_settings.SEPARATE_SHAPES:
+            return 'geometry__shape'
+        return 'shape'
+
+    def get_shape(self):
+        """
+        Returns the boundary's shape, from StoredShape if DEDUPLICATE_SHAPES is
+        set, or from BoundaryGeometry if SEPARATE_SHAPES is.
+        """
+        if app_settings.DEDUPLICATE_SHAPES:
+            return self.stored_shape.shape
+        if app_settings.SEPARATE_SHAPES:
+            return self.geometry.shape
+        return self.shape
+
+    def compute_content_hash(self):
+        """
+        Returns a SHA-256 hash of the boundary's shape (as WKB) and attributes.
+        """
+        attributes = {
+            'set_name': self.set_name,
+            'external_id': self.external_id,
+            'name': self.name,
+            'metadata': self.metadata,
+            'label_point': self.label_point and self.label_point.wkt,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+        }
+        content_hash = hashlib.sha256(bytes(self.shape.wkb))
+        content_hash.update(json.dumps(attributes, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8'))
+        return content_hash.hexdigest()
+
     def merge(self, geometry):
         """
         Merges the boundary's shape with the geometry (EPSG:4326) and its
@@ -310,6 +430,8 @@ class Boundary(models.Model):
 
         self.shape = Geometry(self.shape.ogr).merge(geometry).wkt
         self.simple_shape = Geometry(self.simple_shape.ogr).merge(simple_geometry).wkt
+        self.simple_shape_tolerance = app_settings.SIMPLE_SHAPE_TOLERANCE
+        self.simple_shape_vertices = self.simple_shape.num_coords
 
     def unary_union(self, geometry):
         """
@@ -320,6 +442,171 @@ class Boundary(models.Model):
 
         self.shape = geometry.wkt
         self.simple_shape = geometry.simplify().wkt
+        self.simple_shape_tolerance = app_settings.SIMPLE_SHAPE_TOLERANCE
+        self.simple_shape_vertices = self.simple_shape.num_coords
+
+
+class BoundaryGeometry(models.Model):
+
+    """
+    The shape of a boundary, stored apart from the boundary if SEPARATE_SHAPES
+    is set, in which case the boundary's own shape is empty.
+    """
+    boundary = models.OneToOneField(
+        Boundary,
+        primary_key=True,
+        related_name='geometry',
+        on_delete=models.CASCADE,
+        help_text=_('The boundary whose shape this is.'),
+    )
+    shape = models.MultiPolygonField(
+        help_text=_('The geometry of the boundary in EPSG:4326.'),
+    )
+
+    class Meta:
+        verbose_name = _('boundary geometry')
+        verbose_name_plural = _('boundary geometries')
+
+
+class StoredShape(models.Model):
+
+    """
+    A shape stored once for all boundaries with the same shape, if
+    DEDUPLICATE_SHAPES is set.
+    """
+    hash = models.CharField(
+        max_length=64,
+        primary_key=True,
+        help_text=_("A SHA-256 hash of the shape's normalized WKB."),
+    )
+    shape = models.MultiPolygonField(
+        help_text=_('The geometry in EPSG:4326.'),
+    )
+
+    class Meta:
+        verbose_name = _('stored shape')
+        verbose_name_plural = _('stored shapes')
+
+
+class SimplifiedShape(models.Model):
+
+    """
+    A simplification of a boundary's shape at one of the SIMPLE_SHAPE_TOLERANCES.
+    """
+    boundary = models.ForeignKey(
+        Boundary,
+        related_name='simplified_shapes',
+        on_delete=models.CASCADE,
+        help_text=_('The boundary whose shape is simplified.'),
+    )
+    tolerance = models.FloatField(
+        help_text=_('The tolerance with which the shape is simplified.'),
+    )
+    shape = models.MultiPolygonField(
+        help_text=_('The simplified geometry of the boundary in EPSG:4326.'),
+    )
+
+    class Meta:
+        unique_together = (('boundary', 'tolerance'),)
+        verbose_name = _('simplified shape')
+        verbose_name_plural = _('simplified shapes')
+
+    @staticmethod
+    def get_tolerance(resolution):
+        """
+        Returns the largest tolerance that doesn't exceed the resolution, among
+        the SIMPLE_SHAPE_TOLERANCES, the SIMPLE_SHAPE_TOLERANCE and zero (the
+        unsimplified shape).
+        """
+        tolerances = [0, app_settings.SIMPLE_SHAPE_TOLERANCE] + list(app_settings.SIMPLE_SHAPE_TOLERANCES)
+        return max(tolerance for tolerance in tolerances if tolerance <= resolution)
+
+
+class StagedBoundary(models.Model):
+
+    """
+    A boundary written by `loadshapefiles --stream`, before its boundary set is
+    published. Its columns match the boundary's, but it has no indexes or
+    constraints, to keep inserts cheap.
+    """
+    set = models.ForeignKey(
+        BoundarySet,
+        related_name='+',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+    )
+    set_name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=200, db_index=False)
+    external_id = models.CharField(max_length=255)
+    name = models.CharField(max_length=192)
+    metadata = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    shape = models.MultiPolygonField(spatial_index=False)
+    simple_shape = models.MultiPolygonField(spatial_index=False)
+    simple_shape_tolerance = models.FloatField(null=True)
+    simple_shape_vertices = models.IntegerField(null=True)
+    centroid = models.PointField(null=True, spatial_index=False)
+    extent = models.JSONField(null=True)
+    label_point = models.PointField(null=True, spatial_index=False)
+    start_date = models.DateField(null=True)
+    end_date = models.DateField(null=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    stored_shape = models.ForeignKey(
+        StoredShape,
+        null=True,
+        related_name='+',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+    )
+
+    @classmethod
+    def from_boundary(cls, boundary):
+        return cls(**{
+            field.attname: getattr(boundary, field.attname)
+            for field in Boundary._meta.concrete_fields
+            if field is not Boundary._meta.pk
+        })
+
+
+class LoadCheckpoint(models.Model):
+
+    """
+    The progress of `loadshapefiles --stream` through a boundary set's data
+    sources, as of the last committed batch of staged boundaries.
+    """
+    slug = models.SlugField(
+        max_length=200,
+        primary_key=True,
+        help_text=_('The slug of the boundary set being loaded.'),
+    )
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text=_("The boundary set's fingerprint, to not resume from a checkpoint of other source files."),
+    )
+    data_source = models.CharField(
+        max_length=1024,
+        blank=True,
+        help_text=_('The index and relative path of the data source being loaded.'),
+    )
+    position = models.IntegerField(
+        default=0,
+        help_text=_('The number of features read from the data source.'),
+    )
+    count = models.IntegerField(
+        default=0,
+        help_text=_('The number of boundaries staged.'),
+    )
+    extent = models.JSONField(
+        blank=True,
+        null=True,
+        help_text=_('The bounding box of the boundaries staged as a list like [xmin, ymin, xmax, ymax] in EPSG:4326.'),
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text=_('The time at which the checkpoint was recorded.'),
+    )
 
 
 class Geometry:
@@ -332,46 +619,106 @@ class Geometry:
     def __str__(self):
         return str(self.geometry)
 
-    def transform(self, srs):
+    def transform(self, srs, clean=False):
         """
         Transforms the geometry to EPSG:4326 and ensures it's a MultiPolygon.
+
+        If `clean` is True, first drops Z coordinates and keeps only the
+        Polygons of a GeometryCollection, like `ogr2ogr -dim 2 -nlt POLYGON`.
         """
-        geometry = self.geometry_to_multipolygon(self.geometry)
-        geometry.transform(CoordTransform(srs, SpatialReference(4326)))
+        geometry = self.geometry
+        if clean:
+            geometry = self.clean(geometry)
+        geometry = self.geometry_to_multipolygon(geometry)
+        geometry.transform(get_coord_transform(srs))
         return Geometry(geometry)
 
-    def simplify(self):
+    def snap(self, precision):
+        """
+        Snaps the coordinates to a grid of the given size, with GEOS's precision
+        reducer, which also removes repeated and collapsed vertices and keeps the
+        geometry valid, and ensures the result is a MultiPolygon. If the whole
+        geometry collapses, returns it unchanged.
+        """
+        geometry = self.geometry.geos
+        snapped = GEOSGeometry(set_precision(geometry.ptr, precision, 0), srid=geometry.srid)
+        if snapped.empty:
+            return Geometry(self.geometry)
+        return Geometry(self.geometry_to_multipolygon(snapped.ogr))
+
+    def simplify(self, tolerance=None):
         """
         Uses `ST_SimplifyPreserveTopology` to avoid invalid geometries and
         ensures the result is a MultiPolygon.
+
+        The tolerance defaults to the SIMPLE_SHAPE_TOLERANCE.
         """
-        geometry = self.geometry.geos.simplify(app_settings.SIMPLE_SHAPE_TOLERANCE, preserve_topology=True).ogr
+        if tolerance is None:
+            tolerance = app_settings.SIMPLE_SHAPE_TOLERANCE
+        geometry = self.geometry.geos.simplify(tolerance, preserve_topology=True).ogr
         geometry = self.geometry_to_multipolygon(geometry)  # simplify can return a Polygon
         return Geometry(geometry)
 
+    def simplify_to(self, vertices, steps=16):
+        """
+        Returns the simplification with about the smallest tolerance at which
+        the geometry has at most the given number of vertices, and the tolerance.
+
+        Doubles the tolerance from the SIMPLE_SHAPE_TOLERANCE until the budget
+        is met, then bisects for the given number of steps. If the budget can't
+        be met, returns the simplification at the largest tolerance tried.
+        """
+        geometry = self.geometry.geos
+        if geometry.num_coords <= vertices:
+            return Geometry(self.geometry.clone()), 0
+
+        xmin, ymin, xmax, ymax = geometry.extent
+        limit = max(xmax - xmin, ymax - ymin)
+
+        low, high = 0, app_settings.SIMPLE_SHAPE_TOLERANCE
+        best = geometry.simplify(high, preserve_topology=True)
+        while best.num_coords > vertices and high < limit:
+            low, high = high, high * 2
+            best = geometry.simplify(high, preserve_topology=True)
+
+        if best.num_coords <= vertices:
+            for step in range(steps):
+                middle = (low + high) / 2
+                candidate = geometry.simplify(middle, preserve_topology=True)
+                if candidate.num_coords <= vertices:
+                    high, best = middle, candidate
+                else:
+                    low = middle
+
+        return Geometry(self.geometry_to_multipolygon(best.ogr)), high
+
     def unary_union(self):
         geometry = self.geometry.geos.unary_union.ogr  # returns a Polygon
         geometry = self.geometry_to_multipolygon(geometry)
         return Geometry(geometry)
 
-    def merge(self, other):
+    def merge(self, *others):
         """
-        Creates a new MultiPolygon from the Polygons of two MultiPolygons.
+        Creates a new MultiPolygon from the Polygons of two or more MultiPolygons.
         """
-        if hasattr(other, 'geometry'):
-            other = other.geometry
-
         geometry = OGRGeometry(OGRGeomType('MultiPolygon'))
         for polygon in self.geometry:
             geometry.add(polygon)
-        for polygon in other:
-            geometry.add(polygon)
+        for other in others:
+            if hasattr(other, 'geometry'):
+                other = other.geometry
+            for polygon in other:
+                geometry.add(polygon)
         return Geometry(geometry)
 
     @property
     def wkt(self):
         return self.geometry.wkt
 
+    @property
+    def geos(self):
+        return self.geometry.geos
+
     @property
     def centroid(self):
         return self.geometry.geos.centroid  # centroid is in GEOS
@@ -380,6 +727,32 @@ class Geometry:
     def extent(self):
         return self.geometry.extent
 
+    @staticmethod
+    def clean(geometry):
+        """
+        Returns a 2D copy of the geometry, replacing a GeometryCollection with
+        a MultiPolygon of its Polygons.
+        """
+        geometry = geometry.clone()
+        if hasattr(geometry, 'set_3d'):  # Django >= 5.1
+            geometry.set_3d(False)
+        else:
+            geometry.coord_dim = 2
+
+        if geometry.__class__.__name__ == 'GeometryCollection':
+            multipolygon = OGRGeometry(OGRGeomType('MultiPolygon'))
+            for member in geometry:
+                value = member.__class__.__name__
+                if value == 'Polygon':
+                    multipolygon.add(member)
+                elif value == 'MultiPolygon':
+                    for polygon in member:
+                        multipolygon.add(polygon)
+            if multipolygon.geom_count:
+                return multipolygon
+
+        return geometry
+
     @staticmethod
     def geometry_to_multipolygon(geometry):
         """
@@ -399,13 +772,31 @@ class Geometry:
 
 
 class Feature:
-
     # @see https://github.com/django/django/blob/master/django/contrib/gis/gdal/feature.py
-    def __init__(self, feature, definition, srs=None, boundary_set=None, start_date=None, end_date=None):
-        srs = srs or SpatialReference(4326)
+    def __init__(
+        self,
+        feature,
+        definition,
+        srs=None,
+        boundary_set=None,
+        start_date=None,
+        end_date=None,
+        clean=False,
+        geometry=None,
+    ):
+        """
+        If `geometry` is set, it is the feature's geometry, already transformed
+        to EPSG:4326, e.g. by `boundaries.reproject.transform_features`.
+        """
+        srs = srs or wgs84()
         self.feature = feature
         self.definition = definition
-        self.geometry = Geometry(feature.geom).transform(srs)
+        self.indexes = getattr(definition, 'indexes', None)  # if a CompiledDefinition
+        self._results = {}
+        if geometry is None:
+            geometry = Geometry(feature.geom).transform(srs, clean=clean)
+        self.snapped = None
+        self.geometry = geometry
         self.boundary_set = boundary_set
         self.start_date = start_date
         self.end_date = end_date
@@ -414,33 +805,50 @@ class Feature:
         return self.name
 
     def get(self, field):
+        if self.indexes is not None and field in self.indexes:
+            return self.feature[self.indexes[field]].value
         return self.feature.get(field)
 
+    def evaluate(self, key):
+        """
+        Returns the result of the definition's function, calling each function
+        at most once per feature, e.g. if `slug_func` is `name_func`.
+        """
+        function = self.definition[key]
+        try:
+            return self._results[function]
+        except KeyError:
+            result = self._results[function] = function(self)
+            return result
+
     def is_valid(self):
-        return self.definition['is_valid_func'](self)
+        return self.evaluate('is_valid_func')
 
     @property
     def name(self):
-        return self.definition['name_func'](self)
+        return self.evaluate('name_func')
 
     @property
     def id(self):
         # Coerce to string, as the field in the feature from which the ID is
         # derived may be numeric.
-        return str(self.definition['id_func'](self))
+        return str(self.evaluate('id_func'))
 
     @property
     def slug(self):
         # Coerce to string, as the field in the feature from which the slug is
         # derived may be numeric.
-        return slugify(str(self.definition['slug_func'](self)))
+        return slugify(str(self.evaluate('slug_func')))
 
     @property
     def label_point(self):
-        return self.definition['label_point_func'](self)
+        return self.evaluate('label_point_func')
 
     @property
     def metadata(self):
+        if self.indexes is not None:
+            return {key: self.feature[index].value for key, index in self.indexes.items()}
+
         d = {}
         for field in self.feature.fields:
             if isinstance(field, bytes):
@@ -458,22 +866,65 @@ class Feature:
     def boundary_set(self, value):
         self._boundary_set = value
 
-    def create_boundary(self):
-        return Boundary.objects.create(
+    def snap(self):
+        """
+        If the definition's `precision` or the PRECISION setting is set, snaps
+        the geometry to that grid, once, and sets `snapped` to the numbers of
+        vertices and WKB bytes saved.
+        """
+        precision = self.definition.get('precision') or app_settings.PRECISION
+        if precision and self.snapped is None:
+            snapped = self.geometry.snap(precision)
+            self.snapped = (
+                self.geometry.geometry.point_count - snapped.geometry.point_count,
+                self.geometry.geometry.wkb_size - snapped.geometry.wkb_size,
+            )
+            self.geometry = snapped
+
+    def build_boundary(self, derived=True):
+        """
+        Returns an unsaved boundary, e.g. to insert many boundaries at once.
+        Snaps the geometry first, if a precision is set.
+
+        If the definition sets `simple_shape_vertices`, simplifies the shape
+        with about the smallest tolerance that meets this budget.
+
+        If `derived` is False, leaves the boundary's simple_shape empty and its
+        centroid and extent unset, for the database to derive from its shape.
+        """
+        self.snap()
+        boundary = Boundary(
             set=self.boundary_set,
             set_name=self.boundary_set.singular,
             external_id=self.id,
             name=self.name,
             slug=self.slug,
             metadata=self.metadata,
-            shape=self.geometry.wkt,
-            simple_shape=self.geometry.simplify().wkt,
-            centroid=self.geometry.centroid,
-            extent=self.geometry.extent,
+            shape=self.geometry.geos,
             label_point=self.label_point,
             start_date=self.start_date,
             end_date=self.end_date,
         )
+        if derived:
+            vertices = self.definition.get('simple_shape_vertices')
+            if vertices:
+                simple_shape, tolerance = self.geometry.simplify_to(vertices)
+            else:
+                simple_shape, tolerance = self.geometry.simplify(), app_settings.SIMPLE_SHAPE_TOLERANCE
+            boundary.simple_shape_tolerance = tolerance
+            boundary.simple_shape = simple_shape.geos
+            boundary.simple_shape_vertices = boundary.simple_shape.num_coords
+            boundary.centroid = self.geometry.centroid
+            boundary.extent = self.geometry.extent
+        else:
+            boundary.simple_shape = MultiPolygon(srid=4326)
+        boundary.content_hash = boundary.compute_content_hash()
+        return boundary
+
+    def create_boundary(self):
+        boundary = self.build_boundary()
+        boundary.save(force_insert=True)
+        return boundary
 
 
 class Definition:
@@ -521,3 +972,17 @@ class Definition:
 
     def get(self, key, default=None):
         return self.dictionary.get(key, default)
+
+
+class CompiledDefinition(Definition):
+    """
+    A definition bound to a layer's fields, so that its features read fields
+    by index, instead of looking up each field by name for each feature.
+    """
+    def __init__(self, definition, fields):
+        self.dictionary = definition.dictionary
+        self.indexes = {}
+        for index, field in enumerate(fields):
+            if isinstance(field, bytes):
+                field = field.decode()
+            self.indexes[field] = index
@@ -0,0 +1,251 @@
+"""
+Partitions the boundaries table by boundary set, with PostgreSQL's declarative
+list partitioning, so that a query for one boundary set scans only that set's
+partition, and a boundary set is reloaded by swapping its partition instead of
+deleting its rows. Boundaries of sets without a partition of their own are
+stored in a default partition.
+
+The partitioned table diverges from the schema of Django's migrations, which
+still describe the unpartitioned table:
+
+* PostgreSQL requires a partitioned table's unique keys to include the
+  partition key, so the primary key is (id, set_id). An identity column
+  continues the ids of the unpartitioned table, so ids remain unique, and
+  Django still treats the id as the primary key.
+* The foreign keys from the simplified shapes and separate shapes tables to
+  the boundaries table are dropped, so that partitions can be swapped. Their
+  rows are deleted with their boundaries by Django's cascading delete or by
+  `replace_partition`.
+
+`makemigrations` doesn't detect these differences. Migrations that alter the
+boundaries table, its primary key, or the foreign keys to it must be reviewed
+before they are applied to a partitioned database, and may need to be applied
+by hand.
+"""
+import hashlib
+import re
+
+from django.db import connection
+
+from boundaries.models import Boundary, BoundaryGeometry, SimplifiedShape
+
+# The name of the CHECK constraint with which a table is attached as a partition without a scan.
+CHECK_CONSTRAINT = 'boundaries_partition_check'
+
+
+def _table():
+    return Boundary._meta.db_table
+
+
+def _columns(*names):
+    return [connection.ops.quote_name(Boundary._meta.get_field(name).column) for name in names]
+
+
+def partition_name(slug):
+    """
+    Returns the name of the boundary set's partition.
+    """
+    digest = hashlib.md5(slug.encode()).hexdigest()[:8]
+    return f"{_table()}_{re.sub(r'[^a-z0-9]+', '_', slug.lower())[:28]}_{digest}"
+
+
+def default_partition_name():
+    return f'{_table()}_default'
+
+
+def is_partitioned():
+    """
+    Returns whether the boundaries table is partitioned.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [_table()])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def has_partition(slug):
+    """
+    Returns whether the boundary set has a partition of its own.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(%s) AND inhrelid = to_regclass(%s)',
+            [_table(), partition_name(slug)],
+        )
+        return cursor.fetchone() is not None
+
+
+def partition_table(slugs):
+    """
+    Converts the boundaries table into a table partitioned by boundary set,
+    with a partition for each of the boundary sets and a default partition.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(_table())
+    old = f'{_table()}_unpartitioned'
+    pk, set_id = _columns('id', 'set')
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conrelid::regclass::text, conname FROM pg_constraint '
+            "WHERE confrelid = %s::regclass AND contype = 'f'",
+            [_table()],
+        )
+        for relation, name in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {relation} DROP CONSTRAINT {quote_name(name)}')
+
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {quote_name(old)}')
+
+        # Index and constraint names are kept, so they are dropped from the old table first.
+        cursor.execute(
+            'SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint '
+            "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')",
+            [old],
+        )
+        constraints = cursor.fetchall()
+        for name, kind, definition in constraints:
+            cursor.execute(f'ALTER TABLE {quote_name(old)} DROP CONSTRAINT {quote_name(name)}')
+        cursor.execute(
+            'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid '
+            'WHERE x.indrelid = %s::regclass',
+            [old],
+        )
+        indexes = cursor.fetchall()
+        for name, definition in indexes:
+            cursor.execute(f'DROP INDEX {quote_name(name)}')
+
+        cursor.execute(
+            f'CREATE TABLE {table} (LIKE {quote_name(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY LIST ({set_id})'
+        )
+        cursor.execute(f'ALTER TABLE {table} ALTER COLUMN {pk} DROP DEFAULT')
+        cursor.execute(f'ALTER TABLE {table} ALTER COLUMN {pk} ADD GENERATED BY DEFAULT AS IDENTITY')
+        for name, kind, definition in constraints:
+            if kind == 'p':
+                definition = f'PRIMARY KEY ({pk}, {set_id})'
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {quote_name(name)} {definition}')
+        for name, definition in indexes:
+            cursor.execute(re.sub(r' ON (ONLY )?\S+ USING ', f' ON {table} USING ', definition, count=1))
+
+        cursor.execute(f'CREATE TABLE {quote_name(default_partition_name())} PARTITION OF {table} DEFAULT')
+        for slug in slugs:
+            cursor.execute(
+                f'CREATE TABLE {quote_name(partition_name(slug))} PARTITION OF {table} FOR VALUES IN (%s)', [slug]
+            )
+
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {quote_name(old)}')
+        cursor.execute(
+            f'SELECT setval(pg_get_serial_sequence(%s, %s), GREATEST(MAX({pk}), 1)) FROM {table}',
+            [_table(), Boundary._meta.pk.column],
+        )
+        cursor.execute(f'DROP TABLE {quote_name(old)}')
+
+
+def create_table(name):
+    """
+    Creates a table like a partition of the boundaries table, with its indexes,
+    to be attached as a partition.
+    """
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {quote_name(name)}')
+        cursor.execute(
+            f'CREATE TABLE {quote_name(name)} '
+            f'(LIKE {quote_name(_table())} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES)'
+        )
+
+
+def add_check(name, slug):
+    """
+    Adds a CHECK constraint to the table that its rows are the boundary set's,
+    so that `attach` doesn't scan it. Adding the constraint scans the table, so
+    it is added while the table is loaded, before the boundaries table is locked.
+    """
+    quote_name = connection.ops.quote_name
+    (set_id,) = _columns('set')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE {quote_name(name)} ADD CONSTRAINT {CHECK_CONSTRAINT} '
+            f'CHECK ({set_id} IS NOT NULL AND {set_id} = %s)',
+            [slug],
+        )
+
+
+def attach(name, slug):
+    """
+    Attaches the table as the boundary set's partition. The table must have the
+    CHECK constraint of `add_check`.
+    """
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'ALTER TABLE {quote_name(_table())} ATTACH PARTITION {quote_name(name)} FOR VALUES IN (%s)', [slug]
+        )
+        cursor.execute(f'ALTER TABLE {quote_name(name)} DROP CONSTRAINT {CHECK_CONSTRAINT}')
+
+
+def create_partition(slug):
+    """
+    Creates the boundary set's partition, and moves its boundaries into it from
+    the default partition.
+    """
+    quote_name = connection.ops.quote_name
+    name = partition_name(slug)
+    default = quote_name(default_partition_name())
+    (set_id,) = _columns('set')
+
+    create_table(name)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote_name(name)} SELECT * FROM {default} WHERE {set_id} = %s', [slug])
+        cursor.execute(f'DELETE FROM {default} WHERE {set_id} = %s', [slug])
+    add_check(name, slug)
+    attach(name, slug)
+
+
+def detach_partition(slug):
+    """
+    Detaches and drops the boundary set's partition, and moves its boundaries
+    into the default partition.
+    """
+    quote_name = connection.ops.quote_name
+    name = quote_name(partition_name(slug))
+    table = quote_name(_table())
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+        cursor.execute(f'INSERT INTO {table} SELECT * FROM {name}')
+        cursor.execute(f'DROP TABLE {name}')
+
+
+def replace_partition(boundary_set, name, delete_related=True):
+    """
+    Replaces the boundary set's boundaries with the table's rows, by detaching
+    and dropping the boundary set's partition, and attaching the table in its
+    place. The table's rows must have ids from the boundaries table's sequence,
+    and the table must have the CHECK constraint of `add_check`.
+
+    Unless `delete_related` is False, e.g. if the table's rows are the same
+    boundaries in another order, the rows that reference the boundary set's
+    boundaries in other tables are deleted.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(_table())
+    pk, set_id = _columns('id', 'set')
+    slug = boundary_set.slug
+
+    with connection.cursor() as cursor:
+        for model in (SimplifiedShape, BoundaryGeometry) if delete_related else ():
+            related_table = quote_name(model._meta.db_table)
+            boundary_id = quote_name(model._meta.get_field('boundary').column)
+            cursor.execute(
+                f'DELETE FROM {related_table} WHERE {boundary_id} IN (SELECT {pk} FROM {table} WHERE {set_id} = %s)',
+                [slug],
+            )
+        if has_partition(slug):
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {quote_name(partition_name(slug))}')
+            cursor.execute(f'DROP TABLE {quote_name(partition_name(slug))}')
+        else:
+            cursor.execute(f'DELETE FROM {quote_name(default_partition_name())} WHERE {set_id} = %s', [slug])
+        cursor.execute(f'ALTER TABLE {quote_name(name)} RENAME TO {quote_name(partition_name(slug))}')
+    attach(partition_name(slug), slug)
@@ -0,0 +1,128 @@
+"""
+Reprojects the geometries of many features to EPSG:4326 at once.
+
+Instead of transforming each geometry in its own call to OGR, the coordinates
+of a chunk of geometries are read from their WKB into NumPy arrays,
+transformed with a single call to OGR, and written back to the WKB. Requires
+NumPy; if NumPy isn't installed, `available()` returns False.
+"""
+import struct
+from ctypes import POINTER, c_double, c_int, c_void_p
+
+from django.contrib.gis.gdal import OGRGeometry
+from django.contrib.gis.gdal.libgdal import lgdal
+
+from boundaries.models import Geometry, get_coord_transform, wgs84
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_octtransform = lgdal.OCTTransform
+_octtransform.argtypes = [c_void_p, c_int, POINTER(c_double), POINTER(c_double), POINTER(c_double)]
+_octtransform.restype = c_int
+
+# WKB geometry types.
+POLYGON = 3
+MULTIPOLYGON = 6
+
+
+def available():
+    return np is not None
+
+
+def transform_features(features, srs, clean=False):
+    """
+    Returns the features' geometries as Geometry objects, transformed to
+    EPSG:4326 and converted to MultiPolygons, as `Geometry.transform` would.
+    """
+    geometries = []
+    for feature in features:
+        geometry = feature.geom
+        if clean:
+            geometry = Geometry.clean(geometry)
+        geometries.append(Geometry.geometry_to_multipolygon(geometry))
+
+    transformed = transform_geometries(geometries, srs)
+
+    # Transform any unsupported geometries (e.g. with Z coordinates) one at a time.
+    return [
+        Geometry(result) if result is not None else Geometry(geometry).transform(srs)
+        for geometry, result in zip(geometries, transformed)
+    ]
+
+
+def transform_geometries(geometries, srs):
+    """
+    Transforms the geometries from the spatial reference system to EPSG:4326
+    with a single call to OGR. Returns a list of new geometries, with None in
+    place of any geometry that isn't a 2D Polygon or MultiPolygon, or for all
+    geometries if any coordinate fails to transform.
+    """
+    buffers = []
+    arrays = []
+    for geometry in geometries:
+        buffer = bytearray(geometry.wkb)
+        rings = coordinate_arrays(buffer)
+        buffers.append(buffer if rings is not None else None)
+        if rings:
+            arrays.extend(rings)
+
+    if arrays:
+        coordinates = np.concatenate(arrays)
+        x = np.ascontiguousarray(coordinates[:, 0])
+        y = np.ascontiguousarray(coordinates[:, 1])
+        pointer = POINTER(c_double)
+        if not _octtransform(
+            get_coord_transform(srs).ptr, len(x), x.ctypes.data_as(pointer), y.ctypes.data_as(pointer), None
+        ):
+            return [None] * len(geometries)
+
+        # Write the transformed coordinates back to the WKB.
+        start = 0
+        for array in arrays:
+            end = start + len(array)
+            array[:, 0] = x[start:end]
+            array[:, 1] = y[start:end]
+            start = end
+
+    return [OGRGeometry(memoryview(buffer), wgs84()) if buffer is not None else None for buffer in buffers]
+
+
+def coordinate_arrays(buffer):
+    """
+    Returns writable views of the coordinates of each ring of the little-endian
+    WKB of a 2D Polygon or MultiPolygon, or None if it's any other geometry.
+    """
+    arrays = []
+
+    def read_polygon(offset):
+        if buffer[offset] != 1 or struct.unpack_from('<I', buffer, offset + 1)[0] != POLYGON:
+            raise ValueError
+        (count,) = struct.unpack_from('<I', buffer, offset + 5)
+        offset += 9
+        for _ in range(count):
+            (points,) = struct.unpack_from('<I', buffer, offset)
+            offset += 4
+            arrays.append(np.frombuffer(buffer, dtype='<f8', count=points * 2, offset=offset).reshape(points, 2))
+            offset += points * 16
+        return offset
+
+    try:
+        if buffer[0] != 1:  # big-endian
+            return None
+        (kind,) = struct.unpack_from('<I', buffer, 1)
+        if kind == POLYGON:
+            read_polygon(0)
+        elif kind == MULTIPOLYGON:
+            (count,) = struct.unpack_from('<I', buffer, 5)
+            offset = 9
+            for _ in range(count):
+                offset = read_polygon(offset)
+        else:
+            return None
+    except ValueError:
+        return None
+
+    return arrays
@@ -0,0 +1,229 @@
+"""
+Moves boundaries' shapes out of the boundaries table, for the SEPARATE_SHAPES
+and DEDUPLICATE_SHAPES settings, and back. A moved boundary's own shape is
+empty, so that its row, which most requests read, stays narrow.
+
+With SEPARATE_SHAPES, each boundary's shape moves to the BoundaryGeometry
+table. With DEDUPLICATE_SHAPES, each distinct shape moves to the StoredShape
+table, keyed by a SHA-256 hash of its normalized WKB, and boundaries reference
+it, so that a shape that is reused across boundary sets is stored once.
+"""
+import hashlib
+
+from django.contrib.gis.geos import MultiPolygon, WKBWriter
+from django.db import connection
+
+from boundaries.models import Boundary, BoundaryGeometry, StoredShape, app_settings
+
+EMPTY_SHAPE = "ST_GeomFromText('MULTIPOLYGON EMPTY', 4326)"
+
+
+def hash_expression(shape):
+    """
+    Returns the SQL expression of the hash of a shape, as `shape_hash` computes
+    it in Python.
+    """
+    return f"encode(sha256(ST_AsBinary(ST_Normalize({shape}), 'NDR')), 'hex')"
+
+
+def shape_hash(shape):
+    """
+    Returns the SHA-256 hash of the shape's normalized, little-endian WKB.
+    """
+    writer = WKBWriter()
+    writer.byteorder = 1  # NDR, as in `hash_expression`
+    return hashlib.sha256(bytes(writer.write(shape.normalize(clone=True)))).hexdigest()
+
+
+def _names():
+    quote_name = connection.ops.quote_name
+    return (
+        quote_name(Boundary._meta.db_table),
+        quote_name(BoundaryGeometry._meta.db_table),
+        *(quote_name(Boundary._meta.get_field(name).column) for name in ('id', 'shape', 'set')),
+        *(quote_name(BoundaryGeometry._meta.get_field(name).column) for name in ('boundary', 'shape')),
+    )
+
+
+def _stored_names():
+    quote_name = connection.ops.quote_name
+    return (
+        quote_name(StoredShape._meta.db_table),
+        *(quote_name(StoredShape._meta.get_field(name).column) for name in ('hash', 'shape')),
+        quote_name(Boundary._meta.get_field('stored_shape').column),
+    )
+
+
+def is_enabled():
+    """
+    Returns whether shapes are moved out of the boundaries table.
+    """
+    return app_settings.SEPARATE_SHAPES or app_settings.DEDUPLICATE_SHAPES
+
+
+def split_shapes(boundaries):
+    """
+    Replaces the boundaries' shapes with empty shapes, and returns their shapes,
+    to write to the BoundaryGeometry table with the boundaries, instead of
+    moving them there once written.
+    """
+    shapes = []
+    for boundary in boundaries:
+        shapes.append(boundary.shape)
+        boundary.shape = MultiPolygon(srid=4326)
+    return shapes
+
+
+def store_shapes(boundaries):
+    """
+    Points the boundaries to the stored shapes with the hashes of their shapes,
+    storing only the shapes that aren't stored yet, and replaces their shapes
+    with empty shapes. Returns the hashes of the shapes that were stored before.
+    """
+    hashes = [shape_hash(boundary.shape) for boundary in boundaries]
+    existing = set(StoredShape.objects.filter(hash__in=hashes).values_list('hash', flat=True))
+    shapes = {}
+    for boundary, digest in zip(boundaries, hashes):
+        if digest not in existing:
+            shapes.setdefault(digest, boundary.shape)
+        boundary.stored_shape_id = digest
+        boundary.shape = MultiPolygon(srid=4326)
+    # Another process may store the same shape in the meantime. With --jobs, no process prunes stored shapes until
+    # all are done, so a stored shape that is reused here isn't deleted before this transaction commits.
+    StoredShape.objects.bulk_create(
+        [StoredShape(hash=digest, shape=shape) for digest, shape in shapes.items()], ignore_conflicts=True
+    )
+    return existing
+
+
+def stored_hashes(boundary_set):
+    """
+    Returns the hashes of the stored shapes that the boundary set's boundaries
+    reference, to prune those that are no longer referenced once the boundary
+    set is replaced.
+    """
+    if not app_settings.DEDUPLICATE_SHAPES:
+        return []
+    queryset = Boundary.objects.filter(set=boundary_set, stored_shape__isnull=False)
+    return list(queryset.values_list('stored_shape', flat=True).distinct())
+
+
+def move_shapes(boundary_set=None, prune=True):
+    """
+    Moves the non-empty shapes of the boundary set's boundaries (or of all
+    boundaries) to the StoredShape table if DEDUPLICATE_SHAPES is set, or else
+    to the BoundaryGeometry table, replacing any shapes there, and returns the
+    number of shapes moved.
+
+    Unless `prune` is False, prunes the stored shapes that the moved boundaries
+    no longer reference.
+    """
+    table, geometry_table, pk, shape, set_id, boundary_id, geometry_shape = _names()
+    condition, params = f'NOT ST_IsEmpty({shape})', []
+    if boundary_set is not None:
+        condition, params = f'{set_id} = %s AND {condition}', [boundary_set.slug]
+
+    with connection.cursor() as cursor:
+        if app_settings.DEDUPLICATE_SHAPES:
+            stored_table, stored_hash, stored_shape, stored_shape_id = _stored_names()
+            digest = hash_expression(shape)
+            cursor.execute(
+                f'SELECT DISTINCT {stored_shape_id} FROM {table} WHERE {condition} AND {stored_shape_id} IS NOT NULL',
+                params,
+            )
+            hashes = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                f'INSERT INTO {stored_table} ({stored_hash}, {stored_shape}) '
+                f'SELECT DISTINCT ON (digest) digest, shape FROM '
+                f'(SELECT {digest} AS digest, {shape} AS shape FROM {table} WHERE {condition}) AS shapes '
+                f'ON CONFLICT ({stored_hash}) DO NOTHING',
+                params,
+            )
+            cursor.execute(
+                f'UPDATE {table} SET {stored_shape_id} = {digest}, {shape} = {EMPTY_SHAPE} WHERE {condition}', params
+            )
+            count = cursor.rowcount
+            if prune:
+                prune_stored_shapes(hashes if boundary_set is not None else None)
+            return count
+
+        cursor.execute(
+            f'INSERT INTO {geometry_table} ({boundary_id}, {geometry_shape}) '
+            f'SELECT {pk}, {shape} FROM {table} WHERE {condition} '
+            f'ON CONFLICT ({boundary_id}) DO UPDATE SET {geometry_shape} = EXCLUDED.{geometry_shape}',
+            params,
+        )
+        cursor.execute(f'UPDATE {table} SET {shape} = {EMPTY_SHAPE} WHERE {condition}', params)
+        return cursor.rowcount
+
+
+def restore_shapes(boundary_set=None):
+    """
+    Moves the shapes of the boundary set's boundaries (or of all boundaries)
+    back from the BoundaryGeometry and StoredShape tables, and returns the
+    number of shapes moved.
+    """
+    table, geometry_table, pk, shape, set_id, boundary_id, geometry_shape = _names()
+    stored_table, stored_hash, stored_shape, stored_shape_id = _stored_names()
+    condition, params, hashes = '', [], None
+    if boundary_set is not None:
+        condition, params, hashes = f' AND b.{set_id} = %s', [boundary_set.slug], stored_hashes(boundary_set)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} b SET {shape} = g.{geometry_shape} FROM {geometry_table} g '
+            f'WHERE g.{boundary_id} = b.{pk} AND ST_IsEmpty(b.{shape}){condition}',
+            params,
+        )
+        count = cursor.rowcount
+        cursor.execute(
+            f'DELETE FROM {geometry_table} g USING {table} b WHERE g.{boundary_id} = b.{pk}{condition}',
+            params,
+        )
+        # A boundary whose shape changed since it was moved keeps its own shape.
+        cursor.execute(
+            f'UPDATE {table} b SET {stored_shape_id} = NULL, '
+            f'{shape} = CASE WHEN ST_IsEmpty(b.{shape}) THEN s.{stored_shape} ELSE b.{shape} END '
+            f'FROM {stored_table} s WHERE s.{stored_hash} = b.{stored_shape_id}{condition}',
+            params,
+        )
+        count += cursor.rowcount
+    prune_stored_shapes(hashes)
+    return count
+
+
+def prune_stored_shapes(hashes=None):
+    """
+    Deletes the stored shapes with the hashes (or all stored shapes) that no
+    boundary references, and returns their number.
+    """
+    if hashes is not None and not hashes:
+        return 0
+    table = connection.ops.quote_name(Boundary._meta.db_table)
+    stored_table, stored_hash, stored_shape, stored_shape_id = _stored_names()
+    condition, params = '', []
+    if hashes is not None:
+        condition, params = f's.{stored_hash} = ANY(%s) AND ', [list(hashes)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {stored_table} s WHERE {condition}'
+            f'NOT EXISTS (SELECT 1 FROM {table} b WHERE b.{stored_shape_id} = s.{stored_hash})',
+            params,
+        )
+        return cursor.rowcount
+
+
+def shape_expression(table_alias, geometry_alias, stored_alias):
+    """
+    Returns the SQL expression of a boundary's shape, given the aliases of the
+    boundaries table and of the BoundaryGeometry and StoredShape tables, LEFT
+    JOINed on it.
+    """
+    quote_name = connection.ops.quote_name
+    shape = quote_name(Boundary._meta.get_field('shape').column)
+    geometry_shape = quote_name(BoundaryGeometry._meta.get_field('shape').column)
+    stored_shape = quote_name(StoredShape._meta.get_field('shape').column)
+    return (
+        f'CASE WHEN NOT ST_IsEmpty({table_alias}.{shape}) THEN {table_alias}.{shape} '
+        f'ELSE COALESCE({stored_alias}.{stored_shape}, {geometry_alias}.{geometry_shape}, {table_alias}.{shape}) END'
+    )
@@ -24,6 +24,7 @@ class BoundariesTestCase(TestCase):
             self.assertEqual(len(boundaries.registry), 1)
             self.assertEqual(boundaries.registry['Districts']['file'], './boundaries/tests/fixtures/foo.shp')
             self.assertEqual(boundaries.registry['Districts']['last_updated'], date(2000, 1, 1))
+            self.assertRegex(boundaries.registry['Districts']['definition_file'], r'\A\./boundaries/tests/fixtures/(bar|foo)_definition\.py\Z')
 
         logcapture.check(('boundaries', 'WARNING', 'Multiple definitions of Districts found.'))
 
@@ -4,7 +4,16 @@ from django.contrib.gis.gdal import OGRGeometry
 from django.contrib.gis.geos import GEOSGeometry, Point
 from django.test import TestCase
 
-from boundaries.models import Boundary, BoundarySet, Geometry
+from boundaries.models import (
+    Boundary,
+    BoundaryGeometry,
+    BoundarySet,
+    Geometry,
+    SimplifiedShape,
+    StagedBoundary,
+    StoredShape,
+    app_settings,
+)
 
 
 class BoundaryTestCase(TestCase):
@@ -22,6 +31,31 @@ class BoundaryTestCase(TestCase):
     def test_boundary_set_name(self):
         self.assertEqual(Boundary(set_name='Foo').boundary_set_name, 'Foo')
 
+    def test_get_shape_field(self):
+        self.assertEqual(Boundary.get_shape_field(), 'shape')
+
+        app_settings.SEPARATE_SHAPES, _ = True, app_settings.SEPARATE_SHAPES
+        self.assertEqual(Boundary.get_shape_field(), 'geometry__shape')
+        app_settings.SEPARATE_SHAPES = _
+
+        app_settings.DEDUPLICATE_SHAPES, _ = True, app_settings.DEDUPLICATE_SHAPES
+        self.assertEqual(Boundary.get_shape_field(), 'stored_shape__shape')
+        app_settings.DEDUPLICATE_SHAPES = _
+
+    def test_get_shape(self):
+        boundary = Boundary(shape='MULTIPOLYGON EMPTY')
+        boundary.geometry = BoundaryGeometry(shape='MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+        self.assertTrue(boundary.get_shape().empty)
+
+        app_settings.SEPARATE_SHAPES, _ = True, app_settings.SEPARATE_SHAPES
+        self.assertEqual(boundary.get_shape().wkt, 'MULTIPOLYGON (((0 0, 0 5, 5 5, 0 0)))')
+        app_settings.SEPARATE_SHAPES = _
+
+        boundary.stored_shape = StoredShape(hash='0' * 64, shape='MULTIPOLYGON (((0 0,0 4,4 4,0 0)))')
+        app_settings.DEDUPLICATE_SHAPES, _ = True, app_settings.DEDUPLICATE_SHAPES
+        self.assertEqual(boundary.get_shape().wkt, 'MULTIPOLYGON (((0 0, 0 4, 4 4, 0 0)))')
+        app_settings.DEDUPLICATE_SHAPES = _
+
     def test_get_dicts(self):
         boundaries = [
             ('bar', 'foo', 'Bar', 'Foo', 1),
@@ -124,12 +158,27 @@ class BoundaryTestCase(TestCase):
             ('bar', 'foo', 'Bar', 'Foo', '1'),
         ])
 
+    def test_compute_content_hash(self):
+        boundary = Boundary(name='Foo', metadata={'id': 1}, shape='MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+        content_hash = boundary.compute_content_hash()
+        self.assertRegex(content_hash, r'\A[0-9a-f]{64}\Z')
+        self.assertEqual(boundary.compute_content_hash(), content_hash)
+
+        boundary.metadata = {'id': 2}
+        self.assertNotEqual(boundary.compute_content_hash(), content_hash)
+
+        boundary.metadata = {'id': 1}
+        boundary.shape = 'MULTIPOLYGON (((0 0,0 5,5 5.0001,0 0)))'
+        self.assertNotEqual(boundary.compute_content_hash(), content_hash)
+
     def test_merge(self):
         boundary = Boundary(shape='MULTIPOLYGON (((0 0,0 5,2.5 5.0001,5 5,0 0)))', simple_shape='MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
         boundary.merge(Geometry(OGRGeometry('MULTIPOLYGON (((0 0,5 0,5.0001 2.5,5 5,0 0)))')))
 
         self.assertEqual(boundary.shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0 5,2.5 5.0001,5 5,0 0)),((0 0,5 0,5.0001 2.5,5 5,0 0)))')
         self.assertEqual(boundary.simple_shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)),((0 0,5 0,5 5,0 0)))')
+        self.assertEqual(boundary.simple_shape_tolerance, 0.0002)
+        self.assertEqual(boundary.simple_shape_vertices, 8)
 
     def test_unary_union(self):
         boundary = Boundary(shape='MULTIPOLYGON (((0 0,0 5,2.5 5.0001,5 5,0 0)))')
@@ -143,3 +192,47 @@ class BoundaryTestCase(TestCase):
             boundary.simple_shape.ogr.difference(OGRGeometry('MULTIPOLYGON (((5 5,5 0,0 0,0 5,5 5)))')).wkt,
             'POLYGON EMPTY',
         )
+
+
+class SimplifiedShapeTestCase(TestCase):
+    maxDiff = None
+
+    def test_get_tolerance(self):
+        app_settings.SIMPLE_SHAPE_TOLERANCES, _ = [0.01, 0.002, 0.00005], app_settings.SIMPLE_SHAPE_TOLERANCES
+
+        self.assertEqual(SimplifiedShape.get_tolerance(0), 0)
+        self.assertEqual(SimplifiedShape.get_tolerance(0.00001), 0)
+        self.assertEqual(SimplifiedShape.get_tolerance(0.0001), 0.00005)
+        self.assertEqual(SimplifiedShape.get_tolerance(0.0002), 0.0002)
+        self.assertEqual(SimplifiedShape.get_tolerance(0.005), 0.002)
+        self.assertEqual(SimplifiedShape.get_tolerance(1), 0.01)
+
+        app_settings.SIMPLE_SHAPE_TOLERANCES = _
+
+    def test_get_tolerance_negative(self):
+        self.assertRaises(ValueError, SimplifiedShape.get_tolerance, -1)
+
+
+class StagedBoundaryTestCase(TestCase):
+    maxDiff = None
+
+    def test_columns(self):
+        columns = {field.column for field in StagedBoundary._meta.concrete_fields}
+        for field in Boundary._meta.concrete_fields:
+            self.assertIn(field.column, columns)
+
+    def test_from_boundary(self):
+        boundary = Boundary(
+            set_id='foo',
+            slug='bar',
+            name='Bar',
+            shape='MULTIPOLYGON (((0 0,0 5,5 5,0 0)))',
+            simple_shape_vertices=4,
+        )
+        staged = StagedBoundary.from_boundary(boundary)
+        self.assertIsNone(staged.pk)
+        self.assertEqual(staged.set_id, 'foo')
+        self.assertEqual(staged.slug, 'bar')
+        self.assertEqual(staged.name, 'Bar')
+        self.assertEqual(staged.shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+        self.assertEqual(staged.simple_shape_vertices, 4)
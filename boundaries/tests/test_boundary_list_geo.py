@@ -2,7 +2,7 @@ from datetime import date
 
 from django.contrib.gis.geos import GEOSGeometry
 
-from boundaries.models import Boundary, BoundarySet
+from boundaries.models import Boundary, BoundarySet, SimplifiedShape, app_settings
 from boundaries.tests import GeoListTests, GeoTests, ViewsTests, ViewTestCase
 
 
@@ -32,3 +32,26 @@ class BoundaryListGeoTestCase(ViewTestCase, ViewsTests, GeoListTests, GeoTests):
 
         geom = GEOSGeometry('MULTIPOLYGON(((0 0,0 5,5 5,0 0)))')
         Boundary.objects.create(slug='foo', set_id='inc', shape=geom, simple_shape=geom)
+
+    def test_resolution(self):
+        app_settings.SIMPLE_SHAPE_TOLERANCES, _ = [0.01], app_settings.SIMPLE_SHAPE_TOLERANCES
+
+        SimplifiedShape.objects.create(
+            boundary=Boundary.objects.get(slug='foo'),
+            tolerance=0.01,
+            shape=GEOSGeometry('MULTIPOLYGON(((0 0,0 4,4 4,0 0)))'),
+        )
+
+        response = self.client.get('/boundaries/simple_shape', {'resolution': '0.05'})
+        self.assertResponse(response)
+        self.assertJSONEqual(response, {'objects': [{'name': '', 'simple_shape': {'type': 'MultiPolygon', 'coordinates': [[[[0.0, 0.0], [0.0, 4.0], [4.0, 4.0], [0.0, 0.0]]]]}}]})
+
+        response = self.client.get('/boundaries/simple_shape', {'resolution': '0.001'})
+        self.assertResponse(response)
+        self.assertJSONEqual(response, {'objects': [{'name': '', 'simple_shape': {'type': 'MultiPolygon', 'coordinates': [[[[0.0, 0.0], [0.0, 5.0], [5.0, 5.0], [0.0, 0.0]]]]}}]})
+
+        app_settings.SIMPLE_SHAPE_TOLERANCES = _
+
+    def test_resolution_invalid(self):
+        self.assertError(self.client.get('/boundaries/simple_shape', {'resolution': 'foo'}))
+        self.assertError(self.client.get('/boundaries/simple_shape', {'resolution': '-1'}))
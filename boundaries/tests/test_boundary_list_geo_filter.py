@@ -2,7 +2,8 @@ from datetime import date
 
 from django.contrib.gis.geos import GEOSGeometry
 
-from boundaries.models import Boundary, BoundarySet
+from boundaries.models import Boundary, BoundarySet, app_settings
+from boundaries.storage import move_shapes
 from boundaries.tests import ViewTestCase
 
 
@@ -70,6 +71,20 @@ class BoundaryListGeoFilterTestCase(ViewTestCase):
         self.assertResponse(response)
         self.assertJSONEqual(response, '{"objects": [{"shape": {"type": "MultiPolygon", "coordinates": [[[[0.0, 0.0], [0.0, 5.0], [5.0, 5.0], [0.0, 0.0]]]]}, "name": "Foo"}, {"shape": {"type": "MultiPolygon", "coordinates": [[[[1.0, 2.0], [1.0, 4.0], [3.0, 4.0], [1.0, 2.0]]]]}, "name": "Bar"}]}')
 
+    def test_filter_intersects_separate_shapes(self):
+        app_settings.SEPARATE_SHAPES, _ = True, app_settings.SEPARATE_SHAPES
+        move_shapes()
+
+        response = self.client.get(self.url, {'intersects': 'abc/bar'})
+        self.assertResponse(response)
+        self.assertJSONEqual(response, '{"objects": [{"shape": {"type": "MultiPolygon", "coordinates": [[[[0.0, 0.0], [0.0, 5.0], [5.0, 5.0], [0.0, 0.0]]]]}, "name": "Foo"}, {"shape": {"type": "MultiPolygon", "coordinates": [[[[1.0, 2.0], [1.0, 4.0], [3.0, 4.0], [1.0, 2.0]]]]}, "name": "Bar"}]}')
+
+        response = self.client.get(self.url, {'contains': '1,4'})
+        self.assertResponse(response)
+        self.assertJSONEqual(response, '{"objects": [{"shape": {"type": "MultiPolygon", "coordinates": [[[[0.0, 0.0], [5.0, 0.0], [5.0, 5.0], [0.0, 0.0]]]]}, "name": ""}]}')
+
+        app_settings.SEPARATE_SHAPES = _
+
     def test_filter_intersects_404(self):
         response = self.client.get(self.url, {'intersects': 'inc/nonexistent'})
         self.assertNotFound(response)
@@ -0,0 +1,31 @@
+from django.test import TestCase
+
+from boundaries.clustering import hilbert_index, hilbert_sort
+
+
+class ClusteringTestCase(TestCase):
+    maxDiff = None
+
+    def test_hilbert_index(self):
+        self.assertEqual([hilbert_index(x, y, 1) for x, y in ((0, 0), (0, 1), (1, 1), (1, 0))], [0, 1, 2, 3])
+
+        for order in (2, 3, 4):
+            size = 1 << order
+            cells = sorted((hilbert_index(x, y, order), x, y) for x in range(size) for y in range(size))
+            self.assertEqual([cell[0] for cell in cells], list(range(size * size)))
+            # Consecutive cells along the curve are adjacent.
+            for a, b in zip(cells, cells[1:]):
+                self.assertEqual(abs(a[1] - b[1]) + abs(a[2] - b[2]), 1)
+
+    def test_hilbert_sort(self):
+        items = [
+            ('d', [9, 0, 10, 1]),
+            ('none', None),
+            ('a', [0, 0, 1, 1]),
+            ('c', [9, 9, 10, 10]),
+            ('b', [0, 9, 1, 10]),
+        ]
+        self.assertEqual(hilbert_sort(items, 2), ['a', 'b', 'c', 'd', 'none'])
+
+    def test_hilbert_sort_without_extents(self):
+        self.assertEqual(hilbert_sort([('a', None), ('b', None)]), ['a', 'b'])
@@ -1,10 +1,10 @@
 from datetime import date
 
-from django.contrib.gis.gdal import SpatialReference
+from django.contrib.gis.gdal import DataSource, SpatialReference
 from django.contrib.gis.geos import Point
 
 from boundaries import attr, clean_attr
-from boundaries.models import BoundarySet, Definition, Feature
+from boundaries.models import BoundarySet, CompiledDefinition, Definition, Feature
 from boundaries.tests import BoundariesTestCase, FeatureProxy
 
 
@@ -50,6 +50,11 @@ class FeatureTestCase(BoundariesTestCase):
         self.assertEqual(str(self.feature), 'Valid')
         self.assertEqual(str(self.other), 'Invalid')
 
+    def test_setattr(self):
+        # Definition functions can set their own attributes on features.
+        self.feature.foo = 'bar'
+        self.assertEqual(self.feature.foo, 'bar')
+
     def test_get(self):
         self.assertEqual(self.feature.get('Name'), 'VALID')
 
@@ -102,3 +107,75 @@ class FeatureTestCase(BoundariesTestCase):
         self.assertEqual(boundary.end_date, None)
 
         self.feature.boundary_set = None
+
+    def test_evaluate(self):
+        calls = []
+
+        def name_func(feature):
+            calls.append(feature)
+            return 'Foo'
+
+        feature = Feature(FeatureProxy({}), Definition({'name': 'Districts', 'name_func': name_func}))
+        self.assertEqual(feature.name, 'Foo')
+        self.assertEqual(feature.slug, 'foo')  # slug_func defaults to name_func
+        self.assertEqual(str(feature), 'Foo')
+        self.assertEqual(len(calls), 1)
+
+    def test_compiled_definition(self):
+        layer = DataSource('boundaries/tests/definitions/polygons/test_poly.shp')[0]
+        compiled = CompiledDefinition(self.definition, layer.fields)
+        self.assertEqual(compiled.indexes, {'float': 0, 'int': 1, 'str': 2})
+        self.assertEqual(compiled['name'], 'Districts')
+
+        for feature in layer:
+            expected = Feature(feature, self.definition)
+            actual = Feature(feature, compiled)
+            self.assertEqual(actual.get('str'), expected.get('str'))
+            self.assertEqual(actual.metadata, expected.metadata)
+
+    def test_build_boundary_simple_shape_vertices(self):
+        self.feature.boundary_set = self.boundary_set
+
+        boundary = self.feature.build_boundary()
+        self.assertEqual(boundary.simple_shape_tolerance, 0.0002)
+        self.assertEqual(boundary.simple_shape_vertices, 4)
+
+        definition = Definition(dict(self.definition.dictionary, simple_shape_vertices=5))
+        boundary = Feature(self.feature.feature, definition, boundary_set=self.boundary_set).build_boundary()
+        self.assertEqual(boundary.simple_shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0.0001 0.0001,0 5,5 5,0 0)))')
+        self.assertEqual(boundary.simple_shape_tolerance, 0)
+        self.assertEqual(boundary.simple_shape_vertices, 5)
+
+        self.feature.boundary_set = None
+
+    def test_precision(self):
+        self.assertIsNone(self.feature.snapped)
+
+        definition = Definition(dict(self.definition.dictionary, precision=0.001))
+        feature = Feature(self.feature.feature, definition)
+        self.assertIsNone(feature.snapped)  # until the feature is loaded
+        self.assertEqual(feature.geometry.geometry.point_count, 5)
+
+        feature.snap()
+        self.assertEqual(feature.snapped, (1, 16))
+        self.assertEqual(feature.geometry.geometry.point_count, 4)
+
+        feature.snap()
+        self.assertEqual(feature.snapped, (1, 16))
+
+        feature = Feature(self.feature.feature, definition, boundary_set=self.boundary_set)
+        boundary = feature.build_boundary()
+        self.assertEqual(feature.snapped, (1, 16))
+        self.assertEqual(boundary.shape.num_coords, 4)
+
+    def test_build_boundary_not_derived(self):
+        self.feature.boundary_set = self.boundary_set
+
+        boundary = self.feature.build_boundary(derived=False)
+        self.assertEqual(boundary.shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0.0001 0.0001,0 5,5 5,0 0)))')
+        self.assertTrue(boundary.simple_shape.empty)
+        self.assertEqual(boundary.centroid, None)
+        self.assertEqual(boundary.extent, None)
+        self.assertEqual(boundary.content_hash, self.feature.build_boundary().content_hash)
+
+        self.feature.boundary_set = None
@@ -1,4 +1,5 @@
 from django.contrib.gis.gdal import OGRGeometry, SpatialReference
+from django.contrib.gis.geos import MultiPolygon, Point
 from django.test import TestCase
 
 from boundaries.models import Geometry
@@ -34,12 +35,60 @@ class GeometryTestCase(TestCase):
     def test_transform_nonpolygon(self):
         self.assertRaisesRegex(ValueError, r'\AThe geometry is a Point but must be a Polygon or a MultiPolygon\.\Z', Geometry(OGRGeometry('POINT (0 0)')).transform, SpatialReference(26917))
 
+    def test_transform_clean(self):
+        geometry = Geometry(OGRGeometry('POLYGON Z ((0 0 1,0 5 1,5 5 1,0 0 1))')).transform(SpatialReference(4326), clean=True)
+        self.assertEqual(geometry.geometry.coord_dim, 2)
+        self.assertEqual(geometry.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+
+    def test_transform_clean_geometrycollection(self):
+        geometry = Geometry(OGRGeometry('GEOMETRYCOLLECTION (POINT (0 0),POLYGON ((0 0,0 5,5 5,0 0)),MULTIPOLYGON (((5 0,5 3,2 0,5 0))))')).transform(SpatialReference(4326), clean=True)
+        self.assertEqual(geometry.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)),((5 0,5 3,2 0,5 0)))')
+
+    def test_transform_clean_nonpolygon(self):
+        self.assertRaisesRegex(ValueError, r'\AThe geometry is a GeometryCollection but must be a Polygon or a MultiPolygon\.\Z', Geometry(OGRGeometry('GEOMETRYCOLLECTION (POINT (0 0))')).transform, SpatialReference(4326), clean=True)
+
+    def test_snap(self):
+        geometry = Geometry(OGRGeometry('MULTIPOLYGON (((0 0,0.0001 0.0001,0 5.00012,5 5,0 0)))')).snap(0.001)
+        self.assertIsInstance(geometry, Geometry)
+        self.assertEqual(geometry.geometry.geom_name, 'MULTIPOLYGON')
+        self.assertEqual(geometry.wkt, 'MULTIPOLYGON (((0 5,5 5,0 0,0 5)))')
+
+    def test_snap_collapsed(self):
+        geometry = Geometry(OGRGeometry('MULTIPOLYGON (((0 0,0 0.0001,0.0001 0,0 0)))'))
+        self.assertEqual(geometry.snap(0.001).wkt, geometry.wkt)
+
     def test_simplify(self):
         geometry = Geometry(OGRGeometry('MULTIPOLYGON (((0 0,0.0001 0.0001,0 5,5 5,0 0)))')).simplify()
         self.assertIsInstance(geometry, Geometry)
         self.assertEqual(geometry.geometry.geom_name, 'MULTIPOLYGON')
         self.assertEqual(geometry.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
 
+    def test_simplify_with_tolerance(self):
+        geometry = Geometry(OGRGeometry('MULTIPOLYGON (((0 0,0.1 0.2,0 5,5 5,0 0)))'))
+        self.assertEqual(geometry.simplify().wkt, 'MULTIPOLYGON (((0 0,0.1 0.2,0 5,5 5,0 0)))')
+        self.assertEqual(geometry.simplify(0.5).wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+
+    def test_simplify_to(self):
+        geometry = Geometry(MultiPolygon(Point(0, 0).buffer(1, quadsegs=64)).ogr)  # 257 vertices
+
+        simplified, tolerance = geometry.simplify_to(20)
+        self.assertIsInstance(simplified, Geometry)
+        self.assertEqual(simplified.geometry.geom_name, 'MULTIPOLYGON')
+        self.assertLessEqual(simplified.geometry.geos.num_coords, 20)
+        self.assertGreater(geometry.simplify(tolerance / 2).geometry.geos.num_coords, 20)
+
+    def test_simplify_to_within_budget(self):
+        geometry = Geometry(MultiPolygon(Point(0, 0).buffer(1, quadsegs=64)).ogr)
+        simplified, tolerance = geometry.simplify_to(300)
+        self.assertEqual(tolerance, 0)
+        self.assertEqual(simplified.wkt, geometry.wkt)
+
+    def test_simplify_to_unreachable_budget(self):
+        geometry = Geometry(MultiPolygon(Point(0, 0).buffer(1, quadsegs=64)).ogr)
+        simplified, tolerance = geometry.simplify_to(3)
+        self.assertEqual(simplified.geometry.geos.num_coords, 4)  # a ring has at least four vertices
+        self.assertGreater(tolerance, 2)
+
     def test_unary_union(self):
         geometry = Geometry(OGRGeometry('MULTIPOLYGON (((0 0,0 5,5 5,0 0)),((0 0,5 0,5 5,0 0)))')).unary_union()
         self.assertIsInstance(geometry, Geometry)
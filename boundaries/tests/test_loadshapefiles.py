@@ -1,18 +1,53 @@
 import errno
+import hashlib
+import json
 import os
 import os.path
+import shutil
+import struct
 import traceback
 from datetime import date
-from zipfile import BadZipfile
+from tempfile import TemporaryDirectory
+from zipfile import BadZipfile, ZipFile
 
-from django.contrib.gis.gdal import OGRGeometry
+from django.contrib.gis.gdal import DataSource, OGRGeometry, SpatialReference
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Point, Polygon
 from django.core.management import call_command
-from django.test import TestCase
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 from testfixtures import LogCapture
+from testfixtures import StringComparison as S
 
 import boundaries
-from boundaries.management.commands.loadshapefiles import Command, create_data_sources
-from boundaries.models import BoundarySet, Definition, Feature
+from boundaries import partitioning
+from boundaries.clustering import hilbert_sort
+from boundaries.management.commands.loadshapefiles import (
+    Command,
+    CopyWriter,
+    DetachedFeature,
+    FeatureGroup,
+    Profiler,
+    checkpoint_key,
+    create_data_sources,
+    encode_copy_value,
+    filter_layer,
+    fingerprint,
+    source_files,
+    source_size,
+)
+from boundaries.models import (
+    Boundary,
+    BoundaryGeometry,
+    BoundarySet,
+    Definition,
+    Feature,
+    LoadCheckpoint,
+    SimplifiedShape,
+    StagedBoundary,
+    StoredShape,
+    app_settings,
+)
 from boundaries.tests import BoundariesTestCase, FeatureProxy
 
 
@@ -40,8 +75,483 @@ class LoadShapefilesTestCase(TestCase):  # @todo This only ensures there's no gr
             ('boundaries.management.commands.loadshapefiles', 'INFO', '2...'),
             ('boundaries.management.commands.loadshapefiles', 'INFO', '3...'),
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons count: 3'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'polygons: 3 features in \d+\.\d{2}s \(\d+\.\d features/s\)')),
         )
 
+    def test_batch_size(self):
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', batch_size=2)
+        logcapture.check(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing polygons.'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading polygons from boundaries/tests/definitions/polygons/test_poly.shp'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '1...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '2...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '3...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons count: 3'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'polygons: 3 features in \d+\.\d{2}s \(\d+\.\d features/s\)')),
+        )
+        extent = BoundarySet.objects.get(slug='polygons').extent
+        self.assertEqual([round(value, 6) for value in extent], [-1.015129, -0.558245, 0.161876, 0.839637])
+
+    def test_batch_size_with_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--batch-size cannot be combined with --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', batch_size=2, merge='union')
+
+    def test_group(self):
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', merge='union', group=True, batch_size=2)
+        logcapture.check(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing polygons.'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading polygons from boundaries/tests/definitions/polygons/test_poly.shp'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '1...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '2...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '3...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons count: 3'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'polygons: 3 features in \d+\.\d{2}s \(\d+\.\d features/s\)')),
+        )
+
+    def test_group_without_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--group requires --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', group=True)
+
+    def test_resume_without_stream(self):
+        self.assertRaisesRegex(CommandError, r'\A--resume requires --stream\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', resume=True)
+
+    def test_stream_with_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--stream cannot be combined with --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', stream=True, merge='union')
+
+    def test_stream_with_workers(self):
+        self.assertRaisesRegex(CommandError, r'\A--stream cannot be combined with --workers\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', stream=True, workers=2)
+
+    def test_stream(self):
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', stream=True, batch_size=2)
+
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+        self.assertEqual(StagedBoundary.objects.count(), 0)
+        self.assertEqual(LoadCheckpoint.objects.count(), 0)
+
+    def test_stream_resume(self):
+        LoadCheckpoint.objects.create(
+            slug='polygons',
+            fingerprint=fingerprint({
+                'file': 'boundaries/tests/definitions/polygons/',
+                'definition_file': 'boundaries/tests/definitions/polygons/definition.py',
+            }),
+            data_source='0:test_poly.shp',
+            position=2,
+            count=0,
+            extent=[None, None, None, None],
+        )
+
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', stream=True, resume=True)
+
+        # The first two features are skipped, as if they had been staged before.
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 1)
+
+    def test_stream_resume_zip(self):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'polygons.zip')
+            with ZipFile(path, 'w') as z:
+                for extension in ('dbf', 'prj', 'shp', 'shx'):
+                    z.write(f'boundaries/tests/definitions/polygons/test_poly.{extension}', f'test_poly.{extension}')
+            with open(os.path.join(tmpdir, 'definition.py'), 'w') as f:
+                f.write(
+                    'from datetime import date\n'
+                    'import boundaries\n'
+                    "boundaries.register('Polygons', last_updated=date(2000, 1, 1), name_func=boundaries.attr('str'))\n"
+                )
+            LoadCheckpoint.objects.create(
+                slug='polygons',
+                fingerprint=fingerprint({'file': tmpdir, 'definition_file': os.path.join(tmpdir, 'definition.py')}),
+                data_source='0:test_poly.shp',
+                position=2,
+                count=0,
+                extent=[None, None, None, None],
+            )
+
+            with LogCapture() as logcapture:
+                call_command('loadshapefiles', data_dir=tmpdir, stream=True, resume=True)
+
+        logcapture.check_present(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons: Resuming from feature 2 of 0:test_poly.shp.'),
+        )
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 1)
+
+    def test_stream_rerun(self):
+        path = os.path.abspath('boundaries/tests/definitions/polygons/test_poly.shp')
+        with TemporaryDirectory() as tmpdir:
+            definition_file = os.path.join(tmpdir, 'definition.py')
+            definition = (
+                'from datetime import date\n'
+                'import boundaries\n'
+                f"boundaries.register('Polygons', file={path!r}, last_updated=date(2000, 1, 1), name_func=%s)\n"
+            )
+
+            # The third feature fails, after the first two are staged and checkpointed.
+            with open(definition_file, 'w') as f:
+                f.write(definition % "lambda feature: feature.get('str') if feature.get('str') != '3' else 1 / 0")
+            with LogCapture(), self.assertRaises(ZeroDivisionError):
+                call_command('loadshapefiles', data_dir=tmpdir, stream=True, batch_size=1)
+            self.assertEqual(LoadCheckpoint.objects.get(slug='polygons').count, 2)
+
+            boundaries.registry = {}
+            with open(definition_file, 'w') as f:
+                f.write(definition % "boundaries.attr('str')")
+            with LogCapture():
+                call_command('loadshapefiles', data_dir=tmpdir, stream=True)
+
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+        self.assertEqual(StagedBoundary.objects.count(), 0)
+        self.assertEqual(LoadCheckpoint.objects.count(), 0)
+
+    def test_swap_with_incremental(self):
+        self.assertRaisesRegex(CommandError, r'\A--swap cannot be combined with --incremental\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', swap=True, incremental=True)
+
+    def test_swap_unpartitioned(self):
+        self.assertRaisesRegex(CommandError, r'\A--swap requires a partitioned boundaries table\. Run partitionboundaries first\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', swap=True)
+
+    def test_swap_partitioned(self):
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+            call_command('partitionboundaries')
+        self.assertTrue(partitioning.is_partitioned())
+        self.assertTrue(partitioning.has_partition('polygons'))
+        pks = set(Boundary.objects.values_list('pk', flat=True))
+
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', swap=True, reload=True)
+        self.assertTrue(partitioning.has_partition('polygons'))
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+        self.assertFalse(pks & set(Boundary.objects.values_list('pk', flat=True)))
+        extent = BoundarySet.objects.get(slug='polygons').extent
+        self.assertEqual([round(value, 6) for value in extent], [-1.015129, -0.558245, 0.161876, 0.839637])
+        self.assertEqual(StagedBoundary.objects.count(), 0)
+        self.assertEqual(LoadCheckpoint.objects.count(), 0)
+
+        with LogCapture():
+            call_command('partitionboundaries', 'polygons', detach=True)
+        self.assertFalse(partitioning.has_partition('polygons'))
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+
+    def test_reload_partitioned(self):
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+            call_command('partitionboundaries')
+        pks = set(Boundary.objects.values_list('pk', flat=True))
+
+        # The boundary set's partition is replaced, as with --swap.
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', reload=True)
+        self.assertTrue(partitioning.has_partition('polygons'))
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+        self.assertFalse(pks & set(Boundary.objects.values_list('pk', flat=True)))
+        self.assertEqual(StagedBoundary.objects.count(), 0)
+
+        # Boundaries that are updated in place keep their ids.
+        pks = set(Boundary.objects.values_list('pk', flat=True))
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', reload=True, incremental=True)
+        self.assertEqual(set(Boundary.objects.values_list('pk', flat=True)), pks)
+
+    def test_profile(self):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'profile.json')
+            with LogCapture():
+                call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', profile=path)
+            with open(path) as f:
+                report = json.load(f)
+
+        boundary_set = report['sets'][0]
+        self.assertEqual(boundary_set['slug'], 'polygons')
+        self.assertEqual(boundary_set['features'], 3)
+        self.assertEqual(boundary_set['loaded'], 3)
+        self.assertEqual(len(boundary_set['data_sources']), 1)
+        self.assertEqual(boundary_set['data_sources'][0]['name'], 'boundaries/tests/definitions/polygons/test_poly.shp')
+        self.assertEqual(boundary_set['data_sources'][0]['vertices'], boundary_set['vertices'])
+        self.assertEqual(set(boundary_set['phases']), {'open', 'read', 'transform', 'callbacks', 'build', 'write'})
+
+    def test_derive(self):
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', derive=True, batch_size=2)
+        extent = BoundarySet.objects.get(slug='polygons').extent
+        self.assertEqual([round(value, 6) for value in extent], [-1.015129, -0.558245, 0.161876, 0.839637])
+        for boundary in Boundary.objects.filter(set='polygons'):
+            self.assertFalse(boundary.simple_shape.empty)
+            self.assertTrue(boundary.centroid.equals_exact(boundary.shape.centroid, 1e-9))
+            self.assertEqual(boundary.extent, list(boundary.shape.extent))
+
+    def test_derive_with_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--derive cannot be combined with --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', derive=True, merge='union')
+
+    def test_defer_indexes(self):
+        def indexes():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT regexp_replace(indexdef, '^.* USING ', '') FROM pg_indexes WHERE tablename = %s",
+                    [partitioning.partition_name('polygons')],
+                )
+                return sorted(row[0] for row in cursor.fetchall())
+
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+            call_command('partitionboundaries')
+        expected = indexes()
+
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', defer_indexes=True, reload=True)
+        logcapture.check_present(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'polygons: built \d+ indexes and analyzed the new partition in \d+\.\ds\.')),
+        )
+        self.assertEqual(indexes(), expected)
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+
+    def test_defer_indexes_with_option(self):
+        for option, value in (('merge', 'union'), ('incremental', True), ('copy', True), ('workers', 2)):
+            with self.subTest(option=option):
+                self.assertRaisesRegex(CommandError, rf'\A--defer-indexes cannot be combined with --{option}\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', defer_indexes=True, **{option: value})
+
+    def test_defer_indexes_unpartitioned(self):
+        self.assertRaisesRegex(CommandError, r'\A--defer-indexes requires a partitioned boundaries table\. Run partitionboundaries first\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', defer_indexes=True)
+
+    def test_separate_shapes(self):
+        app_settings.SEPARATE_SHAPES, _ = True, app_settings.SEPARATE_SHAPES
+
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+        self.assertTrue(all(shape.empty for shape in Boundary.objects.values_list('shape', flat=True)))
+        self.assertEqual(BoundaryGeometry.objects.filter(boundary__set='polygons').count(), 3)
+        extent = BoundarySet.objects.get(slug='polygons').extent
+        self.assertEqual([round(value, 6) for value in extent], [-1.015129, -0.558245, 0.161876, 0.839637])
+
+        with LogCapture():
+            call_command('moveshapes', back=True)
+        self.assertFalse(any(shape.empty for shape in Boundary.objects.values_list('shape', flat=True)))
+        self.assertEqual(BoundaryGeometry.objects.count(), 0)
+
+        app_settings.SEPARATE_SHAPES = _
+
+    def test_separate_shapes_writers(self):
+        app_settings.SEPARATE_SHAPES, _ = True, app_settings.SEPARATE_SHAPES
+
+        for options in ({'batch_size': 2}, {'copy': True}, {'stream': True}, {'incremental': True}):
+            with self.subTest(options=options):
+                with LogCapture():
+                    call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', reload=True, **options)
+                self.assertTrue(all(shape.empty for shape in Boundary.objects.values_list('shape', flat=True)))
+                geometries = BoundaryGeometry.objects.filter(boundary__set='polygons')
+                self.assertEqual(geometries.count(), 3)
+                self.assertFalse(any(shape.empty for shape in geometries.values_list('shape', flat=True)))
+
+        app_settings.SEPARATE_SHAPES = _
+
+    def test_deduplicate_shapes(self):
+        app_settings.DEDUPLICATE_SHAPES, _ = True, app_settings.DEDUPLICATE_SHAPES
+
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+        BoundarySet.objects.create(slug='copy', last_updated=date(2000, 1, 1))
+        for boundary in Boundary.objects.filter(set='polygons').select_related('stored_shape'):
+            self.assertTrue(boundary.shape.empty)
+            Boundary.objects.create(
+                set_id='copy', slug=boundary.slug, shape=boundary.get_shape(), simple_shape=boundary.simple_shape
+            )
+
+        with LogCapture() as logcapture:
+            call_command('moveshapes', 'copy')
+        logcapture.check_present(
+            ('boundaries.management.commands.moveshapes', 'INFO', '6 boundaries share 3 stored shapes.'),
+        )
+        self.assertEqual(StoredShape.objects.count(), 3)
+
+        with LogCapture():
+            call_command('moveshapes', back=True)
+        self.assertFalse(any(shape.empty for shape in Boundary.objects.values_list('shape', flat=True)))
+        self.assertEqual(StoredShape.objects.count(), 0)
+
+        app_settings.DEDUPLICATE_SHAPES = _
+
+    def test_deduplicate_shapes_writers(self):
+        app_settings.DEDUPLICATE_SHAPES, _ = True, app_settings.DEDUPLICATE_SHAPES
+        app_settings.SIMPLE_SHAPE_TOLERANCES, tolerances = [0.01], app_settings.SIMPLE_SHAPE_TOLERANCES
+
+        # A stored shape that the boundary set never referenced is left alone.
+        StoredShape.objects.create(hash='0' * 64, shape=MultiPolygon(Polygon(((0, 0), (0, 1), (1, 1), (0, 0)))))
+
+        for options in ({'batch_size': 2}, {'copy': True}, {'stream': True}, {}):
+            with self.subTest(options=options):
+                with LogCapture():
+                    call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', reload=True, **options)
+                boundaries = Boundary.objects.filter(set='polygons')
+                self.assertTrue(all(shape.empty for shape in boundaries.values_list('shape', flat=True)))
+                self.assertEqual(boundaries.filter(stored_shape__isnull=False).count(), 3)
+                self.assertEqual(StoredShape.objects.count(), 4)
+                self.assertEqual(SimplifiedShape.objects.filter(boundary__set='polygons').count(), 3)
+
+        app_settings.DEDUPLICATE_SHAPES = _
+        app_settings.SIMPLE_SHAPE_TOLERANCES = tolerances
+
+    def test_precision(self):
+        app_settings.PRECISION, _ = 0.1, app_settings.PRECISION
+
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+        logcapture.check_present(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons: snapping to 0.1 degrees saved 3 vertices (48 bytes).'),
+        )
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+
+        app_settings.PRECISION = _
+
+    def test_cluster(self):
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', cluster=True)
+        self.assertEqual(sorted(Boundary.objects.filter(set='polygons').values_list('slug', flat=True)), ['1', '2', '3'])
+
+    def test_cluster_order(self):
+        def physical_order():
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT slug FROM {Boundary._meta.db_table} WHERE set_id = %s ORDER BY ctid', ['polygons'])
+                return [row[0] for row in cursor.fetchall()]
+
+        with LogCapture():
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+        expected = hilbert_sort(list(Boundary.objects.filter(set='polygons').values_list('slug', 'extent')))
+
+        with LogCapture():
+            call_command('clusterboundaries')
+        self.assertEqual(physical_order(), expected)
+
+        with LogCapture():
+            call_command('partitionboundaries')
+            call_command('clusterboundaries')
+        self.assertTrue(partitioning.has_partition('polygons'))
+        self.assertEqual(physical_order(), expected)
+
+        # The swapped partition is written in order.
+        for options in ({}, {'stream': True}, {'derive': True}):
+            with self.subTest(options=options):
+                with LogCapture():
+                    call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', reload=True, cluster=True, **options)
+                self.assertEqual(physical_order(), expected)
+
+    def test_copy(self):
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', copy=True)
+        logcapture.check(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing polygons.'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading polygons from boundaries/tests/definitions/polygons/test_poly.shp'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '1...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '2...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '3...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons count: 3'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'polygons: 3 features in \d+\.\d{2}s \(\d+\.\d features/s\)')),
+        )
+        boundary = Boundary.objects.get(set='polygons', slug='1')
+        self.assertEqual(boundary.shape.srid, 4326)
+        self.assertEqual(boundary.metadata, {'float': 1.0, 'int': 1, 'str': '1'})
+
+    def test_copy_with_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--copy cannot be combined with --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', copy=True, merge='union')
+
+    def test_workers(self):
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', workers=2)
+        logcapture.check(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing polygons.'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading polygons from boundaries/tests/definitions/polygons/test_poly.shp'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '1...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '2...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', '3...'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons count: 3'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'polygons: 3 features in \d+\.\d{2}s \(\d+\.\d features/s\)')),
+        )
+
+    def test_workers_with_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--workers cannot be combined with --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', workers=2, merge='union')
+
+    def test_workers_with_layer(self):
+        with TemporaryDirectory() as tmpdir:
+            with ZipFile(os.path.join(tmpdir, 'polygons.zip'), 'w') as z:
+                for extension in ('dbf', 'prj', 'shp', 'shx'):
+                    z.write(f'boundaries/tests/definitions/polygons/test_poly.{extension}', f'test_poly.{extension}')
+            with open(os.path.join(tmpdir, 'definition.py'), 'w') as f:
+                f.write(
+                    'import os.path\n'
+                    'from datetime import date\n'
+                    'import boundaries\n'
+                    "boundaries.register('Polygons', last_updated=date(2000, 1, 1), slug_func=boundaries.attr('str'),\n"
+                    "    name_func=lambda feature: os.path.basename(feature.layer.source.zipfile) + ' ' + feature.get('str'))\n"
+                )
+            call_command('loadshapefiles', data_dir=tmpdir, workers=2)
+        self.assertEqual(Boundary.objects.get(set='polygons', slug='1').name, 'polygons.zip 1')
+
+    def test_incremental(self):
+        call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons')
+        Boundary.objects.filter(set='polygons', slug='1').update(name='Changed', content_hash='')
+        Boundary.objects.filter(set='polygons', slug='3').delete()
+        Boundary.objects.create(set_id='polygons', slug='4', shape='MULTIPOLYGON (((0 0,0 5,5 5,0 0)))', simple_shape='MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+        untouched = Boundary.objects.get(set='polygons', slug='2').pk
+
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', reload=True, incremental=True)
+        logcapture.check_present(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons: 1 added, 1 changed, 1 removed, 1 untouched'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons count: 3'),
+        )
+        self.assertEqual(Boundary.objects.get(set='polygons', slug='1').name, '1')
+        self.assertEqual(Boundary.objects.get(set='polygons', slug='2').pk, untouched)
+        self.assertEqual(sorted(Boundary.objects.filter(set='polygons').values_list('slug', flat=True)), ['1', '2', '3'])
+
+    def test_incremental_coverage(self):
+        path = os.path.abspath('boundaries/tests/definitions/polygons/test_poly.shp')
+        with TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'definition.py'), 'w') as f:
+                f.write(
+                    'from datetime import date\n'
+                    'import boundaries\n'
+                    f"boundaries.register('Polygons', file={path!r}, last_updated=date(2000, 1, 1), name_func=boundaries.attr('str'), coverage=True)\n"
+                )
+
+            for setting in ('SEPARATE_SHAPES', 'DEDUPLICATE_SHAPES'):
+                with self.subTest(setting=setting):
+                    _ = getattr(app_settings, setting)
+                    setattr(app_settings, setting, True)
+
+                    with LogCapture():
+                        call_command('loadshapefiles', data_dir=tmpdir, reload=True)
+                    expected = dict(Boundary.objects.filter(set='polygons').values_list('slug', 'simple_shape'))
+
+                    # Only the first boundary is reloaded. The others' shapes are still simplified as a coverage.
+                    Boundary.objects.filter(set='polygons', slug='1').update(content_hash='')
+                    with LogCapture():
+                        call_command('loadshapefiles', data_dir=tmpdir, reload=True, incremental=True)
+                    simple_shapes = dict(Boundary.objects.filter(set='polygons').values_list('slug', 'simple_shape'))
+                    self.assertTrue(all(shape.empty for shape in Boundary.objects.values_list('shape', flat=True)))
+                    self.assertEqual(len(simple_shapes), 3)
+                    for slug, simple_shape in simple_shapes.items():
+                        self.assertFalse(simple_shape.empty)
+                        self.assertTrue(simple_shape.equals_exact(expected[slug]))
+
+                    setattr(app_settings, setting, _)
+
+    def test_incremental_with_merge(self):
+        self.assertRaisesRegex(CommandError, r'\A--incremental cannot be combined with --merge\.\Z', call_command, 'loadshapefiles', data_dir='boundaries/tests/definitions/polygons', incremental=True, merge='union')
+
+    def test_changed_only(self):
+        call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', changed_only=True)
+        self.assertRegex(BoundarySet.objects.get(slug='polygons').fingerprint, r'\A[0-9a-f]{64}\Z')
+
+        boundaries.registry = {}
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', changed_only=True)
+        logcapture.check(('boundaries.management.commands.loadshapefiles', 'DEBUG', 'Skipping polygons.'))
+
+        BoundarySet.objects.filter(slug='polygons').update(fingerprint='')
+        boundaries.registry = {}
+        with LogCapture() as logcapture:
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/polygons', changed_only=True)
+        logcapture.check_present(('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing polygons.'))
+
     def test_no_features(self):
         with LogCapture() as logcapture:
             try:
@@ -53,6 +563,7 @@ class LoadShapefilesTestCase(TestCase):  # @todo This only ensures there's no gr
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing districts.'),
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading districts from boundaries/tests/definitions/no_features/../../fixtures/foo.shp'),
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'districts count: 0'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'districts: 0 features in \d+\.\d{2}s \(0\.0 features/s\)')),
         )
 
     def test_srid(self):
@@ -66,22 +577,18 @@ class LoadShapefilesTestCase(TestCase):  # @todo This only ensures there's no gr
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing wards.'),
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading wards from boundaries/tests/definitions/srid/../../fixtures/foo.shp'),
             ('boundaries.management.commands.loadshapefiles', 'INFO', 'wards count: 0'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'wards: 0 features in \d+\.\d{2}s \(0\.0 features/s\)')),
         )
 
     def test_clean(self):
         with LogCapture() as logcapture:
-            try:
-                call_command('loadshapefiles', data_dir='boundaries/tests/definitions/no_features', clean=True)
-                logcapture.check(
-                    ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing districts.'),
-                    ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading districts from boundaries/tests/definitions/no_features/../../fixtures/foo._cleaned_.shp'),
-                    ('boundaries.management.commands.loadshapefiles', 'INFO', 'districts count: 0'),
-                )
-            except Exception as e:
-                if not hasattr(e, 'errno') or e.errno != errno.ENOENT:
-                    self.fail(f'Exception {type(e).__name__} raised: {e} {traceback.format_exc()}')
-                else:
-                    logcapture.check(('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing districts.'))
+            call_command('loadshapefiles', data_dir='boundaries/tests/definitions/no_features', clean=True)
+        logcapture.check(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Processing districts.'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'Loading districts from boundaries/tests/definitions/no_features/../../fixtures/foo.shp'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'districts count: 0'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', S(r'districts: 0 features in \d+\.\d{2}s \(0\.0 features/s\)')),
+        )
 
     def test_only(self):
         with LogCapture() as logcapture:
@@ -108,6 +615,81 @@ class LoadShapefilesTestCase(TestCase):  # @todo This only ensures there's no gr
             self.fail(f'Exception {type(e).__name__} raised: {e} {traceback.format_exc()}')
 
 
+class JobsTestCase(TransactionTestCase):
+
+    """
+    Boundary sets loaded with --jobs are loaded in other processes, with their
+    own connections, so the tests' writes must be committed.
+    """
+
+    def setUp(self):
+        boundaries.registry = {}
+        boundaries._basepath = '.'
+
+    def load(self, tmpdir, names, **options):
+        path = os.path.abspath('boundaries/tests/definitions/polygons/test_poly.shp')
+        with open(os.path.join(tmpdir, 'definition.py'), 'w') as f:
+            f.write(
+                'from datetime import date\n'
+                'import boundaries\n'
+                f'for name, name_func in {names!r}:\n'
+                f'    boundaries.register(name, file={path!r}, last_updated=date(2000, 1, 1), name_func=eval(name_func))\n'
+            )
+        call_command('loadshapefiles', data_dir=tmpdir, jobs=2, **options)
+
+    def test_jobs(self):
+        with TemporaryDirectory() as tmpdir, LogCapture() as logcapture:
+            self.load(tmpdir, [('Polygons A', "boundaries.attr('str')"), ('Polygons B', "boundaries.attr('str')")])
+        logcapture.check_present(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons-a succeeded.'),
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons-b succeeded.'),
+            order_matters=False,
+        )
+        self.assertEqual(Boundary.objects.filter(set='polygons-a').count(), 3)
+        self.assertEqual(Boundary.objects.filter(set='polygons-b').count(), 3)
+
+    def test_jobs_failure(self):
+        with TemporaryDirectory() as tmpdir, LogCapture() as logcapture:
+            with self.assertRaisesRegex(CommandError, r'\A1 of 2 boundary sets failed to load\.\Z'):
+                self.load(tmpdir, [('Polygons A', "boundaries.attr('str')"), ('Broken', 'lambda feature: 1 / 0')])
+        logcapture.check_present(
+            ('boundaries.management.commands.loadshapefiles', 'INFO', 'polygons-a succeeded.'),
+            ('boundaries.management.commands.loadshapefiles', 'ERROR', 'broken failed: ZeroDivisionError: division by zero'),
+            order_matters=False,
+        )
+        self.assertEqual(Boundary.objects.filter(set='polygons-a').count(), 3)
+        self.assertFalse(BoundarySet.objects.filter(slug='broken').exists())
+
+    def test_workers_in_transaction(self):
+        path = os.path.abspath('boundaries/tests/definitions/polygons/test_poly.shp')
+        with TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'definition.py'), 'w') as f:
+                f.write(
+                    'from datetime import date\n'
+                    'import boundaries\n'
+                    'from boundaries.models import BoundarySet\n'
+                    f"boundaries.register('Polygons', file={path!r}, last_updated=date(2000, 1, 1),\n"
+                    "    name_func=lambda feature: feature.get('str') + str(BoundarySet.objects.filter(slug='polygons').count()))\n"
+                )
+            with transaction.atomic(), LogCapture():
+                call_command('loadshapefiles', data_dir=tmpdir, workers=2)
+                # The processes query the database with their own connections, which don't see the uncommitted set.
+                self.assertEqual(sorted(Boundary.objects.filter(set='polygons').values_list('name', flat=True)), ['10', '20', '30'])
+        self.assertEqual(Boundary.objects.filter(set='polygons').count(), 3)
+
+    def test_jobs_deduplicate_shapes(self):
+        app_settings.DEDUPLICATE_SHAPES, _ = True, app_settings.DEDUPLICATE_SHAPES
+
+        # Both boundary sets reuse the other's stored shapes, which the reload dereferences.
+        for reload in (False, True):
+            with TemporaryDirectory() as tmpdir, LogCapture():
+                self.load(tmpdir, [('Polygons A', "boundaries.attr('str')"), ('Polygons B', "boundaries.attr('str')")], reload=reload)
+            self.assertEqual(StoredShape.objects.count(), 3)
+            self.assertEqual(Boundary.objects.filter(stored_shape__isnull=False).count(), 6)
+
+        app_settings.DEDUPLICATE_SHAPES = _
+
+
 class LoadableTestCase(TestCase):
 
     def test_whitelist(self):
@@ -131,6 +713,11 @@ class LoadableTestCase(TestCase):
         BoundarySet.objects.create(name='Foo', last_updated=date(2010, 1, 1))
         self.assertFalse(Command().loadable('foo', date(2000, 1, 1)))
 
+    def test_fingerprint(self):
+        BoundarySet.objects.create(name='Foo', last_updated=date(2010, 1, 1), fingerprint='abc')
+        self.assertFalse(Command().loadable('foo', date(2020, 1, 1), fingerprint=lambda: 'abc'))
+        self.assertTrue(Command().loadable('foo', date(2000, 1, 1), fingerprint=lambda: 'def'))
+
     def test_nonexisting(self):
         self.assertTrue(Command().loadable('foo', date(2000, 1, 1)))
         BoundarySet.objects.create(name='Foo', last_updated=date(2010, 1, 1))
@@ -204,6 +791,210 @@ class LoadBoundaryTestCase(BoundariesTestCase):
         self.assertEqual(boundary.extent, (0.0, 0.0001, 5.0, 5.0))
 
 
+class FeatureGroupTestCase(TestCase):
+
+    def setUp(self):
+        definition = LoadBoundaryTestCase.definition
+        boundary_set = LoadBoundaryTestCase.boundary_set
+        self.group = FeatureGroup(Feature(FeatureProxy({}), definition, boundary_set=boundary_set))
+        geometry = OGRGeometry('MULTIPOLYGON (((0 0,5 0,5 5,0 0)))')
+        self.other = Feature(DetachedFeature({}, bytes(geometry.wkb)), definition, boundary_set=boundary_set)
+
+    def test_one_feature(self):
+        boundary = self.group.build_boundary('invalid')
+        self.assertEqual(boundary.shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0.0001 0.0001,0 5,5 5,0 0)))')
+        self.assertEqual(boundary.simple_shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+
+    def test_invalid_merge_strategy(self):
+        self.group.add(self.other)
+        self.assertRaisesRegex(ValueError, r"\AThe merge strategy 'invalid' must be 'combine' or 'union'.\Z", self.group.build_boundary, 'invalid')
+
+    def test_combine_merge_strategy(self):
+        self.group.add(self.other)
+        boundary = self.group.build_boundary('combine')
+        self.assertEqual(boundary.shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0.0001 0.0001,0 5,5 5,0 0)),((0 0,5 0,5 5,0 0)))')
+        self.assertEqual(boundary.simple_shape.ogr.wkt, 'MULTIPOLYGON (((0 0,0 5,5 5,0 0)),((0 0,5 0,5 5,0 0)))')
+        self.assertEqual(boundary.name, 'Test')
+        self.assertEqual(boundary.extent, (0.0, 0.0, 5.0, 5.0))
+
+    def test_union_merge_strategy(self):
+        self.group.add(self.other)
+        boundary = self.group.build_boundary('union')
+        expected = OGRGeometry('MULTIPOLYGON (((0 0,0 5,5 5,5 0,0 0)))')
+        self.assertEqual(boundary.shape.ogr.difference(expected).wkt, 'POLYGON EMPTY')
+        self.assertEqual(boundary.simple_shape.ogr.difference(expected).wkt, 'POLYGON EMPTY')
+        self.assertEqual(boundary.shape.ogr.geom_count, 1)
+        self.assertEqual(boundary.extent, (0.0, 0.0, 5.0, 5.0))
+
+
+class ProfilerTestCase(TestCase):
+
+    def test_disabled(self):
+        profiler = Profiler()
+        with profiler.boundary_set('foo'), profiler.phase('read'):
+            profiler.count(features=1)
+        self.assertEqual(list(profiler.iterate([1, 2], 'read')), [1, 2])
+        self.assertIs(profiler.instrument(LoadBoundaryTestCase.definition), LoadBoundaryTestCase.definition)
+        self.assertEqual(profiler.sets, [])
+
+    def test_enabled(self):
+        profiler = Profiler(enabled=True)
+        definition = profiler.instrument(LoadBoundaryTestCase.definition)
+        with profiler.boundary_set('foo'):
+            with profiler.data_source('foo.shp'):
+                for item in profiler.iterate([1, 2], 'read'):
+                    profiler.count(features=1, vertices=4)
+                    with profiler.phase('build'):
+                        self.assertEqual(definition['name_func'](None), 'Test')
+            with profiler.phase('write'):
+                pass
+
+        report = profiler.sets[0]
+        self.assertEqual(report['slug'], 'foo')
+        self.assertEqual(report['features'], 2)
+        self.assertEqual(report['vertices'], 8)
+        self.assertEqual(set(report['phases']), {'read', 'build', 'callbacks', 'write'})
+        self.assertEqual(report['data_sources'][0]['name'], 'foo.shp')
+        self.assertEqual(set(report['data_sources'][0]['phases']), {'read', 'build', 'callbacks'})
+        self.assertGreaterEqual(report['wall'], sum(phase['wall'] for phase in report['phases'].values()))
+        if report['peak_rss'] is not None:
+            self.assertGreater(report['peak_rss'], 0)
+
+
+class CopyWriterTestCase(TestCase):
+
+    def test_encode(self):
+        geometry = GEOSGeometry('MULTIPOLYGON(((0 0,0 5,5 5,0 0)))')
+        boundary = Boundary(set_id='inc', slug='foo', name='Foo', shape=geometry, simple_shape=geometry)
+        data = CopyWriter(1).encode([boundary])
+        self.assertEqual(data[:19], b'PGCOPY\n\xff\r\n\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(data[19:21], struct.pack('!h', len(Boundary._meta.concrete_fields) - 1))  # excluding the primary key
+        self.assertIn(bytes(geometry.ewkb), data)
+        self.assertEqual(data[-2:], b'\xff\xff')
+
+    def test_encode_copy_value(self):
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('set'), 'inc'), b'inc')
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('start_date'), date(2000, 1, 2)), b'\x00\x00\x00\x01')
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('metadata'), {'date': date(2000, 1, 1)}), b'\x01{"date": "2000-01-01"}')
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('simple_shape_tolerance'), 0.5), b'?\xe0\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('simple_shape_vertices'), 4), b'\x00\x00\x00\x04')
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('centroid'), None), None)
+        self.assertEqual(encode_copy_value(Boundary._meta.get_field('centroid'), Point(0, 1)), bytes(Point(0, 1, srid=4326).ewkb))
+
+
+class DetachedFeatureTestCase(TestCase):
+
+    def test_feature(self):
+        geometry = OGRGeometry('MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+        feature = DetachedFeature({'Name': 'Foo', 'ID': 1}, bytes(geometry.wkb))
+        self.assertEqual(feature.fields, ['Name', 'ID'])
+        self.assertEqual(feature.get('Name'), 'Foo')
+        self.assertEqual(feature.geom.wkt, geometry.wkt)
+        self.assertEqual(Feature(feature, LoadBoundaryTestCase.definition).metadata, {'Name': 'Foo', 'ID': 1})
+
+
+class FilterLayerTestCase(TestCase):
+
+    def setUp(self):
+        self.layer = DataSource('boundaries/tests/definitions/polygons/test_poly.shp')[0]
+
+    def test_no_filters(self):
+        filter_layer(self.layer, Definition({'name': 'Polygons', 'name_func': boundaries.attr('str')}), self.layer.srs)
+        self.assertEqual([feature.get('str') for feature in self.layer], ['1', '2', '3'])
+
+    def test_attribute_filter(self):
+        filter_layer(self.layer, {'attribute_filter': 'int > 1'}, self.layer.srs)
+        self.assertEqual([feature.get('str') for feature in self.layer], ['2', '3'])
+
+    def test_invalid_attribute_filter(self):
+        self.assertRaisesRegex(ValueError, r"\AThe attribute filter 'int >' is not a valid SQL WHERE expression\.\Z", filter_layer, self.layer, {'attribute_filter': 'int >'}, self.layer.srs)
+
+    def test_spatial_filter(self):
+        filter_layer(self.layer, {'spatial_filter': (-1.1, -0.6, -0.5, 0.9)}, self.layer.srs)
+        self.assertEqual([feature.get('str') for feature in self.layer], ['1', '3'])
+
+    def test_spatial_filter_transformed(self):
+        filter_layer(self.layer, {'spatial_filter': (-1.1, -0.6, -0.5, 0.9)}, SpatialReference(3857))
+        lower_left = OGRGeometry('POINT (-1.1 -0.6)', 4326).transform(3857, clone=True)
+        upper_right = OGRGeometry('POINT (-0.5 0.9)', 4326).transform(3857, clone=True)
+        for actual, expected in zip(self.layer.spatial_filter.extent, (lower_left.x, lower_left.y, upper_right.x, upper_right.y)):
+            self.assertAlmostEqual(actual, expected, places=3)
+
+
+class FingerprintTestCase(TestCase):
+
+    def test_fingerprint(self):
+        definition = {'file': fixture('flat.zip')}
+        with open(fixture('flat.zip'), 'rb') as f:
+            expected = hashlib.sha256(b'flat.zip' + f.read()).hexdigest()
+        self.assertEqual(fingerprint(definition), expected)
+        self.assertEqual(definition['fingerprint'], expected)
+
+    def test_definition_file(self):
+        definition = {'file': fixture('flat.zip'), 'definition_file': fixture('foo_definition.py')}
+        self.assertNotEqual(fingerprint(definition), fingerprint({'file': fixture('flat.zip')}))
+
+    def test_shapefile(self):
+        with TemporaryDirectory() as tmpdir:
+            for extension in ('dbf', 'prj', 'shp', 'shx'):
+                shutil.copy(fixture(f'foo.{extension}'), tmpdir)
+            path = os.path.join(tmpdir, 'foo.shp')
+            expected = fingerprint({'file': path})
+
+            with open(os.path.join(tmpdir, 'foo.dbf'), 'ab') as f:
+                f.write(b' ')
+            self.assertNotEqual(fingerprint({'file': path}), expected)
+
+    def test_source_files_shapefile(self):
+        path = fixture('foo.shp')
+        self.assertEqual(source_files(path), [
+            fixture('foo.dbf'),
+            fixture('foo.prj'),
+            fixture('foo.shp'),
+            fixture('foo.shx'),
+        ])
+
+    def test_source_files(self):
+        path = fixture('nested')
+        self.assertEqual(source_files(path), [
+            os.path.join(path, 'dir.zip', 'foo.dbf'),
+            os.path.join(path, 'dir.zip', 'foo.prj'),
+            os.path.join(path, 'dir.zip', 'foo.shp'),
+            os.path.join(path, 'dir.zip', 'foo.shx'),
+        ])
+
+
+class CheckpointKeyTestCase(TestCase):
+
+    def test_zip(self):
+        data_sources, tmpdirs = create_data_sources(fixture('flat.zip'))
+        try:
+            self.assertEqual(checkpoint_key(0, data_sources[0], tmpdirs, fixture('flat.zip')), '0:foo.shp')
+        finally:
+            for tmpdir in tmpdirs:
+                shutil.rmtree(tmpdir)
+
+    def test_directory(self):
+        data_sources, tmpdirs = create_data_sources(fixture('multiple'))
+        try:
+            self.assertEqual(
+                [checkpoint_key(index, data_source, tmpdirs, fixture('multiple')) for index, data_source in enumerate(data_sources)],
+                ['0:bar.shp', '1:foo.shp', '2:foo.shp', '3:dir.zip/foo.shp', '4:dir.zip/foo.shp'],
+            )
+        finally:
+            for tmpdir in tmpdirs:
+                shutil.rmtree(tmpdir)
+
+
+class SourceSizeTestCase(TestCase):
+
+    def test_file(self):
+        self.assertEqual(source_size(fixture('flat.zip')), os.path.getsize(fixture('flat.zip')))
+
+    def test_directory(self):
+        self.assertEqual(source_size(fixture('empty')), os.path.getsize(fixture('empty/empty.txt')) + os.path.getsize(fixture('empty/empty.zip')))
+
+
 class DataSourcesTestCase(TestCase):
 
     def test_empty_txt(self):
@@ -217,6 +1008,16 @@ class DataSourcesTestCase(TestCase):
         self.assertEqual(data_sources[0].name, path)
         self.assertEqual(data_sources[0].layer_count, 1)
 
+    def test_convert_3d_to_2d(self):
+        path = fixture('foo.shp')
+        with self.assertWarnsRegex(DeprecationWarning, r'\AThe convert_3d_to_2d argument of create_data_sources is deprecated and ignored\.\Z'):
+            data_sources, tmpdirs = create_data_sources(path, 'ascii', True)
+        self.assertEqual(len(data_sources), 1)
+        self.assertEqual(data_sources[0].name, path)
+
+    def test_vsizip_keyword_only(self):
+        self.assertRaises(TypeError, create_data_sources, fixture('flat.zip'), 'ascii', None, None, True)
+
     def test_flat_zip(self):
         path = fixture('flat.zip')  # foo.shp, etc.
         data_sources, tmpdirs = create_data_sources(path)
@@ -225,6 +1026,18 @@ class DataSourcesTestCase(TestCase):
         self.assertEqual(data_sources[0].name, os.path.join(tmpdirs[0], 'foo.shp'))
         self.assertEqual(data_sources[0].layer_count, 1)
 
+    def test_flat_zip_vsizip(self):
+        path = fixture('flat.zip')  # foo.shp, etc.
+        data_sources, tmpdirs = create_data_sources(path, vsizip=True)
+        self.assertEqual(len(data_sources), 1)
+        self.assertEqual(tmpdirs, [])
+        self.assertEqual(data_sources[0].name, '/vsizip/{%s}/foo.shp' % path)
+        self.assertEqual(data_sources[0].zipfile, path)
+        self.assertEqual(data_sources[0].layer_count, 1)
+
+    def test_bad_zip_vsizip(self):
+        self.assertRaisesRegex(BadZipfile, r"\AFile is not a zip file\Z", create_data_sources, fixture('bad.zip'), vsizip=True)
+
     def test_bad_zip(self):
         self.assertRaisesRegex(BadZipfile, r"\AFile is not a zip file\Z", create_data_sources, fixture('bad.zip'))
 
@@ -291,6 +1104,21 @@ class DataSourcesTestCase(TestCase):
             if hasattr(data_source, 'zipfile'):
                 self.assertIn(data_source.zipfile, zipfiles)
 
+    def test_multiple_zip_vsizip(self):
+        path = fixture('multiple.zip')
+        data_sources, tmpdirs = create_data_sources(path, vsizip=True)
+        self.assertEqual(tmpdirs, [])
+
+        self.assertEqual([(data_source.name, data_source.zipfile) for data_source in data_sources], [
+            ('/vsizip/{%s}/bar.shp' % path, path),
+            ('/vsizip/{%s}/dir.zip/foo.shp' % path, path),
+            ('/vsizip/{/vsizip/{%s}/flat.zip}/foo.shp' % path, '/vsizip/{%s}/flat.zip' % path),
+            ('/vsizip/{%s}/foo.shp' % path, path),
+            ('/vsizip/{/vsizip/{%s}/nested.zip}/dir.zip/foo.shp' % path, '/vsizip/{%s}/nested.zip' % path),
+        ])
+        for data_source in data_sources:
+            self.assertEqual(data_source.layer_count, 1)
+
     def test_nested(self):
         path = fixture('nested')
         data_sources, tmpdirs = create_data_sources(path)
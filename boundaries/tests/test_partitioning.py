@@ -0,0 +1,12 @@
+from django.test import TestCase
+
+from boundaries.partitioning import partition_name
+
+
+class PartitioningTestCase(TestCase):
+    maxDiff = None
+
+    def test_partition_name(self):
+        self.assertEqual(partition_name('federal-electoral-districts'), 'boundaries_boundary_federal_electoral_districts_%s' % partition_name('federal-electoral-districts')[-8:])
+        self.assertNotEqual(partition_name('foo-bar'), partition_name('foo_bar'))
+        self.assertLessEqual(len(partition_name('x' * 100) + '_new'), 63)
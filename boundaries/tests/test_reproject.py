@@ -0,0 +1,75 @@
+from unittest import skipUnless
+
+from django.contrib.gis.gdal import OGRGeometry, SpatialReference
+from django.test import TestCase
+
+from boundaries import reproject
+from boundaries.models import Geometry
+from boundaries.reproject import coordinate_arrays, transform_features, transform_geometries
+from boundaries.tests import FeatureProxy
+
+
+class GeometryProxy:
+    def __init__(self, wkt):
+        self.geom = OGRGeometry(wkt)
+
+
+@skipUnless(reproject.available(), 'NumPy is not installed')
+class ReprojectTestCase(TestCase):
+    maxDiff = None
+
+    def assertGeometryAlmostEqual(self, actual, expected):
+        self.assertEqual(actual.geom_name, expected.geom_name)
+        self.assertEqual(len(actual.coords), len(expected.coords))
+        for a, b in zip(actual.tuple, expected.tuple):
+            for ring_a, ring_b in zip(a, b):
+                for point_a, point_b in zip(ring_a, ring_b):
+                    self.assertAlmostEqual(point_a[0], point_b[0], places=9)
+                    self.assertAlmostEqual(point_a[1], point_b[1], places=9)
+
+    def test_coordinate_arrays(self):
+        buffer = bytearray(OGRGeometry('MULTIPOLYGON (((0 0,0 5,5 5,0 0)),((5 0,5 3,2 0,5 0),(4 1,4 2,3 1,4 1)))').wkb)
+        arrays = coordinate_arrays(buffer)
+        self.assertEqual([array.tolist() for array in arrays], [
+            [[0, 0], [0, 5], [5, 5], [0, 0]],
+            [[5, 0], [5, 3], [2, 0], [5, 0]],
+            [[4, 1], [4, 2], [3, 1], [4, 1]],
+        ])
+
+        arrays[0][1] = [1, 6]
+        self.assertEqual(OGRGeometry(memoryview(buffer)).wkt, 'MULTIPOLYGON (((0 0,1 6,5 5,0 0)),((5 0,5 3,2 0,5 0),(4 1,4 2,3 1,4 1)))')
+
+    def test_coordinate_arrays_unsupported(self):
+        self.assertIsNone(coordinate_arrays(bytearray(OGRGeometry('POINT (0 0)').wkb)))
+        self.assertIsNone(coordinate_arrays(bytearray(OGRGeometry('POLYGON Z ((0 0 1,0 5 1,5 5 1,0 0 1))').wkb)))
+
+    def test_transform_geometries(self):
+        srs = SpatialReference(26917)
+        geometries = [
+            OGRGeometry('MULTIPOLYGON (((0 0,0 5,5 5,0 0)))'),
+            OGRGeometry('POLYGON Z ((0 0 1,0 5 1,5 5 1,0 0 1))'),
+            OGRGeometry('MULTIPOLYGON (((500000 5000000,500000 5000100,500100 5000100,500000 5000000)))'),
+        ]
+        results = transform_geometries(geometries, srs)
+
+        self.assertIsNone(results[1])
+        for geometry, result in zip(geometries[::2], results[::2]):
+            self.assertEqual(result.srid, 4326)
+            self.assertGeometryAlmostEqual(result, Geometry(geometry).transform(srs).geometry)
+
+    def test_transform_features(self):
+        srs = SpatialReference(26917)
+        features = [
+            FeatureProxy({}),
+            GeometryProxy('POLYGON Z ((0 0 1,0 5 1,5 5 1,0 0 1))'),
+            GeometryProxy('GEOMETRYCOLLECTION (POLYGON ((0 0,0 5,5 5,0 0)))'),
+        ]
+        geometries = transform_features(features, srs, clean=True)
+
+        for feature, geometry in zip(features, geometries):
+            self.assertIsInstance(geometry, Geometry)
+            self.assertEqual(geometry.geometry.geom_name, 'MULTIPOLYGON')
+            self.assertGeometryAlmostEqual(geometry.geometry, Geometry(feature.geom).transform(srs, clean=True).geometry)
+
+    def test_transform_features_nonpolygon(self):
+        self.assertRaisesRegex(ValueError, r'\AThe geometry is a Point but must be a Polygon or a MultiPolygon\.\Z', transform_features, [GeometryProxy('POINT (0 0)')], SpatialReference(26917))
@@ -0,0 +1,16 @@
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import TestCase
+
+from boundaries.storage import shape_hash
+
+
+class StorageTestCase(TestCase):
+
+    def test_shape_hash(self):
+        shape = GEOSGeometry('MULTIPOLYGON (((0 0,0 5,5 5,0 0)))')
+        self.assertRegex(shape_hash(shape), r'\A[0-9a-f]{64}\Z')
+        # The hash is of the normalized shape.
+        self.assertEqual(shape_hash(GEOSGeometry('MULTIPOLYGON (((0 5,5 5,0 0,0 5)))')), shape_hash(shape))
+        self.assertNotEqual(shape_hash(GEOSGeometry('MULTIPOLYGON (((0 0,0 5,5 0,0 0)))')), shape_hash(shape))
+        # The shape isn't modified.
+        self.assertEqual(shape.wkt, 'MULTIPOLYGON (((0 0, 0 5, 5 5, 0 0)))')
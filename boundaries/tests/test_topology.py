@@ -0,0 +1,29 @@
+from unittest import skipUnless
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import TestCase
+
+from boundaries import topology
+from boundaries.topology import simplify_coverage
+
+
+@skipUnless(topology.available(), 'GEOS 3.12 or later is not installed')
+class TopologyTestCase(TestCase):
+    maxDiff = None
+
+    def test_simplify_coverage(self):
+        geometries = [
+            GEOSGeometry('MULTIPOLYGON (((0 0,0 1,0.5 1.01,1 1,1 0,0 0)))', srid=4326),
+            GEOSGeometry('POLYGON ((0 1,0.5 1.01,1 1,1 2,0 2,0 1))', srid=4326),
+        ]
+        simplified = simplify_coverage(geometries, 0.2)
+
+        self.assertEqual([geometry.geom_type for geometry in simplified], ['MultiPolygon', 'MultiPolygon'])
+        self.assertEqual([geometry.srid for geometry in simplified], [4326, 4326])
+        self.assertTrue(simplified[0].equals(GEOSGeometry('MULTIPOLYGON (((0 0,0 1,1 1,1 0,0 0)))')))
+        self.assertTrue(simplified[1].equals(GEOSGeometry('MULTIPOLYGON (((0 1,1 1,1 2,0 2,0 1)))')))
+        # The shared edge is simplified the same way for both geometries.
+        self.assertEqual(simplified[0].intersection(simplified[1]).geom_type, 'LineString')
+
+    def test_simplify_coverage_empty(self):
+        self.assertEqual(simplify_coverage([], 0.2), [])
@@ -0,0 +1,70 @@
+"""
+Simplifies the shapes of a boundary set's boundaries together, as a coverage.
+
+Instead of simplifying each shape on its own, GEOS extracts the edges that
+neighbouring shapes share and simplifies each edge once, the same way for both
+shapes, so that the simplified shapes have no gaps or overlaps where they meet.
+Requires GEOS 3.12 or later; otherwise, `available()` returns False.
+"""
+from ctypes import c_double, c_int
+
+from django.contrib.gis.geos import GeometryCollection, GEOSGeometry, MultiPolygon
+from django.contrib.gis.geos.libgeos import GEOM_PTR, geos_version_tuple
+from django.contrib.gis.geos.prototypes.geom import GeomOutput
+
+from boundaries import storage
+from boundaries.models import Boundary, app_settings
+
+coverage_simplify = GeomOutput('GEOSCoverageSimplifyVW', argtypes=[GEOM_PTR, c_double, c_int])
+
+
+def available():
+    return geos_version_tuple() >= (3, 12)
+
+
+def simplify_coverage(geometries, tolerance):
+    """
+    Simplifies the Polygons and MultiPolygons as a coverage, and returns the
+    simplified geometries as MultiPolygons, in the same order.
+    """
+    if not geometries:
+        return []
+    collection = GeometryCollection(*geometries, srid=geometries[0].srid)
+    result = GEOSGeometry(coverage_simplify(collection.ptr, tolerance, 0), srid=collection.srid)
+    return [
+        geometry if geometry.geom_type == 'MultiPolygon' else MultiPolygon(geometry, srid=geometry.srid)
+        for geometry in result
+    ]
+
+
+def simplify_boundary_set(boundary_set, model=Boundary, batch_size=1000):
+    """
+    Replaces the simplified shapes of the boundary set's boundaries with the
+    simplification of their shapes as a coverage, and returns the number of
+    boundaries. The model can be StagedBoundary, to simplify staged boundaries.
+    Shapes that were moved out of the boundaries table are read from there.
+    """
+    fields = ['pk', 'shape']
+    # With --incremental, the boundaries that weren't reloaded had their shapes moved out of the boundaries table.
+    if model is Boundary and storage.is_enabled():
+        fields.append(Boundary.get_shape_field())
+
+    pks, shapes = [], []
+    for pk, shape, *moved in model.objects.filter(set=boundary_set).values_list(*fields).iterator():
+        pks.append(pk)
+        shapes.append(moved[0] if shape.empty and moved and moved[0] else shape)
+
+    tolerance = app_settings.SIMPLE_SHAPE_TOLERANCE
+    boundaries = [
+        model(
+            pk=pk,
+            simple_shape=simple_shape,
+            simple_shape_tolerance=tolerance,
+            simple_shape_vertices=simple_shape.num_coords,
+        )
+        for pk, simple_shape in zip(pks, simplify_coverage(shapes, tolerance))
+    ]
+    model.objects.bulk_update(
+        boundaries, ['simple_shape', 'simple_shape_tolerance', 'simple_shape_vertices'], batch_size=batch_size
+    )
+    return len(boundaries)
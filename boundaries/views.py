@@ -1,9 +1,11 @@
 from django.contrib.gis.db import models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.http import Http404
 from django.utils.translation import gettext as _
 
 from boundaries.base_views import BadRequest, ModelDetailView, ModelGeoDetailView, ModelGeoListView, ModelListView
-from boundaries.models import Boundary, BoundarySet, app_settings
+from boundaries.models import Boundary, BoundarySet, SimplifiedShape, app_settings
 
 
 class BoundarySetListView(ModelListView):
@@ -28,38 +30,77 @@ class BoundarySetDetailView(ModelDetailView):
             raise Http404
 
 
-class BoundaryListView(ModelGeoListView):
+class BoundaryShapeMixin:
+
+    """
+    Serves the simple_shape at the simplification that best fits the
+    "resolution" parameter (in degrees per pixel), if provided, and the shape
+    from StoredShape or BoundaryGeometry if DEDUPLICATE_SHAPES or SEPARATE_SHAPES
+    is set.
+    """
+
+    def get_geo_field(self, request, qs, field):
+        if field == 'shape' and Boundary.get_shape_field() != 'shape':
+            return qs.only(self.name_field).annotate(separate_shape=F(Boundary.get_shape_field())), 'separate_shape'
+        if field != 'simple_shape' or 'resolution' not in request.GET:
+            return super().get_geo_field(request, qs, field)
+
+        try:
+            tolerance = SimplifiedShape.get_tolerance(float(request.GET['resolution']))
+        except ValueError:
+            raise BadRequest(_("Invalid value for resolution"))
+
+        if tolerance == 0:
+            return self.get_geo_field(request, qs, 'shape')
+        if tolerance == app_settings.SIMPLE_SHAPE_TOLERANCE:
+            return super().get_geo_field(request, qs, field)
+
+        # Fall back to the simple_shape if the boundary wasn't simplified at this tolerance.
+        shapes = SimplifiedShape.objects.filter(boundary=OuterRef('pk'), tolerance=tolerance).values('shape')[:1]
+        qs = qs.only(self.name_field).annotate(
+            resolution_shape=Coalesce(Subquery(shapes), 'simple_shape', output_field=models.MultiPolygonField())
+        )
+        return qs, 'resolution_shape'
+
+
+class BoundaryListView(BoundaryShapeMixin, ModelGeoListView):
 
     """ e.g. /boundary/federal-electoral-districts/
     or /boundary/federal-electoral-districts/centroid """
 
     filterable_fields = ['external_id', 'name']
     allowed_geo_fields = ('shape', 'simple_shape', 'centroid')
-    default_geo_filter_field = 'shape'
     model = Boundary
 
+    @property
+    def default_geo_filter_field(self):
+        return Boundary.get_shape_field()
+
     def filter(self, request, qs):
         qs = super().filter(request, qs)
+        shape_field = Boundary.get_shape_field()
 
         if 'intersects' in request.GET:
             try:
                 (set_slug, slug) = request.GET['intersects'].split('/')
-                shape = Boundary.objects.filter(slug=slug, set=set_slug).values_list('shape', flat=True)[0]
+                shape = Boundary.objects.filter(slug=slug, set=set_slug).values_list(shape_field, flat=True)[0]
             except IndexError:
                 raise Http404
             except ValueError:
                 raise BadRequest(_("Invalid value for intersects filter"))
-            qs = qs.filter(models.Q(shape__covers=shape) | models.Q(shape__overlaps=shape))
+            qs = qs.filter(
+                models.Q(**{shape_field + '__covers': shape}) | models.Q(**{shape_field + '__overlaps': shape})
+            )
 
         if 'touches' in request.GET:
             try:
                 (set_slug, slug) = request.GET['touches'].split('/')
-                shape = Boundary.objects.filter(slug=slug, set=set_slug).values_list('shape', flat=True)[0]
+                shape = Boundary.objects.filter(slug=slug, set=set_slug).values_list(shape_field, flat=True)[0]
             except IndexError:
                 raise Http404
             except ValueError:
                 raise BadRequest(_("Invalid value for touches filter"))
-            qs = qs.filter(shape__touches=shape)
+            qs = qs.filter(**{shape_field + '__touches': shape})
 
         if 'sets' in request.GET:
             set_slugs = request.GET['sets'].split(',')
@@ -112,7 +153,7 @@ class BoundaryDetailView(ModelDetailView, BoundaryObjectGetterMixin):
         self.base_qs = self.base_qs.defer('shape', 'simple_shape')
 
 
-class BoundaryGeoDetailView(ModelGeoDetailView, BoundaryObjectGetterMixin):
+class BoundaryGeoDetailView(BoundaryShapeMixin, ModelGeoDetailView, BoundaryObjectGetterMixin):
 
     """ e.g /boundary/federal-electoral-districts/outremont/shape """
 
@@ -16,6 +16,31 @@ boundaries.register(
     # (Optional) Override the Spatial Reference System Identifier (SRID) of
     # the shapefile.
     srid=4269,
+    # (Optional) A SQL WHERE expression with which to filter the shapefile's
+    # features before they are read, e.g. "PROVCODE = 'ON'". Unlike with
+    # `is_valid_func`, the geometries of filtered features are never read.
+    attribute_filter=None,
+    # (Optional) A bounding box in EPSG:4326, as (xmin, ymin, xmax, ymax), with
+    # which to filter the shapefile's features before they are read, e.g.
+    # (-79.64, 43.58, -79.11, 43.86). Features whose bounding boxes don't
+    # intersect it are skipped.
+    spatial_filter=None,
+    # (Optional) Whether the boundaries share edges without overlapping, in
+    # which case their simplified shapes are simplified together after loading,
+    # so that shared edges are simplified once and no gaps or slivers appear
+    # between neighbouring boundaries. Requires GEOS 3.12 or later.
+    coverage=False,
+    # (Optional) The number of vertices that each boundary's simplified shape
+    # should not exceed. If set, each boundary's shape is simplified with about
+    # the smallest tolerance that meets this budget, instead of with the
+    # SIMPLE_SHAPE_TOLERANCE setting. The tolerance and number of vertices are
+    # stored on each boundary. Can't be combined with `coverage`.
+    simple_shape_vertices=None,
+    # (Optional) The size of the grid, in degrees, to which the boundaries'
+    # shapes are snapped, e.g. 0.000001 (about 10 cm). Snapping drops digits
+    # and vertices that are insignificant at this scale. Defaults to the
+    # PRECISION setting.
+    precision=None,
 
 
     # The following Boundary Set fields will be made available via the API.